@@ -1,6 +1,15 @@
 #include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
 #include <omp.h>
 
+#ifndef _WIN32
+#include <fcntl.h>
+#include <sys/mman.h>
+#include <sys/stat.h>
+#include <unistd.h>
+#endif
+
 #include "draft_ai.h"
 
 
@@ -30,8 +39,42 @@ u64 zobrist_keys[3][MAX_NUM_HEROES];
 // terminal values in flex_negamax
 int root_selecting_team;
 
-// transposition table
-struct tt_entry tt[TT_IDX_BITS + 1];
+// set by run_search to every hero num in a synergy or counter reward
+// (lineups that only differ outside of these are compared by
+// prune_lineups)
+u64 combo_hero_nums;
+
+// set when the A and B reward values have been swapped so the teams
+// play the other sides of the draft. States are then hashed with
+// SWITCHED_SIDES_KEY so entries for both orientations share the TT.
+int sides_switched;
+
+// transposition table (points to tt_memory unless a saved table
+// file has been mapped into memory with map_tt_file). tt_memory is
+// only allocated once needed (see alloc_tt) and freed when cleared,
+// so a table that is never used or just cleared costs nothing.
+struct tt_entry *tt_memory = NULL;
+struct tt_entry *tt = NULL;
+
+// currently mapped table file (start of mapping is its header)
+void *tt_map;
+size_t tt_map_size;
+int tt_map_mode;
+
+// set when the table is mapped read only so search doesn't store
+int tt_read_only;
+
+// set (from another thread) to end a search early when its result is
+// no longer needed, e.g., a background search on a reply that wasn't
+// made. Values returned once set are meaningless so nothing is stored
+// in the transposition table until it is cleared.
+volatile int search_stopped;
+
+// lineups after each selection in the current thread's search (a
+// search at some stage only writes to the frame of its stage and the
+// next for a double selection, so those of its parents are kept)
+struct lineup_frame lineup_stack[MAX_DRAFT_LEN];
+#pragma omp threadprivate(lineup_stack)
 
 
 //
@@ -60,9 +103,12 @@ int negamax(
     u64 hash,
     int stage,
     int alpha,
-    int beta
+    int beta,
+    u64 *nodes        // incremented for every node visited
 )
 {
+    (*nodes)++;
+
     if (stage == draft_len)
         // since B has last pick in draft it is always
         // guaranteed that team is A and e_team is B
@@ -71,6 +117,10 @@ int negamax(
     int original_alpha = alpha;
 
     if (stage < MAX_TT_STAGE) {
+        // only checked at upper stages where it is cheap in comparison
+        if (search_stopped)
+            return 0;
+
         struct tt_entry tt_entry = tt[hash & TT_IDX_BITS];
 
         // check if state has already been evaluated
@@ -116,7 +166,8 @@ int negamax(
                     hash ^ zobrist_keys[draft[stage].team][h],
                     stage + 1,
                     -beta,
-                    -alpha
+                    -alpha,
+                    nodes
                 );
 
                 if (child_value > value)
@@ -146,7 +197,8 @@ int negamax(
                     hash ^ zobrist_keys[BAN_KEYS][h],
                     stage + 1,
                     -beta,
-                    -alpha
+                    -alpha,
+                    nodes
                 );
 
                 if (child_value > value)
@@ -186,7 +238,8 @@ int negamax(
                         new_hash ^ zobrist_keys[draft[stage].team][h2],
                         stage + 2,
                         -beta,
-                        -alpha
+                        -alpha,
+                        nodes
                     );
 
                     if (child_value > value)
@@ -227,7 +280,8 @@ int negamax(
                         new_hash ^ zobrist_keys[BAN_KEYS][h2],
                         stage + 2,
                         -beta,
-                        -alpha
+                        -alpha,
+                        nodes
                     );
 
                     if (child_value > value)
@@ -266,7 +320,8 @@ int negamax(
                         new_hash ^ zobrist_keys[draft[stage].team][h2],
                         stage + 2,
                         -beta,
-                        -alpha
+                        -alpha,
+                        nodes
                     );
 
                     if (child_value > value)
@@ -304,7 +359,8 @@ int negamax(
                         new_hash ^ zobrist_keys[BAN_KEYS][h2],
                         stage + 2,
                         -beta,
-                        -alpha
+                        -alpha,
+                        nodes
                     );
 
                     if (child_value > value)
@@ -323,7 +379,7 @@ int negamax(
 
 cutoff:
     
-    if (stage < MAX_TT_STAGE) {
+    if (stage < MAX_TT_STAGE && !search_stopped && !tt_read_only) {
         // pack state value, flag and tag into 64 bits (upper 46 bits of hash for tag,
         // 2 bits for flag and 16 bits for value) then store in transposition table
         if (value <= original_alpha)
@@ -375,6 +431,83 @@ int terminal_value(u64 team_A, u64 team_B)
 }
 
 
+//
+// Evaluate the synergy rewards a team gets from its own heroes.
+//
+int synergy_value(enum team team, u64 team_heroes)
+{
+    int value = 0;
+
+    for (int i = 0; i < num_synergy_rs; i++) {
+        u64 s_heroes = synergy_rs[i].heroes;
+
+        // if all synergy heroes are part of a team then
+        // the AND between the two will equal the original
+        if ((team_heroes & s_heroes) == s_heroes)
+            value += (team == A) ? synergy_rs[i].A_value : synergy_rs[i].B_value;
+    }
+
+    return value;
+}
+
+
+//
+// Evaluate the given counter rewards from team A's perspective.
+//
+int counter_value(int n, struct counter_r rs[], u64 team_A, u64 team_B)
+{
+    int value = 0;
+
+    for (int i = 0; i < n; i++) {
+        u64 c_heroes = rs[i].heroes;
+        u64 c_foes = rs[i].foes;
+
+        // same deal as synergies except reward is only
+        // granted if opposition also have specified heroes
+        if ((team_A & c_heroes) == c_heroes && (team_B & c_foes) == c_foes)
+            value += rs[i].A_value;
+        else if ((team_B & c_heroes) == c_heroes && (team_A & c_foes) == c_foes)
+            value -= rs[i].B_value;
+    }
+
+    return value;
+}
+
+
+//
+// Mix the bits of a hash (the splitmix64 finalizer) so that sums of
+// mixed hashes don't keep the linear structure of zobrist hashes.
+//
+static inline u64 mix_hash(u64 hash)
+{
+    hash = (hash ^ (hash >> 30)) * 0xBF58476D1CE4E5B9ULL;
+    hash = (hash ^ (hash >> 27)) * 0x94D049BB133111EBULL;
+    return hash ^ (hash >> 31);
+}
+
+
+//
+// Hash for the transposition table of a state where a team has multiple
+// lineups (see flex_negamax), which is defined by the set of lineups of
+// each team rather than a single pick of each hero. Lineups are summed
+// once mixed so the hash doesn't depend on their order (XOR alone would
+// cancel heroes shared by an even number of lineups). Terminal values
+// of these states depend on the team selecting at the root, so it is
+// also included.
+//
+u64 flex_hash(int num_teams, int num_e_teams, u64 hashes[], u64 e_hashes[], u64 bans_hash)
+{
+    u64 lineups_hash = 0;
+    for (int i = 0; i < num_teams; i++)
+        lineups_hash += mix_hash(hashes[i]);
+    for (int i = 0; i < num_e_teams; i++)
+        lineups_hash += mix_hash(e_hashes[i]);
+
+    u64 root_key = root_selecting_team == A ? FLEX_ROOT_A_KEY : FLEX_ROOT_B_KEY;
+    return bans_hash ^ mix_hash(lineups_hash ^ root_key);
+}
+
+
 //
 // To eliminate searching redundant states that contain teams
 // with more than one hero per role, all heroes who play a filled
@@ -410,9 +543,12 @@ int flex_negamax(
     u64 bans_hash,
     int stage,
     int alpha,
-    int beta
+    int beta,
+    u64 *nodes
 )
 {
+    (*nodes)++;
+
     if (num_e_teams == 1) {
         // if enemy can't swtich lineups then value is highest the
         // selecting team can achieve with one of its lineups vs it
@@ -428,7 +564,8 @@ int flex_negamax(
                 bans_hash ^ hashes[i] ^ e_hashes[0],    // final hash is XOR of all selections
                 stage,
                 alpha,
-                beta
+                beta,
+                nodes
             );
 
             if (team_value > value)
@@ -467,6 +604,35 @@ int flex_negamax(
         // without leaving themselves open to counter exploitation. Its
         // impossible for these values to contradict each other.
 
+        // role and synergy values only depend on a team's own lineup
+        // so are found once per lineup, leaving counters for each pair
+        int values[MAX_LINEUPS];
+        int e_values[MAX_LINEUPS];
+        u64 any_team = 0;
+        u64 any_e_team = 0;
+
+        for (int i = 0; i < num_teams; i++) {
+            values[i] = rr_values[i] + synergy_value(A, teams[i]);
+            any_team |= teams[i];
+        }
+        for (int i = 0; i < num_e_teams; i++) {
+            e_values[i] = e_rr_values[i] - synergy_value(B, e_teams[i]);
+            any_e_team |= e_teams[i];
+        }
+
+        // only counters that apply for at least one pair of lineups
+        struct counter_r leaf_counter_rs[MAX_COUNTER_RS];
+        int num_leaf_counter_rs = 0;
+
+        for (int i = 0; i < num_counter_rs; i++) {
+            u64 c_heroes = counter_rs[i].heroes;
+            u64 c_foes = counter_rs[i].foes;
+
+            if (((any_team & c_heroes) == c_heroes && (any_e_team & c_foes) == c_foes)
+                    || ((any_e_team & c_heroes) == c_heroes && (any_team & c_foes) == c_foes))
+                leaf_counter_rs[num_leaf_counter_rs++] = counter_rs[i];
+        }
+
         if (root_selecting_team == A) {
             // find the best (max) value A can get with a lineup where
             // each value is the best (min) value B can get in response
@@ -476,7 +642,8 @@ int flex_negamax(
                 int value_min = INF;
 
                 for (int j = 0; j < num_e_teams; j++) {
-                    int value = rr_values[i] + e_rr_values[j] + terminal_value(teams[i], e_teams[j]);
+                    int value = values[i] + e_values[j]
+                        + counter_value(num_leaf_counter_rs, leaf_counter_rs, teams[i], e_teams[j]);
 
                     if (value < value_min)
                         value_min = value;
@@ -500,7 +667,8 @@ int flex_negamax(
                 int value_max = -INF;
 
                 for (int j = 0; j < num_teams; j++) {
-                    int value = rr_values[j] + e_rr_values[i] + terminal_value(teams[j], e_teams[i]);
+                    int value = values[j] + e_values[i]
+                        + counter_value(num_leaf_counter_rs, leaf_counter_rs, teams[j], e_teams[i]);
 
                     if (value > value_max)
                         value_max = value;
@@ -520,14 +688,59 @@ int flex_negamax(
 
     // if there are multiple enemy lineups and its not a terminal 
     // state, then each legal hero is searched to get state value
+    // (unless already evaluated and stored in the transposition table)
+    int original_alpha = alpha;
+    u64 hash = 0;
+
+    if (stage < MAX_TT_STAGE) {
+        if (search_stopped)
+            return 0;
+
+        hash = flex_hash(num_teams, num_e_teams, hashes, e_hashes, bans_hash);
+        struct tt_entry tt_entry = tt[hash & TT_IDX_BITS];
+
+        if (tt_entry.tag == (hash >> 18)) {
+            int value = tt_entry.value;
+            switch (tt_entry.flag)  {
+                case EXACT:
+                    return value;
+
+                case LOWERBOUND:
+                    if (value > alpha)
+                        alpha = value;
+                    break;
+
+                case UPPERBOUND:
+                    if (value < beta)
+                        beta = value;
+                    break;
+            }
+
+            if (alpha >= beta)
+                return value;
+        }
+    }
+
+    // lineups after this stage's selection(s) go in this thread's frames
+    struct lineup_frame *frames = &lineup_stack[stage];
+
+    // heroes legal for any lineup of each team (any others can be
+    // skipped without updating every lineup)
+    u64 any_legals = any_lineup_legals(num_teams, legals);
+    u64 e_any_legals = any_lineup_legals(num_e_teams, e_legals);
+
     int value = -INF;
     switch (draft[stage].selection) {
         case PICK:
             for (int h = 0; h < num_heroes; h++) {
-                u64 teams_p[num_teams];
-                u64 legals_p[num_teams];
-                int rr_values_p[num_teams];
-                u64 hashes_p[num_teams];
+                // skip hero if not legal for any team lineup
+                if (!(any_legals & (1ULL << h)))
+                    continue;
+
+                u64 *teams_p = frames[0].teams;
+                u64 *legals_p = frames[0].legals;
+                int *rr_values_p = frames[0].rr_values;
+                u64 *hashes_p = frames[0].hashes;
                 int num_teams_p = hero_in_team_update(
                     h,
                     draft[stage].team,
@@ -542,12 +755,12 @@ int flex_negamax(
                     hashes_p
                 );
 
-                // skip hero if not legal for any team lineup
-                if (num_teams_p == 0)
-                    continue;
+                num_teams_p = prune_lineups(
+                    draft[stage].team, num_teams_p, teams_p, legals_p, rr_values_p, hashes_p
+                );
 
                 // must update all enemy legals as well if continuing
-                u64 e_legals_p[num_e_teams];
+                u64 *e_legals_p = frames[0].e_legals;
                 hero_out_of_team_update(h, num_e_teams, e_legals, e_legals_p);
 
                 int child_value = -flex_negamax(
@@ -564,7 +777,8 @@ int flex_negamax(
                     bans_hash,
                     stage + 1,
                     -beta,
-                    -alpha
+                    -alpha,
+                    nodes
                 );
 
                 if (child_value > value)
@@ -574,7 +788,7 @@ int flex_negamax(
                     alpha = value;
 
                 if (alpha >= beta)
-                    return value;
+                    goto cutoff;
             }
             break;
 
@@ -585,13 +799,13 @@ int flex_negamax(
                 // considered (not only those where it is legal) as its
                 // possible the enemy could do better using a lineup
                 // where the hero is illegal
-                if (!legal_for_any_lineup(h, num_e_teams, e_legals))
+                if (!(e_any_legals & (1ULL << h)))
                     continue;
 
                 // get updated legals for both teams after the ban
-                u64 legals_b[num_teams];
+                u64 *legals_b = frames[0].legals;
                 hero_out_of_team_update(h, num_teams, legals, legals_b);
-                u64 e_legals_b[num_e_teams];
+                u64 *e_legals_b = frames[0].e_legals;
                 hero_out_of_team_update(h, num_e_teams, e_legals, e_legals_b);
 
                 int child_value = -flex_negamax(
@@ -608,7 +822,8 @@ int flex_negamax(
                     bans_hash ^ zobrist_keys[BAN_KEYS][h],
                     stage + 1,
                     -beta,
-                    -alpha
+                    -alpha,
+                    nodes
                 );
 
                 if (child_value > value)
@@ -618,17 +833,20 @@ int flex_negamax(
                     alpha = value;
 
                 if (alpha >= beta)
-                    return value;
+                    goto cutoff;
             }
             break;
 
         case PICK_PICK:
             for (int h = 0; h < num_heroes; h++) {
+                if (!(any_legals & (1ULL << h)))
+                    continue;
+
                 // update lineups for first pick
-                u64 teams_p[num_teams];
-                u64 legals_p[num_teams];
-                int rr_values_p[num_teams];
-                u64 hashes_p[num_teams];
+                u64 *teams_p = frames[0].teams;
+                u64 *legals_p = frames[0].legals;
+                int *rr_values_p = frames[0].rr_values;
+                u64 *hashes_p = frames[0].hashes;
                 int num_teams_p = hero_in_team_update(
                     h,
                     draft[stage].team,
@@ -643,18 +861,23 @@ int flex_negamax(
                     hashes_p
                 );
 
-                if (num_teams_p == 0)
-                    continue;
+                num_teams_p = prune_lineups(
+                    draft[stage].team, num_teams_p, teams_p, legals_p, rr_values_p, hashes_p
+                );
 
-                u64 e_legals_p[num_e_teams];
+                u64 *e_legals_p = frames[0].e_legals;
                 hero_out_of_team_update(h, num_e_teams, e_legals, e_legals_p);
+                u64 any_legals_p = any_lineup_legals(num_teams_p, legals_p);
 
                 for (int h2 = h + 1; h2 < num_heroes; h2++) {
+                    if (!(any_legals_p & (1ULL << h2)))
+                        continue;
+
                     // update lineups for second pick
-                    u64 teams_pp[num_teams_p];
-                    u64 legals_pp[num_teams_p];
-                    int rr_values_pp[num_teams_p];
-                    u64 hashes_pp[num_teams_p];
+                    u64 *teams_pp = frames[1].teams;
+                    u64 *legals_pp = frames[1].legals;
+                    int *rr_values_pp = frames[1].rr_values;
+                    u64 *hashes_pp = frames[1].hashes;
                     int num_teams_pp = hero_in_team_update(
                         h2,
                         draft[stage].team,
@@ -669,10 +892,11 @@ int flex_negamax(
                         hashes_pp
                     );
 
-                    if (num_teams_pp == 0)
-                        continue;
+                    num_teams_pp = prune_lineups(
+                        draft[stage].team, num_teams_pp, teams_pp, legals_pp, rr_values_pp, hashes_pp
+                    );
 
-                    u64 e_legals_pp[num_e_teams];
+                    u64 *e_legals_pp = frames[1].e_legals;
                     hero_out_of_team_update(h2, num_e_teams, e_legals_p, e_legals_pp);
 
                     int child_value = -flex_negamax(
@@ -689,7 +913,8 @@ int flex_negamax(
                         bans_hash,
                         stage + 2,
                         -beta,
-                        -alpha
+                        -alpha,
+                        nodes
                     );
 
                     if (child_value > value)
@@ -699,18 +924,21 @@ int flex_negamax(
                         alpha = value;
 
                     if (alpha >= beta)
-                        return value;
+                        goto cutoff;
                 }
             }
             break;
 
         case PICK_BAN:
             for (int h = 0; h < num_heroes; h++) {
+                if (!(any_legals & (1ULL << h)))
+                    continue;
+
                 // update lineups for pick
-                u64 teams_p[num_teams];
-                u64 legals_p[num_teams];
-                int rr_values_p[num_teams];
-                u64 hashes_p[num_teams];
+                u64 *teams_p = frames[0].teams;
+                u64 *legals_p = frames[0].legals;
+                int *rr_values_p = frames[0].rr_values;
+                u64 *hashes_p = frames[0].hashes;
                 int num_teams_p = hero_in_team_update(
                     h,
                     draft[stage].team,
@@ -725,20 +953,22 @@ int flex_negamax(
                     hashes_p
                 );
 
-                if (num_teams_p == 0)
-                    continue;
+                num_teams_p = prune_lineups(
+                    draft[stage].team, num_teams_p, teams_p, legals_p, rr_values_p, hashes_p
+                );
 
-                u64 e_legals_p[num_e_teams];
+                u64 *e_legals_p = frames[0].e_legals;
                 hero_out_of_team_update(h, num_e_teams, e_legals, e_legals_p);
+                u64 e_any_legals_p = e_any_legals & h_infos[h].diff_h;
 
                 for (int h2 = 0; h2 < num_heroes; h2++) {
-                    if (!legal_for_any_lineup(h2, num_e_teams, e_legals_p))
+                    if (!(e_any_legals_p & (1ULL << h2)))
                         continue;
 
                     // update lineups for ban
-                    u64 legals_pb[num_teams_p];
+                    u64 *legals_pb = frames[1].legals;
                     hero_out_of_team_update(h2, num_teams_p, legals_p, legals_pb);
-                    u64 e_legals_pb[num_e_teams];
+                    u64 *e_legals_pb = frames[1].e_legals;
                     hero_out_of_team_update(h2, num_e_teams, e_legals_p, e_legals_pb);
 
                     int child_value = -flex_negamax(
@@ -755,7 +985,8 @@ int flex_negamax(
                         bans_hash ^ zobrist_keys[BAN_KEYS][h2],
                         stage + 2,
                         -beta,
-                        -alpha
+                        -alpha,
+                        nodes
                     );
 
                     if (child_value > value)
@@ -765,29 +996,33 @@ int flex_negamax(
                         alpha = value;
 
                     if (alpha >= beta)
-                        return value;
+                        goto cutoff;
                 }
             }
             break;
 
         case BAN_PICK:
             for (int h = 0; h < num_heroes; h++) {
-                if (!legal_for_any_lineup(h, num_e_teams, e_legals))
+                if (!(e_any_legals & (1ULL << h)))
                     continue;
 
                 // update lineups for ban
-                u64 legals_b[num_teams];
+                u64 *legals_b = frames[0].legals;
                 hero_out_of_team_update(h, num_teams, legals, legals_b);
-                u64 e_legals_b[num_e_teams];
+                u64 *e_legals_b = frames[0].e_legals;
                 hero_out_of_team_update(h, num_e_teams, e_legals, e_legals_b);
                 u64 bans_hash_b = bans_hash ^ zobrist_keys[BAN_KEYS][h];
+                u64 any_legals_b = any_legals & h_infos[h].diff_h;
 
                 for (int h2 = 0; h2 < num_heroes; h2++) {
+                    if (!(any_legals_b & (1ULL << h2)))
+                        continue;
+
                     // update lineups for pick
-                    u64 teams_bp[num_teams];
-                    u64 legals_bp[num_teams];
-                    int rr_values_bp[num_teams];
-                    u64 hashes_bp[num_teams];
+                    u64 *teams_bp = frames[1].teams;
+                    u64 *legals_bp = frames[1].legals;
+                    int *rr_values_bp = frames[1].rr_values;
+                    u64 *hashes_bp = frames[1].hashes;
                     int num_teams_bp = hero_in_team_update(
                         h2,
                         draft[stage].team,
@@ -802,10 +1037,11 @@ int flex_negamax(
                         hashes_bp
                     );
 
-                    if (num_teams_bp == 0)
-                        continue;
+                    num_teams_bp = prune_lineups(
+                        draft[stage].team, num_teams_bp, teams_bp, legals_bp, rr_values_bp, hashes_bp
+                    );
 
-                    u64 e_legals_bp[num_e_teams];
+                    u64 *e_legals_bp = frames[1].e_legals;
                     hero_out_of_team_update(h2, num_e_teams, e_legals_b, e_legals_bp);
 
                     int child_value = -flex_negamax(
@@ -822,7 +1058,8 @@ int flex_negamax(
                         bans_hash_b,
                         stage + 2,
                         -beta,
-                        -alpha
+                        -alpha,
+                        nodes
                     );
 
                     if (child_value > value)
@@ -832,31 +1069,32 @@ int flex_negamax(
                         alpha = value;
 
                     if (alpha >= beta)
-                        return value;
+                        goto cutoff;
                 }
             }
             break;
 
         case BAN_BAN:
             for (int h = 0; h < num_heroes; h++) {
-                if (!legal_for_any_lineup(h, num_e_teams, e_legals))
+                if (!(e_any_legals & (1ULL << h)))
                     continue;
 
                 // update lineups for first ban
-                u64 legals_b[num_teams];
+                u64 *legals_b = frames[0].legals;
                 hero_out_of_team_update(h, num_teams, legals, legals_b);
-                u64 e_legals_b[num_e_teams];
+                u64 *e_legals_b = frames[0].e_legals;
                 hero_out_of_team_update(h, num_e_teams, e_legals, e_legals_b);
                 u64 bans_hash_b = bans_hash ^ zobrist_keys[BAN_KEYS][h];
+                u64 e_any_legals_b = e_any_legals & h_infos[h].diff_h;
 
                 for (int h2 = h + 1; h2 < num_heroes; h2++) {
-                    if (!legal_for_any_lineup(h2, num_e_teams, e_legals_b))
+                    if (!(e_any_legals_b & (1ULL << h2)))
                         continue;
 
                     // update lineups for second ban
-                    u64 legals_bb[num_teams];
+                    u64 *legals_bb = frames[1].legals;
                     hero_out_of_team_update(h2, num_teams, legals_b, legals_bb);
-                    u64 e_legals_bb[num_e_teams];
+                    u64 *e_legals_bb = frames[1].e_legals;
                     hero_out_of_team_update(h2, num_e_teams, e_legals_b, e_legals_bb);
 
                     int child_value = -flex_negamax(
@@ -873,7 +1111,8 @@ int flex_negamax(
                         bans_hash_b ^ zobrist_keys[BAN_KEYS][h2],
                         stage + 2,
                         -beta,
-                        -alpha
+                        -alpha,
+                        nodes
                     );
 
                     if (child_value > value)
@@ -883,12 +1122,23 @@ int flex_negamax(
                         alpha = value;
 
                     if (alpha >= beta)
-                        return value;
+                        goto cutoff;
                 }
             }
             break;
     }
 
+cutoff:
+
+    if (stage < MAX_TT_STAGE && !search_stopped && !tt_read_only) {
+        if (value <= original_alpha)
+            tt[hash & TT_IDX_BITS] = (struct tt_entry) {(hash >> 18), UPPERBOUND, value};
+        else if (value >= beta)
+            tt[hash & TT_IDX_BITS] = (struct tt_entry) {(hash >> 18), LOWERBOUND, value};
+        else
+            tt[hash & TT_IDX_BITS] = (struct tt_entry) {(hash >> 18), EXACT, value};
+    }
+
     return value;
 }
 
@@ -931,17 +1181,20 @@ int hero_in_team_update(
 {
     int new_num_teams = 0;
     u64 hero = 1ULL << hero_num;
-
+    u64 legals_mask = h_infos[hero_num].diff_role_and_h;
+    int rr_value = selecting_team == A ? role_rs[hero_num].A_value : -role_rs[hero_num].B_value;
+    u64 key = zobrist_keys[selecting_team][hero_num];
+
+    // Every lineup is written to the next free position, which is only
+    // kept (moved past) if the hero is legal for it. This avoids a hard
+    // to predict branch per lineup. The arrays always have room as a
+    // lineup is only written to a position no greater than its own.
     for (int i = 0; i < num_teams; i++) {
-        if (legals[i] & hero) {
-            // only update state for a lineup where hero is legal
-            new_teams[new_num_teams] = teams[i] | hero;
-            new_legals[new_num_teams] = legals[i] & h_infos[hero_num].diff_role_and_h;
-            new_rr_values[new_num_teams] = rr_values[i] + (selecting_team == A ? role_rs[hero_num].A_value :
-                                                                                 -role_rs[hero_num].B_value);
-            new_hashes[new_num_teams] = hashes[i] ^ zobrist_keys[selecting_team][hero_num];
-            new_num_teams += 1;
-        }
+        new_teams[new_num_teams] = teams[i] | hero;
+        new_legals[new_num_teams] = legals[i] & legals_mask;
+        new_rr_values[new_num_teams] = rr_values[i] + rr_value;
+        new_hashes[new_num_teams] = hashes[i] ^ key;
+        new_num_teams += (legals[i] >> hero_num) & 1;
     }
 
     return new_num_teams;
@@ -954,26 +1207,111 @@ int hero_in_team_update(
 //
 void hero_out_of_team_update(int hero_num, int num_teams, u64 legals[], u64 new_legals[])
 {
+    u64 legals_mask = h_infos[hero_num].diff_h;
+
+    #pragma omp simd
     for (int i = 0; i < num_teams; i++) {
-        new_legals[i] = legals[i] & h_infos[hero_num].diff_h;
+        new_legals[i] = legals[i] & legals_mask;
     }
 }
 
 
 //
-// Checks if a given hero is legal in any of a team's
-// starting lineup legal actions.
+// Removes the lineups of a team that can never do better than one of
+// its other lineups, returning how many are left. A lineup is dominated
+// by another when they only differ in heroes' roles that aren't part of
+// any synergy or counter reward (so they gain the same combo rewards in
+// every future state), it has no legal heroes the other doesn't and its
+// role reward value is no better for the team. Any continuation of the
+// dominated lineup is then also a continuation of the other worth at
+// least as much, so removing it doesn't change any value (or the heroes
+// that are legal). Of equivalent lineups (same legals and role reward
+// value) only the first is kept.
 //
-int legal_for_any_lineup(int hero_num, int num_teams, u64 legals[])
+int prune_lineups(
+    enum team team,
+    int num_teams,
+    u64 teams[],
+    u64 legals[],
+    int rr_values[],
+    u64 hashes[]
+)
 {
-    u64 hero = 1ULL << hero_num;
+    // nothing can be removed if every hero num that differs between
+    // lineups is part of a combo reward (any two then differ in one)
+    u64 in_any = 0;
+    u64 in_all = ~0ULL;
+    #pragma omp simd reduction(|:in_any) reduction(&:in_all)
+    for (int i = 0; i < num_teams; i++) {
+        in_any |= teams[i];
+        in_all &= teams[i];
+    }
+    if (((in_any & ~in_all) & ~combo_hero_nums) == 0)
+        return num_teams;
+
+    // role reward values are from A's perspective
+    int sign = team == A ? 1 : -1;
+    int keep[MAX_LINEUPS];
+
+    for (int i = 0; i < num_teams; i++) {
+        keep[i] = 1;
+
+        for (int j = 0; j < num_teams; j++) {
+            if (j == i
+                || ((teams[i] ^ teams[j]) & combo_hero_nums)
+                || (legals[i] & ~legals[j])
+                || sign * rr_values[i] > sign * rr_values[j])
+                continue;
+
+            // j is at least as good so i is removed unless they are
+            // equivalent and i comes first
+            if (legals[i] != legals[j] || rr_values[i] != rr_values[j] || j < i) {
+                keep[i] = 0;
+                break;
+            }
+        }
+    }
 
+    int new_num_teams = 0;
     for (int i = 0; i < num_teams; i++) {
-        if (legals[i] & hero)
-            return 1;
+        if (keep[i]) {
+            teams[new_num_teams] = teams[i];
+            legals[new_num_teams] = legals[i];
+            rr_values[new_num_teams] = rr_values[i];
+            hashes[new_num_teams] = hashes[i];
+            new_num_teams += 1;
+        }
     }
 
-    return 0;
+    return new_num_teams;
+}
+
+
+//
+// Returns the heroes that are legal in at least one of a team's
+// lineups. As bans and enemy picks remove the same heroes from every
+// lineup, the union after one is this ANDed with the hero's diff_h.
+//
+u64 any_lineup_legals(int num_teams, u64 legals[])
+{
+    u64 any_legals = 0;
+
+    #pragma omp simd reduction(|:any_legals)
+    for (int i = 0; i < num_teams; i++) {
+        any_legals |= legals[i];
+    }
+
+    return any_legals;
+}
+
+
+//
+// Checks if a given hero is legal in any of a team's
+// starting lineup legal actions.
+//
+int legal_for_any_lineup(int hero_num, int num_teams, u64 legals[])
+{
+    return (any_lineup_legals(num_teams, legals) >> hero_num) & 1;
 }
 
 
@@ -992,6 +1330,12 @@ int legal_for_any_lineup(int hero_num, int num_teams, u64 legals[])
 // combination with the transposition table, all threads can share
 // state evaluations which can reduce the time to evaluate a single hero.
 //
+// The best num_pv root actions (with exact values) are kept in pv,
+// sorted from best to worst. Each child is searched with the kth best
+// value so far as the bound so that only actions which make it into
+// the top num_pv need an exact value. With num_pv of 1 this is the
+// same as a regular search.
+//
 struct search_result root_negamax(
     int num_teams,
     int num_e_teams,
@@ -1004,18 +1348,31 @@ struct search_result root_negamax(
     u64 hashes[],
     u64 e_hashes[],
     u64 bans_hash,
-    int stage
+    int stage,
+    int num_pv,
+    struct root_action pv[]
 )
 {
-    struct search_result ret = {.value = -INF};
+    struct search_result ret = {.value = -INF, .nodes = 1};
+
+    // heroes legal for any lineup of each team (any others can be
+    // skipped without updating every lineup)
+    u64 any_legals = any_lineup_legals(num_teams, legals);
+    u64 e_any_legals = any_lineup_legals(num_e_teams, e_legals);
+
     switch (draft[stage].selection) {
         case PICK:
             #pragma omp parallel for schedule(dynamic, 1)
             for (int h = 0; h < num_heroes; h++) {
-                u64 teams_p[num_teams];
-                u64 legals_p[num_teams];
-                int rr_values_p[num_teams];
-                u64 hashes_p[num_teams];
+                struct lineup_frame *frames = &lineup_stack[stage];  // of this thread
+                // skip hero if not legal for any team lineup
+                if (!(any_legals & (1ULL << h)))
+                    continue;
+
+                u64 *teams_p = frames[0].teams;
+                u64 *legals_p = frames[0].legals;
+                int *rr_values_p = frames[0].rr_values;
+                u64 *hashes_p = frames[0].hashes;
                 int num_teams_p = hero_in_team_update(
                     h,
                     draft[stage].team,
@@ -1030,14 +1387,15 @@ struct search_result root_negamax(
                     hashes_p
                 );
 
-                // skip hero if not legal for any team lineup
-                if (num_teams_p == 0)
-                    continue;
+                num_teams_p = prune_lineups(
+                    draft[stage].team, num_teams_p, teams_p, legals_p, rr_values_p, hashes_p
+                );
 
                 // must update all enemy legals as well if continuing
-                u64 e_legals_p[num_e_teams];
+                u64 *e_legals_p = frames[0].e_legals;
                 hero_out_of_team_update(h, num_e_teams, e_legals, e_legals_p);
 
+                u64 child_nodes = 0;
                 int child_value = -flex_negamax(
                     num_e_teams,
                     num_teams_p,
@@ -1052,36 +1410,38 @@ struct search_result root_negamax(
                     bans_hash,
                     stage + 1,
                     -INF,
-                    -ret.value    // use current best value
+                    -pv_bound(&ret, num_pv, pv),   // use current kth best value
+                    &child_nodes
                 );
 
                 #pragma omp critical
                 {
-                    if (child_value > ret.value) {
-                        ret.value = child_value;
-                        ret.best_hero = h;
-                    }
+                    ret.nodes += child_nodes;
+
+                    add_root_action(&ret, num_pv, pv, child_value, h, -1, 0);
                 }
             }
-            return ret;
+            break;
 
         case BAN:
             #pragma omp parallel for schedule(dynamic, 1)
             for (int h = 0; h < num_heroes; h++) {
+                struct lineup_frame *frames = &lineup_stack[stage];  // of this thread
                 // if hero is legal for at least one enemy lineup then
                 // the response values of all enemy lineups must be
                 // considered (not only those where it is legal) as its
                 // possible the enemy could do better using a lineup
                 // where the hero is illegal
-                if (!legal_for_any_lineup(h, num_e_teams, e_legals))
+                if (!(e_any_legals & (1ULL << h)))
                     continue;
 
                 // get updated legals for both teams after the ban
-                u64 legals_b[num_teams];
+                u64 *legals_b = frames[0].legals;
                 hero_out_of_team_update(h, num_teams, legals, legals_b);
-                u64 e_legals_b[num_e_teams];
+                u64 *e_legals_b = frames[0].e_legals;
                 hero_out_of_team_update(h, num_e_teams, e_legals, e_legals_b);
 
+                u64 child_nodes = 0;
                 int child_value = -flex_negamax(
                     num_e_teams,
                     num_teams,
@@ -1096,27 +1456,31 @@ struct search_result root_negamax(
                     bans_hash ^ zobrist_keys[BAN_KEYS][h],
                     stage + 1,
                     -INF,
-                    -ret.value
+                    -pv_bound(&ret, num_pv, pv),
+                    &child_nodes
                 );
 
                 #pragma omp critical
                 {
-                    if (child_value > ret.value) {
-                        ret.value = child_value;
-                        ret.best_hero = h;
-                    }
+                    ret.nodes += child_nodes;
+
+                    add_root_action(&ret, num_pv, pv, child_value, h, -1, 0);
                 }
             }
-            return ret;
+            break;
 
         case PICK_PICK:
             #pragma omp parallel for schedule(dynamic, 1)
             for (int h = 0; h < num_heroes; h++) {
+                struct lineup_frame *frames = &lineup_stack[stage];  // of this thread
+                if (!(any_legals & (1ULL << h)))
+                    continue;
+
                 // update lineups for first pick
-                u64 teams_p[num_teams];
-                u64 legals_p[num_teams];
-                int rr_values_p[num_teams];
-                u64 hashes_p[num_teams];
+                u64 *teams_p = frames[0].teams;
+                u64 *legals_p = frames[0].legals;
+                int *rr_values_p = frames[0].rr_values;
+                u64 *hashes_p = frames[0].hashes;
                 int num_teams_p = hero_in_team_update(
                     h,
                     draft[stage].team,
@@ -1131,18 +1495,23 @@ struct search_result root_negamax(
                     hashes_p
                 );
 
-                if (num_teams_p == 0)
-                    continue;
+                num_teams_p = prune_lineups(
+                    draft[stage].team, num_teams_p, teams_p, legals_p, rr_values_p, hashes_p
+                );
 
-                u64 e_legals_p[num_e_teams];
+                u64 *e_legals_p = frames[0].e_legals;
                 hero_out_of_team_update(h, num_e_teams, e_legals, e_legals_p);
+                u64 any_legals_p = any_lineup_legals(num_teams_p, legals_p);
 
                 for (int h2 = h + 1; h2 < num_heroes; h2++) {
+                    if (!(any_legals_p & (1ULL << h2)))
+                        continue;
+
                     // update lineups for second pick
-                    u64 teams_pp[num_teams_p];
-                    u64 legals_pp[num_teams_p];
-                    int rr_values_pp[num_teams_p];
-                    u64 hashes_pp[num_teams_p];
+                    u64 *teams_pp = frames[1].teams;
+                    u64 *legals_pp = frames[1].legals;
+                    int *rr_values_pp = frames[1].rr_values;
+                    u64 *hashes_pp = frames[1].hashes;
                     int num_teams_pp = hero_in_team_update(
                         h2,
                         draft[stage].team,
@@ -1157,12 +1526,14 @@ struct search_result root_negamax(
                         hashes_pp
                     );
 
-                    if (num_teams_pp == 0)
-                        continue;
+                    num_teams_pp = prune_lineups(
+                        draft[stage].team, num_teams_pp, teams_pp, legals_pp, rr_values_pp, hashes_pp
+                    );
 
-                    u64 e_legals_pp[num_e_teams];
+                    u64 *e_legals_pp = frames[1].e_legals;
                     hero_out_of_team_update(h2, num_e_teams, e_legals_p, e_legals_pp);
 
+                    u64 child_nodes = 0;
                     int child_value = -flex_negamax(
                         num_e_teams,
                         num_teams_pp,
@@ -1177,29 +1548,32 @@ struct search_result root_negamax(
                         bans_hash,
                         stage + 2,
                         -INF,
-                        -ret.value
+                        -pv_bound(&ret, num_pv, pv),
+                        &child_nodes
                     );
 
                     #pragma omp critical
                     {
-                        if (child_value > ret.value) {
-                            ret.value = child_value;
-                            ret.best_hero = h;
-                            ret.best_hero_2 = h2;
-                        }
+                        ret.nodes += child_nodes;
+
+                        add_root_action(&ret, num_pv, pv, child_value, h, h2, 1);
                     }
                 }
             }
-            return ret;
+            break;
 
         case PICK_BAN:
             #pragma omp parallel for schedule(dynamic, 1)
             for (int h = 0; h < num_heroes; h++) {
+                struct lineup_frame *frames = &lineup_stack[stage];  // of this thread
+                if (!(any_legals & (1ULL << h)))
+                    continue;
+
                 // update lineups for pick
-                u64 teams_p[num_teams];
-                u64 legals_p[num_teams];
-                int rr_values_p[num_teams];
-                u64 hashes_p[num_teams];
+                u64 *teams_p = frames[0].teams;
+                u64 *legals_p = frames[0].legals;
+                int *rr_values_p = frames[0].rr_values;
+                u64 *hashes_p = frames[0].hashes;
                 int num_teams_p = hero_in_team_update(
                     h,
                     draft[stage].team,
@@ -1214,22 +1588,25 @@ struct search_result root_negamax(
                     hashes_p
                 );
 
-                if (num_teams_p == 0)
-                    continue;
+                num_teams_p = prune_lineups(
+                    draft[stage].team, num_teams_p, teams_p, legals_p, rr_values_p, hashes_p
+                );
 
-                u64 e_legals_p[num_e_teams];
+                u64 *e_legals_p = frames[0].e_legals;
                 hero_out_of_team_update(h, num_e_teams, e_legals, e_legals_p);
+                u64 e_any_legals_p = e_any_legals & h_infos[h].diff_h;
 
                 for (int h2 = 0; h2 < num_heroes; h2++) {
-                    if (!legal_for_any_lineup(h2, num_e_teams, e_legals_p))
+                    if (!(e_any_legals_p & (1ULL << h2)))
                         continue;
 
                     // update lineups for ban
-                    u64 legals_pb[num_teams_p];
+                    u64 *legals_pb = frames[1].legals;
                     hero_out_of_team_update(h2, num_teams_p, legals_p, legals_pb);
-                    u64 e_legals_pb[num_e_teams];
+                    u64 *e_legals_pb = frames[1].e_legals;
                     hero_out_of_team_update(h2, num_e_teams, e_legals_p, e_legals_pb);
 
+                    u64 child_nodes = 0;
                     int child_value = -flex_negamax(
                         num_e_teams,
                         num_teams_p,
@@ -1244,40 +1621,44 @@ struct search_result root_negamax(
                         bans_hash ^ zobrist_keys[BAN_KEYS][h2],
                         stage + 2,
                         -INF,
-                        -ret.value
+                        -pv_bound(&ret, num_pv, pv),
+                        &child_nodes
                     );
 
                     #pragma omp critical
                     {
-                        if (child_value > ret.value) {
-                            ret.value = child_value;
-                            ret.best_hero = h;
-                            ret.best_hero_2 = h2;
-                        }
+                        ret.nodes += child_nodes;
+
+                        add_root_action(&ret, num_pv, pv, child_value, h, h2, 0);
                     }
                 }
             }
-            return ret;
+            break;
 
         case BAN_PICK:
             #pragma omp parallel for schedule(dynamic, 1)
             for (int h = 0; h < num_heroes; h++) {
-                if (!legal_for_any_lineup(h, num_e_teams, e_legals))
+                struct lineup_frame *frames = &lineup_stack[stage];  // of this thread
+                if (!(e_any_legals & (1ULL << h)))
                     continue;
 
                 // update lineups for ban
-                u64 legals_b[num_teams];
+                u64 *legals_b = frames[0].legals;
                 hero_out_of_team_update(h, num_teams, legals, legals_b);
-                u64 e_legals_b[num_e_teams];
+                u64 *e_legals_b = frames[0].e_legals;
                 hero_out_of_team_update(h, num_e_teams, e_legals, e_legals_b);
                 u64 bans_hash_b = bans_hash ^ zobrist_keys[BAN_KEYS][h];
+                u64 any_legals_b = any_legals & h_infos[h].diff_h;
 
                 for (int h2 = 0; h2 < num_heroes; h2++) {
+                    if (!(any_legals_b & (1ULL << h2)))
+                        continue;
+
                     // update lineups for pick
-                    u64 teams_bp[num_teams];
-                    u64 legals_bp[num_teams];
-                    int rr_values_bp[num_teams];
-                    u64 hashes_bp[num_teams];
+                    u64 *teams_bp = frames[1].teams;
+                    u64 *legals_bp = frames[1].legals;
+                    int *rr_values_bp = frames[1].rr_values;
+                    u64 *hashes_bp = frames[1].hashes;
                     int num_teams_bp = hero_in_team_update(
                         h2,
                         draft[stage].team,
@@ -1292,12 +1673,14 @@ struct search_result root_negamax(
                         hashes_bp
                     );
 
-                    if (num_teams_bp == 0)
-                        continue;
+                    num_teams_bp = prune_lineups(
+                        draft[stage].team, num_teams_bp, teams_bp, legals_bp, rr_values_bp, hashes_bp
+                    );
 
-                    u64 e_legals_bp[num_e_teams];
+                    u64 *e_legals_bp = frames[1].e_legals;
                     hero_out_of_team_update(h2, num_e_teams, e_legals_b, e_legals_bp);
 
+                    u64 child_nodes = 0;
                     int child_value = -flex_negamax(
                         num_e_teams,
                         num_teams_bp,
@@ -1312,44 +1695,46 @@ struct search_result root_negamax(
                         bans_hash_b,
                         stage + 2,
                         -INF,
-                        -ret.value
+                        -pv_bound(&ret, num_pv, pv),
+                        &child_nodes
                     );
 
                     #pragma omp critical
                     {
-                        if (child_value > ret.value) {
-                            ret.value = child_value;
-                            ret.best_hero = h;
-                            ret.best_hero_2 = h2;
-                        }
+                        ret.nodes += child_nodes;
+
+                        add_root_action(&ret, num_pv, pv, child_value, h, h2, 0);
                     }
                 }
             }
-            return ret;
+            break;
 
         case BAN_BAN:
             #pragma omp parallel for schedule(dynamic, 1)
             for (int h = 0; h < num_heroes; h++) {
-                if (!legal_for_any_lineup(h, num_e_teams, e_legals))
+                struct lineup_frame *frames = &lineup_stack[stage];  // of this thread
+                if (!(e_any_legals & (1ULL << h)))
                     continue;
 
                 // update lineups for first ban
-                u64 legals_b[num_teams];
+                u64 *legals_b = frames[0].legals;
                 hero_out_of_team_update(h, num_teams, legals, legals_b);
-                u64 e_legals_b[num_e_teams];
+                u64 *e_legals_b = frames[0].e_legals;
                 hero_out_of_team_update(h, num_e_teams, e_legals, e_legals_b);
                 u64 bans_hash_b = bans_hash ^ zobrist_keys[BAN_KEYS][h];
+                u64 e_any_legals_b = e_any_legals & h_infos[h].diff_h;
 
                 for (int h2 = h + 1; h2 < num_heroes; h2++) {
-                    if (!legal_for_any_lineup(h2, num_e_teams, e_legals_b))
+                    if (!(e_any_legals_b & (1ULL << h2)))
                         continue;
 
                     // update lineups for second ban
-                    u64 legals_bb[num_teams];
+                    u64 *legals_bb = frames[1].legals;
                     hero_out_of_team_update(h2, num_teams, legals_b, legals_bb);
-                    u64 e_legals_bb[num_e_teams];
+                    u64 *e_legals_bb = frames[1].e_legals;
                     hero_out_of_team_update(h2, num_e_teams, e_legals_b, e_legals_bb);
 
+                    u64 child_nodes = 0;
                     int child_value = -flex_negamax(
                         num_e_teams,
                         num_teams,
@@ -1364,29 +1749,361 @@ struct search_result root_negamax(
                         bans_hash_b ^ zobrist_keys[BAN_KEYS][h2],
                         stage + 2,
                         -INF,
-                        -ret.value
+                        -pv_bound(&ret, num_pv, pv),
+                        &child_nodes
                     );
 
                     #pragma omp critical
                     {
-                        if (child_value > ret.value) {
-                            ret.value = child_value;
-                            ret.best_hero = h;
-                            ret.best_hero_2 = h2;
-                        }
+                        ret.nodes += child_nodes;
+
+                        add_root_action(&ret, num_pv, pv, child_value, h, h2, 1);
                     }
                 }
             }
-            return ret;
+            break;
+    }
+
+    // fill in best action for convenience
+    if (ret.num_pv > 0) {
+        ret.value = pv[0].value;
+        ret.best_hero = pv[0].hero;
+        ret.best_hero_2 = pv[0].hero_2;
     }
+    return ret;
 }
 
 
-// 
+//
+// Returns the value a root action must beat to be one of the best
+// num_pv actions, i.e., the kth best value once k actions are found.
+// Read in the same critical section as root actions are added as pv
+// is only sorted again once an action has been inserted. A child that
+// fails low against this bound is then always rejected by
+// add_root_action as the kth best value never decreases.
+//
+int pv_bound(struct search_result* ret, int num_pv, struct root_action pv[])
+{
+    int bound;
+    #pragma omp critical
+    bound = ret->num_pv < num_pv ? -INF : pv[num_pv - 1].value;
+    return bound;
+}
+
+
+//
+// Inserts a root action into the sorted best actions (when good
+// enough). Different role variations of the same hero(es) are the
+// same action in the actual draft so only the best of them is kept.
+// Order of the heroes is irrelevant for double picks and bans.
+//
+void add_root_action(
+    struct search_result* ret,
+    int num_pv,
+    struct root_action pv[],
+    int value,
+    int hero,
+    int hero_2,
+    int unordered
+)
+{
+    int i;
+    for (i = 0; i < ret->num_pv; i++) {
+        if (same_action(pv[i], hero, hero_2, unordered))
+            break;
+    }
+
+    if (i < ret->num_pv) {
+        // replace existing variation if better
+        if (value <= pv[i].value)
+            return;
+    } else if (ret->num_pv == num_pv) {
+        // replace kth best if better
+        if (value <= pv[num_pv - 1].value)
+            return;
+        i = num_pv - 1;
+    } else {
+        i = ret->num_pv++;
+    }
+
+    // move worse actions down to keep pv sorted
+    while (i > 0 && pv[i - 1].value < value) {
+        pv[i] = pv[i - 1];
+        i--;
+    }
+    pv[i].value = value;
+    pv[i].hero = hero;
+    pv[i].hero_2 = hero_2;
+}
+
+
+int same_action(struct root_action action, int hero, int hero_2, int unordered)
+{
+    if (same_hero(action.hero, hero) && same_hero(action.hero_2, hero_2))
+        return 1;
+    return unordered && same_hero(action.hero, hero_2) && same_hero(action.hero_2, hero);
+}
+
+
+// hero nums are the same underlying hero if either is not in the
+// other's diff_h (-1 is used for no hero)
+int same_hero(int hero_num, int other_num)
+{
+    if (hero_num == other_num)
+        return 1;
+    if (hero_num < 0 || other_num < 0)
+        return 0;
+    return !(h_infos[hero_num].diff_h & (1ULL << other_num));
+}
+
+
+//
+// Reconstructs the principal variation (expected selections for both
+// teams through to the end of the draft) from a state with a known
+// exact value. At each stage the first action whose child also has
+// that value is followed. Each child is only checked with a minimal
+// window around the value so, with the transposition table already
+// filled by the search that found the value, this repeats very little
+// of the original search and no extra work is added to negamax.
+//
+// Actions already in line (not -1) are followed without checking,
+// which allows the root action(s) returned by search to be used.
+// Hero nums are written to line at their stage. Returns 0 if no
+// action with the value can be found (only possible with a hash
+// collision), leaving the rest of line as -1.
+//
+int find_pv(
+    int num_teams,
+    int num_e_teams,
+    u64 teams[],
+    u64 e_teams[],
+    u64 legals[],
+    u64 e_legals[],
+    int rr_values[],
+    int e_rr_values[],
+    u64 hashes[],
+    u64 e_hashes[],
+    u64 bans_hash,
+    int stage,
+    int value,
+    int line[],
+    u64 *nodes
+)
+{
+    if (stage == draft_len)
+        return 1;
+
+    enum selection selection = draft[stage].selection;
+    int double_selection = selection != PICK && selection != BAN;
+    int first_pick = selection == PICK || selection == PICK_PICK || selection == PICK_BAN;
+    int second_pick = selection == PICK_PICK || selection == BAN_PICK;
+    int unordered = selection == PICK_PICK || selection == BAN_BAN;
+    int next_stage = double_selection ? stage + 2 : stage + 1;
+    int forced = line[stage] >= 0;
+
+    for (int h = 0; h < num_heroes; h++) {
+        if (forced && h != line[stage])
+            continue;
+
+        u64 teams_1[num_teams];
+        u64 legals_1[num_teams];
+        int rr_values_1[num_teams];
+        u64 hashes_1[num_teams];
+        u64 e_legals_1[num_e_teams];
+        u64 bans_hash_1;
+        int num_teams_1 = apply_action(
+            h,
+            first_pick,
+            draft[stage].team,
+            num_teams,
+            num_e_teams,
+            teams,
+            legals,
+            rr_values,
+            hashes,
+            e_legals,
+            bans_hash,
+            teams_1,
+            legals_1,
+            rr_values_1,
+            hashes_1,
+            e_legals_1,
+            &bans_hash_1
+        );
+
+        if (num_teams_1 == 0)
+            continue;
+
+        // single selections go through this loop once with h2 as -1
+        int h2_start = !double_selection ? -1 : (unordered ? h + 1 : 0);
+        int h2_end = double_selection ? num_heroes : 0;
+        for (int h2 = h2_start; h2 < h2_end; h2++) {
+            if (forced && double_selection && h2 != line[stage + 1])
+                continue;
+
+            u64 teams_2[num_teams];
+            u64 legals_2[num_teams];
+            int rr_values_2[num_teams];
+            u64 hashes_2[num_teams];
+            u64 e_legals_2[num_e_teams];
+            u64 bans_hash_2;
+            int num_teams_2;
+            if (h2 >= 0) {
+                num_teams_2 = apply_action(
+                    h2,
+                    second_pick,
+                    draft[stage].team,
+                    num_teams_1,
+                    num_e_teams,
+                    teams_1,
+                    legals_1,
+                    rr_values_1,
+                    hashes_1,
+                    e_legals_1,
+                    bans_hash_1,
+                    teams_2,
+                    legals_2,
+                    rr_values_2,
+                    hashes_2,
+                    e_legals_2,
+                    &bans_hash_2
+                );
+
+                if (num_teams_2 == 0)
+                    continue;
+            } else {
+                num_teams_2 = num_teams_1;
+                memcpy(teams_2, teams_1, num_teams_1 * sizeof(u64));
+                memcpy(legals_2, legals_1, num_teams_1 * sizeof(u64));
+                memcpy(rr_values_2, rr_values_1, num_teams_1 * sizeof(int));
+                memcpy(hashes_2, hashes_1, num_teams_1 * sizeof(u64));
+                memcpy(e_legals_2, e_legals_1, num_e_teams * sizeof(u64));
+                bans_hash_2 = bans_hash_1;
+            }
+
+            if (!forced) {
+                // window only returns an exact value if it is equal
+                int child_value = -flex_negamax(
+                    num_e_teams,
+                    num_teams_2,
+                    e_teams,
+                    teams_2,
+                    e_legals_2,
+                    legals_2,
+                    e_rr_values,
+                    rr_values_2,
+                    e_hashes,
+                    hashes_2,
+                    bans_hash_2,
+                    next_stage,
+                    -value - 1,
+                    -value + 1,
+                    nodes
+                );
+
+                if (child_value != value)
+                    continue;
+            }
+
+            line[stage] = h;
+            if (double_selection)
+                line[stage + 1] = h2;
+
+            return find_pv(
+                num_e_teams,
+                num_teams_2,
+                e_teams,
+                teams_2,
+                e_legals_2,
+                legals_2,
+                e_rr_values,
+                rr_values_2,
+                e_hashes,
+                hashes_2,
+                bans_hash_2,
+                next_stage,
+                -value,
+                line,
+                nodes
+            );
+        }
+    }
+
+    return 0;
+}
+
+
+//
+// Applies a single pick (or ban) of a hero by the selecting team to
+// all lineups of both teams, using the same rules (and lineup pruning)
+// as root_negamax. Returns the number of selecting team lineups after
+// the action (0 if it is not legal).
+//
+int apply_action(
+    int hero_num,
+    int pick,
+    enum team selecting_team,
+    int num_teams,
+    int num_e_teams,
+    u64 teams[],
+    u64 legals[],
+    int rr_values[],
+    u64 hashes[],
+    u64 e_legals[],
+    u64 bans_hash,
+    u64 new_teams[],
+    u64 new_legals[],
+    int new_rr_values[],
+    u64 new_hashes[],
+    u64 new_e_legals[],
+    u64* new_bans_hash
+)
+{
+    if (pick) {
+        int new_num_teams = hero_in_team_update(
+            hero_num,
+            selecting_team,
+            num_teams,
+            teams,
+            legals,
+            rr_values,
+            hashes,
+            new_teams,
+            new_legals,
+            new_rr_values,
+            new_hashes
+        );
+
+        if (new_num_teams == 0)
+            return 0;
+
+        hero_out_of_team_update(hero_num, num_e_teams, e_legals, new_e_legals);
+        *new_bans_hash = bans_hash;
+        return prune_lineups(selecting_team, new_num_teams, new_teams, new_legals, new_rr_values, new_hashes);
+    }
+
+    // only heroes the enemy can pick are banned
+    if (!legal_for_any_lineup(hero_num, num_e_teams, e_legals))
+        return 0;
+
+    memcpy(new_teams, teams, num_teams * sizeof(u64));
+    memcpy(new_rr_values, rr_values, num_teams * sizeof(int));
+    memcpy(new_hashes, hashes, num_teams * sizeof(u64));
+    hero_out_of_team_update(hero_num, num_teams, legals, new_legals);
+    hero_out_of_team_update(hero_num, num_e_teams, e_legals, new_e_legals);
+    *new_bans_hash = bans_hash ^ zobrist_keys[BAN_KEYS][hero_num];
+    return num_teams;
+}
+
+
+//
 // Outer search function. Takes in any starting state of selected
 // hero nums (that includes all role variations), sets up initial
 // bit format variables, then calls root_negamax for the selecting
-// team to return optimal value and action(s).
+// team to return optimal value and action(s). The best num_pv root
+// actions and their values are also written to pv. If pv_lines is
+// given, the principal variation following each of these actions is
+// written to it (MAX_DRAFT_LEN hero nums per action indexed by stage).
 //
 struct search_result run_search(
     int num_teams_A,
@@ -1396,7 +2113,137 @@ struct search_result run_search(
     int banned_size,
     int** start_teams_A,
     int** start_teams_B,
-    int* banned
+    int* banned,
+    int num_pv,
+    struct root_action pv[],
+    int pv_lines[]
+)
+{
+    init_combo_hero_nums();
+    root_selecting_team = draft[team_A_size + team_B_size + banned_size].team;
+
+    return search_from(
+        num_teams_A,
+        num_teams_B,
+        team_A_size,
+        team_B_size,
+        banned_size,
+        start_teams_A,
+        start_teams_B,
+        banned,
+        num_pv,
+        pv,
+        pv_lines
+    );
+}
+
+
+//
+// Runs a search (as run_search with a single root action) from each
+// of the given states, filling in their results. Searches are run in
+// the order given so, as all share the TT, states stored by earlier
+// searches can be used by later ones from related drafts (e.g., when
+// given from the latest stage to the earliest). Consecutive searches
+// from the same stage are run as a group. Those with fewer than
+// MIN_ROOT_SPLIT_LEFT selections left are too small to be worth
+// splitting between threads at the root so are run alongside each
+// other, one per thread. Larger searches are run one at a time with
+// the root actions split as usual.
+//
+void run_search_batch(int num_searches, const struct search_input inputs[], struct search_result results[])
+{
+    init_combo_hero_nums();
+
+    int start = 0;
+    while (start < num_searches) {
+        int stage = search_input_stage(inputs[start]);
+        int end = start + 1;
+        while (end < num_searches && search_input_stage(inputs[end]) == stage)
+            end++;
+
+        // flex_negamax depends on the root selecting team shared by
+        // all threads so it can only change between groups
+        root_selecting_team = draft[stage].team;
+
+        if (draft_len - stage < MIN_ROOT_SPLIT_LEFT) {
+            #pragma omp parallel for schedule(dynamic, 1)
+            for (int i = start; i < end; i++)
+                results[i] = search_input(inputs[i]);
+        } else {
+            for (int i = start; i < end; i++)
+                results[i] = search_input(inputs[i]);
+        }
+
+        start = end;
+    }
+}
+
+
+int search_input_stage(struct search_input input)
+{
+    return input.team_A_size + input.team_B_size + input.banned_size;
+}
+
+
+//
+// Search from a batch input (see run_search_batch).
+//
+struct search_result search_input(struct search_input input)
+{
+    int *teams_A[MAX_LINEUPS];
+    int *teams_B[MAX_LINEUPS];
+    for (int i = 0; i < input.num_teams_A; i++)
+        teams_A[i] = input.teams_A + i * input.team_A_size;
+    for (int i = 0; i < input.num_teams_B; i++)
+        teams_B[i] = input.teams_B + i * input.team_B_size;
+
+    struct root_action pv[1] = {{0}};
+    return search_from(
+        input.num_teams_A,
+        input.num_teams_B,
+        input.team_A_size,
+        input.team_B_size,
+        input.banned_size,
+        teams_A,
+        teams_B,
+        input.banned,
+        1,
+        pv,
+        NULL
+    );
+}
+
+
+//
+// Hero nums of all combo rewards, needed for pruning lineups (see
+// prune_lineups) before any search.
+//
+void init_combo_hero_nums()
+{
+    combo_hero_nums = 0;
+    for (int i = 0; i < num_synergy_rs; i++)
+        combo_hero_nums |= synergy_rs[i].heroes;
+    for (int i = 0; i < num_counter_rs; i++)
+        combo_hero_nums |= counter_rs[i].heroes | counter_rs[i].foes;
+}
+
+
+//
+// Search from a starting state for run_search once the combo hero nums
+// and root selecting team are set.
+//
+struct search_result search_from(
+    int num_teams_A,
+    int num_teams_B,
+    int team_A_size,
+    int team_B_size,
+    int banned_size,
+    int** start_teams_A,
+    int** start_teams_B,
+    int* banned,
+    int num_pv,
+    struct root_action pv[],
+    int pv_lines[]
 )
 {
     // init team A teams, legals, rr_values and starting hashes for all lineups
@@ -1437,15 +2284,21 @@ struct search_result run_search(
         hashes_B[i] = init_hash(B, team_B_size, start_teams_B[i]);
     }
 
+    // remove lineups that can never do better than another
+    num_teams_A = prune_lineups(A, num_teams_A, teams_A, legals_A, rr_values_A, hashes_A);
+    num_teams_B = prune_lineups(B, num_teams_B, teams_B, legals_B, rr_values_B, hashes_B);
+
     // init hash of all bans (only single hash needed as a ban
     // from either team of any role variation is equivalent)
     u64 bans_hash = init_hash(BAN_KEYS, banned_size, banned);
+    if (sides_switched)
+        bans_hash ^= SWITCHED_SIDES_KEY;  // part of every state's hash
 
     // call search for selecting team
     int stage = team_A_size + team_B_size + banned_size;
-    root_selecting_team = draft[stage].team;
+    struct search_result ret;
     if (draft[stage].team == A)
-        return root_negamax(
+        ret = root_negamax(
             num_teams_A,
             num_teams_B,
             teams_A,
@@ -1457,10 +2310,12 @@ struct search_result run_search(
             hashes_A,
             hashes_B,
             bans_hash,
-            stage
+            stage,
+            num_pv,
+            pv
         );
-     else
-        return root_negamax(
+    else
+        ret = root_negamax(
             num_teams_B,
             num_teams_A,
             teams_B,
@@ -1472,71 +2327,573 @@ struct search_result run_search(
             hashes_B,
             hashes_A,
             bans_hash,
-            stage
+            stage,
+            num_pv,
+            pv
         );
-}
-
-
-// 
-// Turn array of hero nums into their bit representation.
-//
-u64 team_bit_repr(int team_size, int team_nums[])
-{
-    u64 team = 0;  // start with empty team
 
-    for (int i = 0; i < team_size; i++) {
-        team |= (1ULL << team_nums[i]);
+    // reconstruct the principal variation following each root action
+    if (pv_lines != NULL) {
+        for (int i = 0; i < ret.num_pv; i++) {
+            int* line = pv_lines + i * MAX_DRAFT_LEN;
+            for (int s = 0; s < MAX_DRAFT_LEN; s++) {
+                line[s] = -1;
+            }
+            line[stage] = pv[i].hero;
+            if (pv[i].hero_2 >= 0)
+                line[stage + 1] = pv[i].hero_2;
+
+            if (draft[stage].team == A)
+                find_pv(
+                    num_teams_A,
+                    num_teams_B,
+                    teams_A,
+                    teams_B,
+                    legals_A,
+                    legals_B,
+                    rr_values_A,
+                    rr_values_B,
+                    hashes_A,
+                    hashes_B,
+                    bans_hash,
+                    stage,
+                    pv[i].value,
+                    line,
+                    &ret.nodes
+                );
+            else
+                find_pv(
+                    num_teams_B,
+                    num_teams_A,
+                    teams_B,
+                    teams_A,
+                    legals_B,
+                    legals_A,
+                    rr_values_B,
+                    rr_values_A,
+                    hashes_B,
+                    hashes_A,
+                    bans_hash,
+                    stage,
+                    pv[i].value,
+                    line,
+                    &ret.nodes
+                );
+        }
     }
 
-    return team;
+    return ret;
 }
 
 
-// 
-// Get the legal actions for a team in bit representation given 
-// arrays of hero nums for team, enemy and bans.
 //
-u64 legal_bit_repr(
-    int team_size,
-    int e_team_size,
-    int banned_size,
-    int team_nums[],
-    int e_team_nums[],
-    int banned_nums[]
-)
+// Perft style node counting. Walks the full legal tree from a state
+// with a single lineup per team using the same legal action updates
+// and double selection rules as negamax, but without any pruning or
+// evaluation, adding every node visited to the count for its stage.
+// Useful for validating changes to move generation and measuring raw
+// speed. Stops at end_stage (or the end of the draft) and, for double
+// selections, the states after the first selection are also counted.
+//
+void perft(u64 legal, u64 e_legal, int stage, int end_stage, u64 counts[])
 {
-    u64 legal = 0xFFFFFFFFFFFFFFFF;  // init all heroes as legal
+    counts[stage]++;
 
-    // remove team heroes (and their shared roles and flex nums)
-    for (int i = 0; i < team_size; i++) {
-        legal &= h_infos[team_nums[i]].diff_role_and_h;
-    }
+    if (stage == end_stage)
+        return;
 
-    // remove selected enemy heroes (including flex nums)
-    for (int i = 0; i < e_team_size; i++) {
-        legal &= h_infos[e_team_nums[i]].diff_h;
-    }
+    switch (draft[stage].selection) {
+        case PICK:
+            for (int h = 0; h < num_heroes; h++) {
+                if (!(legal & (1ULL << h)))
+                    continue;
 
-    // remove banned heroes (including flex nums)
-    for (int i = 0; i < banned_size; i++) {
-        legal &= h_infos[banned_nums[i]].diff_h;
-    }
+                perft(
+                    e_legal & h_infos[h].diff_h,
+                    legal & h_infos[h].diff_role_and_h,
+                    stage + 1,
+                    end_stage,
+                    counts
+                );
+            }
+            break;
 
-    return legal;
-}
+        case BAN:
+            for (int h = 0; h < num_heroes; h++) {
+                if (!(e_legal & (1ULL << h)))
+                    continue;
 
+                perft(
+                    e_legal & h_infos[h].diff_h,
+                    legal & h_infos[h].diff_h,
+                    stage + 1,
+                    end_stage,
+                    counts
+                );
+            }
+            break;
 
-//
-// XOR the zobrist keys for each hero in a set of team picks
-// or all bans.
-//
-u64 init_hash(int team_or_ban, int hero_nums_size, int hero_nums[])
-{
-    u64 hash = 0ULL;
+        case PICK_PICK:
+            for (int h = 0; h < num_heroes; h++) {
+                if (!(legal & (1ULL << h)))
+                    continue;
 
-    for (int i = 0; i < hero_nums_size; i++) {
-        hash ^= zobrist_keys[team_or_ban][hero_nums[i]];
-    }
+                u64 new_legal = legal & h_infos[h].diff_role_and_h;
+                u64 new_e_legal = e_legal & h_infos[h].diff_h;
+                counts[stage + 1]++;
+                if (stage + 1 == end_stage)
+                    continue;
+
+                // order in double pick is irrelevant
+                for (int h2 = h + 1; h2 < num_heroes; h2++) {
+                    if (!(new_legal & (1ULL << h2)))
+                        continue;
+
+                    perft(
+                        new_e_legal & h_infos[h2].diff_h,
+                        new_legal & h_infos[h2].diff_role_and_h,
+                        stage + 2,
+                        end_stage,
+                        counts
+                    );
+                }
+            }
+            break;
+
+        case PICK_BAN:
+            for (int h = 0; h < num_heroes; h++) {
+                if (!(legal & (1ULL << h)))
+                    continue;
+
+                u64 new_legal = legal & h_infos[h].diff_role_and_h;
+                u64 new_e_legal = e_legal & h_infos[h].diff_h;
+                counts[stage + 1]++;
+                if (stage + 1 == end_stage)
+                    continue;
+
+                for (int h2 = 0; h2 < num_heroes; h2++) {
+                    if (!(new_e_legal & (1ULL << h2)))
+                        continue;
+
+                    perft(
+                        new_e_legal & h_infos[h2].diff_h,
+                        new_legal & h_infos[h2].diff_h,
+                        stage + 2,
+                        end_stage,
+                        counts
+                    );
+                }
+            }
+            break;
+
+        case BAN_PICK:
+            for (int h = 0; h < num_heroes; h++) {
+                if (!(e_legal & (1ULL << h)))
+                    continue;
+
+                u64 new_legal = legal & h_infos[h].diff_h;
+                u64 new_e_legal = e_legal & h_infos[h].diff_h;
+                counts[stage + 1]++;
+                if (stage + 1 == end_stage)
+                    continue;
+
+                for (int h2 = 0; h2 < num_heroes; h2++) {
+                    if (!(new_legal & (1ULL << h2)))
+                        continue;
+
+                    perft(
+                        new_e_legal & h_infos[h2].diff_h,
+                        new_legal & h_infos[h2].diff_role_and_h,
+                        stage + 2,
+                        end_stage,
+                        counts
+                    );
+                }
+            }
+            break;
+
+        case BAN_BAN:
+            for (int h = 0; h < num_heroes; h++) {
+                if (!(e_legal & (1ULL << h)))
+                    continue;
+
+                u64 new_legal = legal & h_infos[h].diff_h;
+                u64 new_e_legal = e_legal & h_infos[h].diff_h;
+                counts[stage + 1]++;
+                if (stage + 1 == end_stage)
+                    continue;
+
+                // order for double bans is irrelevant
+                for (int h2 = h + 1; h2 < num_heroes; h2++) {
+                    if (!(new_e_legal & (1ULL << h2)))
+                        continue;
+
+                    perft(
+                        new_e_legal & h_infos[h2].diff_h,
+                        new_legal & h_infos[h2].diff_h,
+                        stage + 2,
+                        end_stage,
+                        counts
+                    );
+                }
+            }
+            break;
+    }
+}
+
+
+//
+// Same as perft but mirroring flex_negamax for when either team has
+// multiple lineups. Once the enemy has a single lineup each of the
+// selecting team's lineups is handed over to perft (just as
+// flex_negamax hands over to negamax), so the counts reflect the
+// nodes a search without pruning would visit.
+//
+void flex_perft(
+    int num_teams,
+    int num_e_teams,
+    u64 legals[],
+    u64 e_legals[],
+    int stage,
+    int end_stage,
+    u64 counts[]
+)
+{
+    if (num_e_teams == 1) {
+        for (int i = 0; i < num_teams; i++) {
+            perft(legals[i], e_legals[0], stage, end_stage, counts);
+        }
+        return;
+    }
+
+    counts[stage]++;
+
+    if (stage == end_stage)
+        return;
+
+    switch (draft[stage].selection) {
+        case PICK:
+            for (int h = 0; h < num_heroes; h++) {
+                u64 legals_p[num_teams];
+                int num_teams_p = legal_pick_update(h, num_teams, legals, legals_p);
+                if (num_teams_p == 0)
+                    continue;
+
+                u64 e_legals_p[num_e_teams];
+                hero_out_of_team_update(h, num_e_teams, e_legals, e_legals_p);
+
+                flex_perft(num_e_teams, num_teams_p, e_legals_p, legals_p, stage + 1, end_stage, counts);
+            }
+            break;
+
+        case BAN:
+            for (int h = 0; h < num_heroes; h++) {
+                if (!legal_for_any_lineup(h, num_e_teams, e_legals))
+                    continue;
+
+                u64 legals_b[num_teams];
+                hero_out_of_team_update(h, num_teams, legals, legals_b);
+                u64 e_legals_b[num_e_teams];
+                hero_out_of_team_update(h, num_e_teams, e_legals, e_legals_b);
+
+                flex_perft(num_e_teams, num_teams, e_legals_b, legals_b, stage + 1, end_stage, counts);
+            }
+            break;
+
+        case PICK_PICK:
+            for (int h = 0; h < num_heroes; h++) {
+                u64 legals_p[num_teams];
+                int num_teams_p = legal_pick_update(h, num_teams, legals, legals_p);
+                if (num_teams_p == 0)
+                    continue;
+
+                u64 e_legals_p[num_e_teams];
+                hero_out_of_team_update(h, num_e_teams, e_legals, e_legals_p);
+                counts[stage + 1]++;
+                if (stage + 1 == end_stage)
+                    continue;
+
+                for (int h2 = h + 1; h2 < num_heroes; h2++) {
+                    u64 legals_pp[num_teams_p];
+                    int num_teams_pp = legal_pick_update(h2, num_teams_p, legals_p, legals_pp);
+                    if (num_teams_pp == 0)
+                        continue;
+
+                    u64 e_legals_pp[num_e_teams];
+                    hero_out_of_team_update(h2, num_e_teams, e_legals_p, e_legals_pp);
+
+                    flex_perft(num_e_teams, num_teams_pp, e_legals_pp, legals_pp, stage + 2, end_stage, counts);
+                }
+            }
+            break;
+
+        case PICK_BAN:
+            for (int h = 0; h < num_heroes; h++) {
+                u64 legals_p[num_teams];
+                int num_teams_p = legal_pick_update(h, num_teams, legals, legals_p);
+                if (num_teams_p == 0)
+                    continue;
+
+                u64 e_legals_p[num_e_teams];
+                hero_out_of_team_update(h, num_e_teams, e_legals, e_legals_p);
+                counts[stage + 1]++;
+                if (stage + 1 == end_stage)
+                    continue;
+
+                for (int h2 = 0; h2 < num_heroes; h2++) {
+                    if (!legal_for_any_lineup(h2, num_e_teams, e_legals_p))
+                        continue;
+
+                    u64 legals_pb[num_teams_p];
+                    hero_out_of_team_update(h2, num_teams_p, legals_p, legals_pb);
+                    u64 e_legals_pb[num_e_teams];
+                    hero_out_of_team_update(h2, num_e_teams, e_legals_p, e_legals_pb);
+
+                    flex_perft(num_e_teams, num_teams_p, e_legals_pb, legals_pb, stage + 2, end_stage, counts);
+                }
+            }
+            break;
+
+        case BAN_PICK:
+            for (int h = 0; h < num_heroes; h++) {
+                if (!legal_for_any_lineup(h, num_e_teams, e_legals))
+                    continue;
+
+                u64 legals_b[num_teams];
+                hero_out_of_team_update(h, num_teams, legals, legals_b);
+                u64 e_legals_b[num_e_teams];
+                hero_out_of_team_update(h, num_e_teams, e_legals, e_legals_b);
+                counts[stage + 1]++;
+                if (stage + 1 == end_stage)
+                    continue;
+
+                for (int h2 = 0; h2 < num_heroes; h2++) {
+                    u64 legals_bp[num_teams];
+                    int num_teams_bp = legal_pick_update(h2, num_teams, legals_b, legals_bp);
+                    if (num_teams_bp == 0)
+                        continue;
+
+                    u64 e_legals_bp[num_e_teams];
+                    hero_out_of_team_update(h2, num_e_teams, e_legals_b, e_legals_bp);
+
+                    flex_perft(num_e_teams, num_teams_bp, e_legals_bp, legals_bp, stage + 2, end_stage, counts);
+                }
+            }
+            break;
+
+        case BAN_BAN:
+            for (int h = 0; h < num_heroes; h++) {
+                if (!legal_for_any_lineup(h, num_e_teams, e_legals))
+                    continue;
+
+                u64 legals_b[num_teams];
+                hero_out_of_team_update(h, num_teams, legals, legals_b);
+                u64 e_legals_b[num_e_teams];
+                hero_out_of_team_update(h, num_e_teams, e_legals, e_legals_b);
+                counts[stage + 1]++;
+                if (stage + 1 == end_stage)
+                    continue;
+
+                for (int h2 = h + 1; h2 < num_heroes; h2++) {
+                    if (!legal_for_any_lineup(h2, num_e_teams, e_legals_b))
+                        continue;
+
+                    u64 legals_bb[num_teams];
+                    hero_out_of_team_update(h2, num_teams, legals_b, legals_bb);
+                    u64 e_legals_bb[num_e_teams];
+                    hero_out_of_team_update(h2, num_e_teams, e_legals_b, e_legals_bb);
+
+                    flex_perft(num_e_teams, num_teams, e_legals_bb, legals_bb, stage + 2, end_stage, counts);
+                }
+            }
+            break;
+    }
+}
+
+
+//
+// Updates the legal actions of all team lineups where it's possible
+// to pick the given hero (the legal only equivalent of
+// hero_in_team_update), returning how many new lineups there are.
+//
+int legal_pick_update(int hero_num, int num_teams, u64 legals[], u64 new_legals[])
+{
+    int new_num_teams = 0;
+    u64 hero = 1ULL << hero_num;
+
+    for (int i = 0; i < num_teams; i++) {
+        if (legals[i] & hero) {
+            new_legals[new_num_teams] = legals[i] & h_infos[hero_num].diff_role_and_h;
+            new_num_teams += 1;
+        }
+    }
+
+    return new_num_teams;
+}
+
+
+//
+// Outer perft function. Takes the same starting state as run_search
+// and fills counts (indexed by stage) with the number of nodes in the
+// legal tree up to depth selections from the current stage.
+//
+void run_perft(
+    int num_teams_A,
+    int num_teams_B,
+    int team_A_size,
+    int team_B_size,
+    int banned_size,
+    int** start_teams_A,
+    int** start_teams_B,
+    int* banned,
+    int depth,
+    u64 counts[]
+)
+{
+    u64 legals_A[num_teams_A];
+    for (int i = 0; i < num_teams_A; i++) {
+        legals_A[i] = legal_bit_repr(
+            team_A_size,
+            team_B_size,
+            banned_size,
+            start_teams_A[i],
+            start_teams_B[0],
+            banned
+        );
+    }
+
+    u64 legals_B[num_teams_B];
+    for (int i = 0; i < num_teams_B; i++) {
+        legals_B[i] = legal_bit_repr(
+            team_B_size,
+            team_A_size,
+            banned_size,
+            start_teams_B[i],
+            start_teams_A[0],
+            banned
+        );
+    }
+
+    for (int stage = 0; stage <= MAX_DRAFT_LEN; stage++) {
+        counts[stage] = 0;
+    }
+
+    int stage = team_A_size + team_B_size + banned_size;
+    int end_stage = stage + depth < draft_len ? stage + depth : draft_len;
+    if (draft[stage].team == A)
+        flex_perft(num_teams_A, num_teams_B, legals_A, legals_B, stage, end_stage, counts);
+    else
+        flex_perft(num_teams_B, num_teams_A, legals_B, legals_A, stage, end_stage, counts);
+}
+
+
+//
+// Evaluate the role rewards a team gets from its own heroes.
+//
+int role_value(enum team team, u64 team_heroes)
+{
+    int value = 0;
+
+    for (int h = 0; h < num_heroes; h++) {
+        if ((team_heroes >> h) & 1)
+            value += (team == A) ? role_rs[h].A_value : role_rs[h].B_value;
+    }
+
+    return value;
+}
+
+
+//
+// Fill values with the value (from team A's perspective) of each of
+// team A's lineups against each of team B's, with lineup i vs lineup
+// j at i * num_teams_B + j. Used for choosing role assignments once
+// a draft is over. As for multi-lineup leaves in flex_negamax, role
+// and synergy values are found once per lineup leaving only counters
+// for each pair. Each team can have at most MAX_LINEUPS lineups.
+//
+void lineup_values(
+    int num_teams_A,
+    int num_teams_B,
+    const u64 teams_A[],
+    const u64 teams_B[],
+    int values[]
+)
+{
+    int B_values[MAX_LINEUPS];
+    for (int j = 0; j < num_teams_B; j++)
+        B_values[j] = role_value(B, teams_B[j]) + synergy_value(B, teams_B[j]);
+
+    for (int i = 0; i < num_teams_A; i++) {
+        int A_value = role_value(A, teams_A[i]) + synergy_value(A, teams_A[i]);
+
+        for (int j = 0; j < num_teams_B; j++) {
+            values[i * num_teams_B + j] = A_value - B_values[j]
+                + counter_value(num_counter_rs, counter_rs, teams_A[i], teams_B[j]);
+        }
+    }
+}
+
+
+// 
+// Turn array of hero nums into their bit representation.
+//
+u64 team_bit_repr(int team_size, int team_nums[])
+{
+    u64 team = 0;  // start with empty team
+
+    for (int i = 0; i < team_size; i++) {
+        team |= (1ULL << team_nums[i]);
+    }
+
+    return team;
+}
+
+
+// 
+// Get the legal actions for a team in bit representation given 
+// arrays of hero nums for team, enemy and bans.
+//
+u64 legal_bit_repr(
+    int team_size,
+    int e_team_size,
+    int banned_size,
+    int team_nums[],
+    int e_team_nums[],
+    int banned_nums[]
+)
+{
+    u64 legal = 0xFFFFFFFFFFFFFFFF;  // init all heroes as legal
+
+    // remove team heroes (and their shared roles and flex nums)
+    for (int i = 0; i < team_size; i++) {
+        legal &= h_infos[team_nums[i]].diff_role_and_h;
+    }
+
+    // remove selected enemy heroes (including flex nums)
+    for (int i = 0; i < e_team_size; i++) {
+        legal &= h_infos[e_team_nums[i]].diff_h;
+    }
+
+    // remove banned heroes (including flex nums)
+    for (int i = 0; i < banned_size; i++) {
+        legal &= h_infos[banned_nums[i]].diff_h;
+    }
+
+    return legal;
+}
+
+
+//
+// XOR the zobrist keys for each hero in a set of team picks
+// or all bans.
+//
+u64 init_hash(int team_or_ban, int hero_nums_size, int hero_nums[])
+{
+    u64 hash = 0ULL;
+
+    for (int i = 0; i < hero_nums_size; i++) {
+        hash ^= zobrist_keys[team_or_ban][hero_nums[i]];
+    }
 
     return hash;
 }
@@ -1565,108 +2922,499 @@ int init_rr_value(int team, int hero_nums_size, int hero_nums[])
 
 
 // ======================================================================
-// I need a way to go from receiving a draft format and set of rewards in
-// python to initialising the global variables required for calling
-// searches. For now having python do most of the processing and 
-// initialising individual elements seems easiest. However, I may want to 
-// change this @Later. The following are used in the __init__ of the
-// python DraftAI wrapper class.
-
-void set_role_r(int hero_num, int A_value, int B_value)
+// Set up of the global variables required for calling searches. Python
+// does most of the processing (see the DraftAI wrapper class) and then
+// passes everything in a single load_engine call.
+
+void load_engine(const struct engine_spec *spec)
 {
-    role_rs[hero_num].A_value = A_value;
-    role_rs[hero_num].B_value = B_value;
-}
+    num_heroes = spec->num_heroes;
+    for (int i = 0; i < num_heroes; i++) {
+        role_rs[i].A_value = spec->A_role_values[i];
+        role_rs[i].B_value = spec->B_role_values[i];
+        h_infos[i].diff_role_and_h = ~spec->same_role_and_h[i];
+        h_infos[i].diff_h = ~spec->same_h[i];
+    }
 
+    num_synergy_rs = spec->num_synergy_rs;
+    for (int i = 0; i < num_synergy_rs; i++) {
+        synergy_rs[i].heroes = spec->synergy_heroes[i];
+        synergy_rs[i].A_value = spec->synergy_A_values[i];
+        synergy_rs[i].B_value = spec->synergy_B_values[i];
+    }
 
-void set_synergy_r(int i, int heroes_size, int hero_nums[], int A_value, int B_value)
-{
-    synergy_rs[i].heroes = team_bit_repr(heroes_size, hero_nums);
-    synergy_rs[i].A_value = A_value;
-    synergy_rs[i].B_value = B_value;
+    num_counter_rs = spec->num_counter_rs;
+    for (int i = 0; i < num_counter_rs; i++) {
+        counter_rs[i].heroes = spec->counter_heroes[i];
+        counter_rs[i].foes = spec->counter_foes[i];
+        counter_rs[i].A_value = spec->counter_A_values[i];
+        counter_rs[i].B_value = spec->counter_B_values[i];
+    }
+
+    draft_len = spec->draft_len;
+    for (int stage = 0; stage < draft_len; stage++) {
+        draft[stage].team = spec->draft_teams[stage];
+        draft[stage].selection = spec->draft_selections[stage];
+    }
 }
 
 
-void set_counter_r(int i, int heroes_size, int hero_nums[], int foes_size, 
-                   int foe_nums[], int A_value, int B_value)
+void set_sides_switched(int switched)
 {
-    counter_rs[i].heroes = team_bit_repr(heroes_size, hero_nums);
-    counter_rs[i].foes = team_bit_repr(foes_size, foe_nums);
-    counter_rs[i].A_value = A_value;
-    counter_rs[i].B_value = B_value;
+    sides_switched = switched;
 }
 
+// ======================================================================
+
 
-void set_draft_stage(int stage, int team, int selection)
+//
+// Stop (1) or allow (0) search. See search_stopped.
+//
+void stop_search(int stop)
 {
-    draft[stage].team = team;
-    draft[stage].selection = selection;
+    search_stopped = stop;
 }
 
 
-void set_h_info(int hero_num, int same_role_and_h_size, int same_role_and_h_nums[],
-                int same_h_size, int same_h_nums[])
+//
+// Clear transposition table to run search with new reward values. Any
+// mapped table file is unmapped first so it is never wiped.
+//
+void clear_tt()
 {
-    h_infos[hero_num].diff_role_and_h = ~team_bit_repr(same_role_and_h_size,
-                                                       same_role_and_h_nums);
-    h_infos[hero_num].diff_h = ~team_bit_repr(same_h_size, same_h_nums);
+    unmap_tt_file();
+    free(tt_memory);
+    tt_memory = NULL;
+    tt = NULL;
 }
 
-
-void set_sizes(int heroes, int synergy_rs, int counter_rs, int draft)
+//
+// Allocate an empty transposition table if there isn't one (or a file
+// mapped), which must be done before running search. Zeroed memory is
+// requested so, for a table this size, the OS only provides pages as
+// they are first touched. Returns 0 if out of memory.
+//
+int alloc_tt()
 {
-    num_heroes = heroes;
-    num_synergy_rs = synergy_rs;
-    num_counter_rs = counter_rs;
-    draft_len = draft;
+    if (tt == NULL) {
+        tt_memory = calloc(TT_IDX_BITS + 1, sizeof(struct tt_entry));
+        tt = tt_memory;
+    }
+    return tt != NULL;
 }
 
-void set_zobrist_key(int team_or_ban, int hero_num, u64 key)
+//
+// Checksum (64 bit FNV-1a over whole words) used to detect corrupted
+// transposition table files.
+//
+u64 tt_checksum(const u64 keys[], const struct tt_entry entries[], u64 num_entries)
 {
-    zobrist_keys[team_or_ban][hero_num] = key;
-}
+    u64 hash = 0xcbf29ce484222325ULL;
+    for (int i = 0; i < 3 * MAX_NUM_HEROES; i++) {
+        hash = (hash ^ keys[i]) * 0x100000001b3ULL;
+    }
 
-// ======================================================================
+    const u64 *words = (const u64 *) entries;
+    for (u64 i = 0; i < num_entries; i++) {
+        hash = (hash ^ words[i]) * 0x100000001b3ULL;
+    }
+    return hash;
+}
 
 
 //
-// Clear transposition table to run search with new reward values.
+// Header describing everything a saved transposition table depends on
+// for the currently set globals and the given fingerprint (identifying
+// the rewards and hero nums they were translated to).
 //
-void clear_tt()
+struct tt_file_header tt_file_header(const unsigned char fingerprint[])
 {
-    for (u64 i = 0; i < TT_IDX_BITS + 1; i++) {
-        tt[i].tag = 0;
+    struct tt_file_header header;
+    memset(&header, 0, sizeof(header));  // no uninitialised padding in file
+
+    header.magic = TT_FILE_MAGIC;
+    header.version = TT_FILE_VERSION;
+    header.tt_size = TT_IDX_BITS + 1;
+    header.max_tt_stage = MAX_TT_STAGE;
+    header.max_num_heroes = MAX_NUM_HEROES;
+    header.num_heroes = num_heroes;
+    header.draft_len = draft_len;
+    for (int stage = 0; stage < draft_len; stage++) {
+        header.draft_teams[stage] = draft[stage].team;
+        header.draft_selections[stage] = draft[stage].selection;
     }
+    memcpy(header.fingerprint, fingerprint, TT_FINGERPRINT_SIZE);
+    return header;
+}
+
+
+//
+// Returns whether the header of a saved transposition table file is
+// usable with the current globals and the expected fingerprint.
+//
+int check_tt_file_header(const struct tt_file_header *header, const unsigned char fingerprint[])
+{
+    struct tt_file_header expected = tt_file_header(fingerprint);
+    if (header->magic != expected.magic)
+        return TT_FILE_BAD_MAGIC;
+    if (header->version != expected.version)
+        return TT_FILE_BAD_VERSION;
+    if (header->tt_size != expected.tt_size
+            || header->max_tt_stage != expected.max_tt_stage
+            || header->max_num_heroes != expected.max_num_heroes)
+        return TT_FILE_INCOMPATIBLE;
+    if (header->num_heroes != expected.num_heroes
+            || header->draft_len != expected.draft_len
+            || memcmp(header->draft_teams, expected.draft_teams, sizeof(header->draft_teams))
+            || memcmp(header->draft_selections, expected.draft_selections, sizeof(header->draft_selections))
+            || memcmp(header->fingerprint, expected.fingerprint, TT_FINGERPRINT_SIZE))
+        return TT_FILE_MISMATCH;
+    return TT_FILE_OK;
 }
 
+
 //
 // Save the transposition table, and the zobrist keys used to access it,
-// to the given file for later reuse.
+// to the given file for later reuse. A header is written first so that
+// loading can check the file is for the same draft and rewards.
 //
-int write_tt_and_zobrist_keys(const char *filename)
+int write_tt_and_zobrist_keys(const char *filename, const unsigned char fingerprint[])
 {
     int num_keys = 3 * MAX_NUM_HEROES;
     int num_tt_entries = TT_IDX_BITS + 1;
+    if (!alloc_tt())
+        return 0;
     FILE *f = fopen(filename, "wb");
+    if (f == NULL)
+        return 0;
+
+    struct tt_file_header header = tt_file_header(fingerprint);
+    header.checksum = tt_checksum(&zobrist_keys[0][0], tt, num_tt_entries);
+
+    int header_w = fwrite(&header, sizeof(header), 1, f);
     int keys_w = fwrite(zobrist_keys, sizeof(u64), num_keys, f);
     int tt_entries_w = fwrite(tt, sizeof(struct tt_entry), num_tt_entries, f);
+    int closed = fclose(f) == 0;
+    return header_w == 1 && keys_w == num_keys && tt_entries_w == num_tt_entries && closed;
+}
+
+//
+// Read the zobrist keys and entries of a saved transposition table file
+// into the given buffers after checking it against the current globals
+// and expected fingerprint. Returns a tt_file_status.
+//
+int read_tt_file(const char *filename, const unsigned char fingerprint[],
+                 u64 keys[], struct tt_entry entries[])
+{
+    int num_keys = 3 * MAX_NUM_HEROES;
+    int num_tt_entries = TT_IDX_BITS + 1;
+    FILE *f = fopen(filename, "rb");
+    if (f == NULL)
+        return TT_FILE_NOT_FOUND;
+
+    struct tt_file_header header;
+    if (fread(&header, sizeof(header), 1, f) != 1) {
+        fclose(f);
+        return TT_FILE_TRUNCATED;
+    }
+
+    int status = check_tt_file_header(&header, fingerprint);
+    if (status != TT_FILE_OK) {
+        fclose(f);
+        return status;
+    }
+
+    int keys_r = fread(keys, sizeof(u64), num_keys, f);
+    int tt_entries_r = fread(entries, sizeof(struct tt_entry), num_tt_entries, f);
+    int extra = fgetc(f) != EOF;
     fclose(f);
-    return keys_w == num_keys && tt_entries_w == num_tt_entries;
+
+    if (keys_r != num_keys || tt_entries_r != num_tt_entries)
+        return TT_FILE_TRUNCATED;
+    if (extra || tt_checksum(keys, entries, num_tt_entries) != header.checksum)
+        return TT_FILE_CORRUPT;
+    return TT_FILE_OK;
 }
 
 // 
 // Load a previously saved transposition table, and the zobrist keys used
 // to access it, from the given file, ready to be used for running search.
+// The file is fully read and checked against the current globals and
+// expected fingerprint before anything is changed, so on failure the
+// current table and keys are left as they were. Returns a tt_file_status.
 //
-int read_tt_and_zobrist_keys(const char *filename)
+int read_tt_and_zobrist_keys(const char *filename, const unsigned char fingerprint[])
 {
     int num_keys = 3 * MAX_NUM_HEROES;
     int num_tt_entries = TT_IDX_BITS + 1;
-    FILE *f = fopen(filename, "rb");
-    int keys_r = fread(zobrist_keys, sizeof(u64), num_keys, f);
-    int tt_entries_r = fread(tt, sizeof(struct tt_entry), num_tt_entries, f);
-    fclose(f);
-    return keys_r == num_keys && tt_entries_r == num_tt_entries;
+    u64 *keys = malloc(num_keys * sizeof(u64));
+    struct tt_entry *entries = malloc(num_tt_entries * sizeof(struct tt_entry));
+    int status = TT_FILE_NO_MEMORY;
+    if (keys != NULL && entries != NULL)
+        status = read_tt_file(filename, fingerprint, keys, entries);
+
+    if (status == TT_FILE_OK) {
+        clear_tt();  // unmaps so a mapped file isn't overwritten
+        memcpy(zobrist_keys, keys, num_keys * sizeof(u64));
+        tt_memory = entries;  // read entries become the table
+        tt = tt_memory;
+        entries = NULL;
+    }
+    free(keys);
+    free(entries);
+    return status;
+}
+
+//
+// Combine an entry from another table (stored with the same zobrist
+// keys) into the table at the given index. Search always replaces, but
+// here neither entry is known to be more recent so the more useful one
+// is kept: for the same state, an exact value over a bound, the tighter
+// of two bounds of the same type and an exact value if an upper and
+// lower bound meet; for different states (sharing a slot), an exact
+// value over a bound and otherwise the entry already in the table.
+//
+void merge_tt_entry(u64 idx, struct tt_entry entry)
+{
+    struct tt_entry *current = &tt[idx & TT_IDX_BITS];
+    if (entry.tag == 0 || tt_read_only)
+        return;
+
+    if (current->tag == 0) {
+        *current = entry;
+    } else if (current->tag != entry.tag) {
+        if (entry.flag == EXACT && current->flag != EXACT)
+            *current = entry;
+    } else if (current->flag == EXACT) {
+        return;
+    } else if (entry.flag == EXACT) {
+        *current = entry;
+    } else if (current->flag == entry.flag) {
+        if ((entry.flag == LOWERBOUND && entry.value > current->value)
+                || (entry.flag == UPPERBOUND && entry.value < current->value))
+            current->value = entry.value;
+    } else if (current->value == entry.value) {
+        current->flag = EXACT;  // value is both a lower and upper bound
+    }
+}
+
+//
+// Merge entries previously returned by get_tt_entries into the table.
+//
+int merge_tt_entries(int n, const unsigned int idxs[], const u64 words[])
+{
+    struct tt_entry entry;
+    if (!alloc_tt())
+        return 0;
+    for (int i = 0; i < n; i++) {
+        memcpy(&entry, &words[i], sizeof(u64));
+        merge_tt_entry(idxs[i], entry);
+    }
+    return 1;
+}
+
+//
+// Merge the entries of a saved transposition table file into the table
+// (see merge_tt_entry) so that knowledge from separate searches on the
+// same rewards accumulates. The file must use the current zobrist keys.
+// Returns a tt_file_status.
+//
+int merge_tt_file(const char *filename, const unsigned char fingerprint[])
+{
+    int num_keys = 3 * MAX_NUM_HEROES;
+    int num_tt_entries = TT_IDX_BITS + 1;
+    u64 *keys = malloc(num_keys * sizeof(u64));
+    struct tt_entry *entries = malloc(num_tt_entries * sizeof(struct tt_entry));
+    int status = TT_FILE_NO_MEMORY;
+    if (keys != NULL && entries != NULL)
+        status = read_tt_file(filename, fingerprint, keys, entries);
+
+    if (status == TT_FILE_OK && memcmp(keys, zobrist_keys, num_keys * sizeof(u64)))
+        status = TT_FILE_KEYS_DIFFER;
+    if (status == TT_FILE_OK && !alloc_tt())
+        status = TT_FILE_NO_MEMORY;
+
+    if (status == TT_FILE_OK) {
+        for (int i = 0; i < num_tt_entries; i++) {
+            merge_tt_entry(i, entries[i]);
+        }
+    }
+    free(keys);
+    free(entries);
+    return status;
+}
+
+
+//
+// Loosen every entry into a bound that still holds after the rewards
+// change such that the value of any complete draft changes by at most
+// max_change. The value of every state then also changes by at most
+// max_change, so lower bounds are lowered and upper bounds raised by it
+// (exact values are kept as lower bounds). Entries whose bound would
+// pass INF are removed.
+//
+void widen_tt_entries(int max_change)
+{
+    if (tt == NULL)
+        return;
+    for (u64 i = 0; i < TT_IDX_BITS + 1; i++) {
+        if (tt[i].tag == 0)
+            continue;
+
+        int value;
+        if (tt[i].flag == UPPERBOUND) {
+            value = tt[i].value + max_change;
+        } else {
+            value = tt[i].value - max_change;
+            tt[i].flag = LOWERBOUND;
+        }
+
+        if (value > INF || value < -INF)
+            tt[i].tag = 0;
+        else
+            tt[i].value = value;
+    }
+}
+
+
+//
+// Use a previously saved transposition table file directly as the
+// table by mapping it into memory, so that none of it has to be read
+// up front and (in read only or shared mode) processes using the same
+// file share its pages. The zobrist keys are still copied. To keep
+// this near instant the checksum is not verified, unlike when reading.
+//
+// In shared mode stored entries are written back to the file by the
+// OS (sync_tt_file forces this and updates the checksum), in private
+// mode they only go to copy-on-write pages and in read only mode
+// search doesn't store anything. On failure the current table and
+// keys are left as they were. Returns a tt_file_status.
+//
+int map_tt_file(const char *filename, const unsigned char fingerprint[], int mode)
+{
+#ifdef _WIN32
+    return TT_FILE_MAP_FAILED;
+#else
+    size_t keys_size = 3 * MAX_NUM_HEROES * sizeof(u64);
+    size_t entries_size = (TT_IDX_BITS + 1) * sizeof(struct tt_entry);
+    size_t file_size = sizeof(struct tt_file_header) + keys_size + entries_size;
+
+    int fd = open(filename, mode == TT_MAP_SHARED ? O_RDWR : O_RDONLY);
+    if (fd == -1)
+        return TT_FILE_NOT_FOUND;
+
+    struct stat st;
+    struct tt_file_header header;
+    int status = TT_FILE_OK;
+    if (fstat(fd, &st) == -1)
+        status = TT_FILE_MAP_FAILED;
+    else if (pread(fd, &header, sizeof(header), 0) != sizeof(header))
+        status = TT_FILE_TRUNCATED;
+    else
+        status = check_tt_file_header(&header, fingerprint);
+
+    if (status == TT_FILE_OK && (size_t) st.st_size != file_size)
+        status = (size_t) st.st_size < file_size ? TT_FILE_TRUNCATED : TT_FILE_CORRUPT;
+
+    void *map = MAP_FAILED;
+    if (status == TT_FILE_OK) {
+        int prot = mode == TT_MAP_READ_ONLY ? PROT_READ : PROT_READ | PROT_WRITE;
+        int flags = mode == TT_MAP_PRIVATE ? MAP_PRIVATE : MAP_SHARED;
+        map = mmap(NULL, file_size, prot, flags, fd, 0);
+        if (map == MAP_FAILED)
+            status = TT_FILE_MAP_FAILED;
+    }
+    close(fd);  // mapping stays valid
+    if (status != TT_FILE_OK)
+        return status;
+
+    unmap_tt_file();
+    memcpy(zobrist_keys, (char *) map + sizeof(struct tt_file_header), keys_size);
+    tt_map = map;
+    tt_map_size = file_size;
+    tt_map_mode = mode;
+    tt = (struct tt_entry *) ((char *) map + sizeof(struct tt_file_header) + keys_size);
+    tt_read_only = mode == TT_MAP_READ_ONLY;
+    return TT_FILE_OK;
+#endif
+}
+
+//
+// Write all entries stored in a table file mapped in shared mode back
+// to the file, updating its checksum. Returns 1 on success.
+//
+int sync_tt_file()
+{
+#ifdef _WIN32
+    return 0;
+#else
+    if (tt_map == NULL || tt_map_mode != TT_MAP_SHARED)
+        return 0;
+
+    struct tt_file_header *header = tt_map;
+    header->checksum = tt_checksum(&zobrist_keys[0][0], tt, TT_IDX_BITS + 1);
+    return msync(tt_map, tt_map_size, MS_SYNC) == 0;
+#endif
+}
+
+//
+// Go back to using the in memory table (whose entries are stale so
+// should be cleared or read in next) if a table file is mapped.
+//
+void unmap_tt_file()
+{
+#ifndef _WIN32
+    if (tt_map != NULL)
+        munmap(tt_map, tt_map_size);
+#endif
+    tt_map = NULL;
+    tt = tt_memory;
+    tt_read_only = 0;
+}
+
+//
+// Copy the populated entries with indexes in [start, end) to the given
+// arrays (each entry as a packed 64 bit word) returning how many there
+// are, so that a table can be saved without its empty slots.
+//
+int get_tt_entries(int start, int end, unsigned int idxs[], u64 words[])
+{
+    int n = 0;
+    if (tt == NULL)
+        return 0;
+    for (int i = start; i < end; i++) {
+        if (tt[i].tag != 0) {
+            idxs[n] = i;
+            memcpy(&words[n], &tt[i], sizeof(u64));
+            n++;
+        }
+    }
+    return n;
+}
+
+//
+// Set entries previously returned by get_tt_entries (the table should
+// be cleared first as other slots are left as they are). Returns 0 if
+// out of memory.
+//
+int set_tt_entries(int n, const unsigned int idxs[], const u64 words[])
+{
+    if (!alloc_tt())
+        return 0;
+    for (int i = 0; i < n; i++) {
+        memcpy(&tt[idxs[i] & TT_IDX_BITS], &words[i], sizeof(u64));
+    }
+    return 1;
+}
+
+void get_zobrist_keys(u64 keys[])
+{
+    memcpy(keys, zobrist_keys, sizeof(zobrist_keys));
+}
+
+void set_zobrist_keys(const u64 keys[])
+{
+    memcpy(zobrist_keys, keys, sizeof(zobrist_keys));
 }
 
 //
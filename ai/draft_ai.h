@@ -2,6 +2,8 @@
 #define MAX_SYNERGY_RS 50
 #define MAX_COUNTER_RS 50  
 #define MAX_DRAFT_LEN 24
+#define MAX_LINEUPS 120  // most role assignments for a team (5!)
+#define MIN_ROOT_SPLIT_LEFT 8  // selections left for a batch search to be split between threads
 
 #define INF 32000
 
@@ -22,6 +24,54 @@ typedef unsigned long long u64;
 // longer to evaluate are less likely to be replaced).
 #define TT_IDX_BITS 0xFFFFFULL
 #define MAX_TT_STAGE 7
+#define SWITCHED_SIDES_KEY 0x9E3779B97F4A7C15ULL  // any random bits will do
+#define FLEX_ROOT_A_KEY 0xD1B54A32D192ED03ULL     // for states with multiple lineups
+#define FLEX_ROOT_B_KEY 0x8CB92BA72F3D8DD7ULL     // (see flex_hash)
+
+// Saved transposition table files start with a header holding all
+// that the table depends on so that loading one made for a different
+// draft, set of rewards or engine build fails instead of silently
+// returning wrong values. The zobrist keys and entries follow it.
+#define TT_FILE_MAGIC 0x31545444494E4D4FULL  // "OMNIDTT1" as little endian bytes
+#define TT_FILE_VERSION 1
+#define TT_FINGERPRINT_SIZE 32
+
+struct tt_file_header
+{
+    u64 magic;
+    int version;
+    int tt_size;
+    int max_tt_stage;
+    int max_num_heroes;
+    int num_heroes;
+    int draft_len;
+    int draft_teams[MAX_DRAFT_LEN];
+    int draft_selections[MAX_DRAFT_LEN];
+    unsigned char fingerprint[TT_FINGERPRINT_SIZE];  // set by caller to identify rewards
+    u64 checksum;  // of zobrist keys and entries
+};
+
+enum tt_file_status
+{
+    TT_FILE_OK = 0,
+    TT_FILE_NOT_FOUND = 1,
+    TT_FILE_TRUNCATED = 2,
+    TT_FILE_BAD_MAGIC = 3,
+    TT_FILE_BAD_VERSION = 4,
+    TT_FILE_INCOMPATIBLE = 5,  // different engine build (e.g. TT size)
+    TT_FILE_MISMATCH = 6,      // different draft or rewards
+    TT_FILE_CORRUPT = 7,
+    TT_FILE_NO_MEMORY = 8,
+    TT_FILE_MAP_FAILED = 9,    // or mapping isn't supported
+    TT_FILE_KEYS_DIFFER = 10,  // can't be merged as zobrist keys don't match
+};
+
+enum tt_map_mode
+{
+    TT_MAP_READ_ONLY = 0,  // shared between processes and nothing is stored
+    TT_MAP_PRIVATE = 1,    // copy-on-write so stores never reach the file
+    TT_MAP_SHARED = 2,     // stores are written back to the file
+};
 
 enum tt_flag
 {
@@ -72,6 +122,19 @@ struct h_info
 };
 
 
+// The lineups of the selecting team (and legals of the enemy's) after
+// a selection at some stage. Each search thread has one for each stage
+// to use instead of allocating arrays for every child.
+struct lineup_frame
+{
+    u64 teams[MAX_LINEUPS];
+    u64 legals[MAX_LINEUPS];
+    int rr_values[MAX_LINEUPS];
+    u64 hashes[MAX_LINEUPS];
+    u64 e_legals[MAX_LINEUPS];
+};
+
+
 // Draft format.
 enum team 
 {
@@ -98,12 +161,61 @@ struct draft_stage
 };
 
 
+// Everything the engine needs for a set of rewards and draft format as
+// packed arrays (with rewards and hero info as bitmasks) so that it can
+// all be set by load_engine in a single call.
+struct engine_spec
+{
+    int num_heroes;
+    const int *A_role_values;
+    const int *B_role_values;
+    int num_synergy_rs;
+    const u64 *synergy_heroes;
+    const int *synergy_A_values;
+    const int *synergy_B_values;
+    int num_counter_rs;
+    const u64 *counter_heroes;
+    const u64 *counter_foes;
+    const int *counter_A_values;
+    const int *counter_B_values;
+    int draft_len;
+    const int *draft_teams;
+    const int *draft_selections;
+    const u64 *same_role_and_h;  // per hero num (diff_role_and_h is its complement)
+    const u64 *same_h;
+};
+
+
 // returned by outer search function
 struct search_result
 {
     int value;
     int best_hero;
     int best_hero_2;  // only applies for stages with a double selection
+    u64 nodes;        // total nodes visited during search
+    int num_pv;       // number of root actions written to pv
+};
+
+// a starting state for run_search_batch (lineups are given one after
+// another as team_size hero nums each)
+struct search_input
+{
+    int num_teams_A;
+    int num_teams_B;
+    int team_A_size;
+    int team_B_size;
+    int banned_size;
+    int *teams_A;
+    int *teams_B;
+    int *banned;
+};
+
+// a root action and its exact value (for multi-PV searches)
+struct root_action
+{
+    int value;
+    int hero;
+    int hero_2;  // -1 for single selections
 };
 
 
@@ -138,9 +250,13 @@ int negamax(
     u64 hash,
     int stage,
     int alpha,
-    int beta
+    int beta,
+    u64 *nodes
 );
 int terminal_value(u64 team_A, u64 team_B);
+int synergy_value(enum team team, u64 team_heroes);
+int counter_value(int n, struct counter_r rs[], u64 team_A, u64 team_B);
+u64 flex_hash(int num_teams, int num_e_teams, u64 hashes[], u64 e_hashes[], u64 bans_hash);
 int flex_negamax(
     int num_teams,
     int num_e_teams,
@@ -155,7 +271,8 @@ int flex_negamax(
     u64 bans_hash,
     int stage,
     int alpha,
-    int beta
+    int beta,
+    u64 *nodes
 );
 int *init_team_heroes(u64 team, int *team_ptr);
 int hero_in_team_update(
@@ -172,6 +289,14 @@ int hero_in_team_update(
     u64 new_hashes[]
 );
 void hero_out_of_team_update(int hero_num, int num_teams, u64 legals[], u64 new_legals[]);
+int prune_lineups(
+    enum team team,
+    int num_teams,
+    u64 teams[],
+    u64 legals[],
+    int rr_values[],
+    u64 hashes[]
+);
 struct search_result root_negamax(
     int num_teams,
     int num_e_teams,
@@ -184,7 +309,57 @@ struct search_result root_negamax(
     u64 hashes[],
     u64 e_hashes[],
     u64 bans_hash,
-    int stage
+    int stage,
+    int num_pv,
+    struct root_action pv[]
+);
+int pv_bound(struct search_result* ret, int num_pv, struct root_action pv[]);
+void add_root_action(
+    struct search_result* ret,
+    int num_pv,
+    struct root_action pv[],
+    int value,
+    int hero,
+    int hero_2,
+    int unordered
+);
+int same_action(struct root_action action, int hero, int hero_2, int unordered);
+int same_hero(int hero_num, int other_num);
+int find_pv(
+    int num_teams,
+    int num_e_teams,
+    u64 teams[],
+    u64 e_teams[],
+    u64 legals[],
+    u64 e_legals[],
+    int rr_values[],
+    int e_rr_values[],
+    u64 hashes[],
+    u64 e_hashes[],
+    u64 bans_hash,
+    int stage,
+    int value,
+    int line[],
+    u64 *nodes
+);
+int apply_action(
+    int hero_num,
+    int pick,
+    enum team selecting_team,
+    int num_teams,
+    int num_e_teams,
+    u64 teams[],
+    u64 legals[],
+    int rr_values[],
+    u64 hashes[],
+    u64 e_legals[],
+    u64 bans_hash,
+    u64 new_teams[],
+    u64 new_legals[],
+    int new_rr_values[],
+    u64 new_hashes[],
+    u64 new_e_legals[],
+    u64* new_bans_hash
 );
 struct search_result run_search(
     int num_teams_A,
@@ -194,10 +369,66 @@ struct search_result run_search(
     int banned_size,
     int** start_teams_A,
     int** start_teams_B,
-    int* banned
+    int* banned,
+    int num_pv,
+    struct root_action pv[],
+    int pv_lines[]
+);
+void run_search_batch(int num_searches, const struct search_input inputs[], struct search_result results[]);
+struct search_result search_input(struct search_input input);
+int search_input_stage(struct search_input input);
+void init_combo_hero_nums();
+struct search_result search_from(
+    int num_teams_A,
+    int num_teams_B,
+    int team_A_size,
+    int team_B_size,
+    int banned_size,
+    int** start_teams_A,
+    int** start_teams_B,
+    int* banned,
+    int num_pv,
+    struct root_action pv[],
+    int pv_lines[]
+);
+
+// perft (node counting without pruning)
+void perft(u64 legal, u64 e_legal, int stage, int end_stage, u64 counts[]);
+void flex_perft(
+    int num_teams,
+    int num_e_teams,
+    u64 legals[],
+    u64 e_legals[],
+    int stage,
+    int end_stage,
+    u64 counts[]
+);
+int legal_pick_update(int hero_num, int num_teams, u64 legals[], u64 new_legals[]);
+void run_perft(
+    int num_teams_A,
+    int num_teams_B,
+    int team_A_size,
+    int team_B_size,
+    int banned_size,
+    int** start_teams_A,
+    int** start_teams_B,
+    int* banned,
+    int depth,
+    u64 counts[]
+);
+
+// lineup evaluation
+int role_value(enum team team, u64 team_heroes);
+void lineup_values(
+    int num_teams_A,
+    int num_teams_B,
+    const u64 teams_A[],
+    const u64 teams_B[],
+    int values[]
 );
 
 // helpers
+u64 any_lineup_legals(int num_teams, u64 legals[]);
 int legal_for_any_lineup(int hero_num, int num_teams, u64 legals[]);
 u64 team_bit_repr(int team_size, int team_nums[]);
 u64 legal_bit_repr(
@@ -213,18 +444,29 @@ int init_rr_value(int team, int hero_nums_size, int hero_nums[]);
 
 
 // set up functions used to init all global variables required for search
-void set_role_r(int hero_num, int A_value, int B_value);
-void set_synergy_r(int i, int heroes_size, int hero_nums[], int A_value, int B_value);
-void set_counter_r(int i, int heroes_size, int hero_nums[], int foes_size, 
-                   int foe_nums[], int A_value, int B_value);
-void set_draft_stage(int stage, int team, int selection);
-void set_h_info(int hero_num, int same_role_and_h_size, int same_role_and_h_nums[],
-                int same_h_size, int same_h_nums[]);
-void set_sizes(int heroes, int synergy_rs, int counter_rs, int draft);
-void set_zobrist_key(int team_or_ban, int hero_num, u64 key);
+void load_engine(const struct engine_spec *spec);
+void set_sides_switched(int switched);
 
 
+void stop_search(int stop);
 void clear_tt();
-int write_tt_and_zobrist_keys(const char *filename);
-int read_tt_and_zobrist_keys(const char *filename);
+int alloc_tt();
+u64 tt_checksum(const u64 keys[], const struct tt_entry entries[], u64 num_entries);
+struct tt_file_header tt_file_header(const unsigned char fingerprint[]);
+int check_tt_file_header(const struct tt_file_header *header, const unsigned char fingerprint[]);
+int write_tt_and_zobrist_keys(const char *filename, const unsigned char fingerprint[]);
+int read_tt_file(const char *filename, const unsigned char fingerprint[],
+                 u64 keys[], struct tt_entry entries[]);
+int read_tt_and_zobrist_keys(const char *filename, const unsigned char fingerprint[]);
+void merge_tt_entry(u64 idx, struct tt_entry entry);
+int merge_tt_entries(int n, const unsigned int idxs[], const u64 words[]);
+int merge_tt_file(const char *filename, const unsigned char fingerprint[]);
+void widen_tt_entries(int max_change);
+int map_tt_file(const char *filename, const unsigned char fingerprint[], int mode);
+int sync_tt_file();
+void unmap_tt_file();
+int get_tt_entries(int start, int end, unsigned int idxs[], u64 words[]);
+int set_tt_entries(int n, const unsigned int idxs[], const u64 words[]);
+void get_zobrist_keys(u64 keys[]);
+void set_zobrist_keys(const u64 keys[]);
 struct constants_s get_constants();
@@ -0,0 +1,97 @@
+"""
+Seeded generators for the canonical reward sets and histories used by the
+benchmark suite.
+
+Follows the same approach as Draft._generate_rewards in the old draft
+simulator (test/draft_az/draft_az.py), but every knob is exposed and all
+randomness comes from the supplied Random instance so that each benchmark
+case is reproducible across machines and commits.
+"""
+
+from ai.draft_ai import RoleR, SynergyR, CounterR, MAX_NUM_HEROES, ROLES
+
+
+def halving_weights(n):
+    return [2**(-x) for x in range(1, n + 1)]
+
+
+def generate_rewards(rng, num_heroes, synergy_density, counter_density, flex_ratio):
+    """
+    Returns role, synergy and counter rewards for num_heroes heroes (named
+    '0', '1', ...). Each hero gets a primary role with an extra role given
+    to flex_ratio of them (limited by MAX_NUM_HEROES hero-role nums). The
+    number of synergies and counters are their density multiplied by the
+    number of heroes. Combo rewards only apply to a hero's primary role so
+    that each translates into exactly one AI reward.
+    """
+    num_flex = min(int(num_heroes * flex_ratio), MAX_NUM_HEROES - num_heroes)
+    if num_flex < 0:
+        raise ValueError(f"Max of {MAX_NUM_HEROES} heroes supported")
+
+    # Spread heroes evenly across the roles and let a sample play another.
+    heroes = [str(h) for h in range(num_heroes)]
+    hero_roles = {hero: [h % len(ROLES)] for h, hero in enumerate(heroes)}
+    for hero in rng.sample(heroes, num_flex):
+        hero_roles[hero].append(rng.choice([r for r in ROLES if r not in hero_roles[hero]]))
+
+    def rand_team_values():
+        assignment = rng.randrange(4)
+        if assignment == 0:
+            # Both teams receive same reward value.
+            value = rng.randint(0, 1000)
+            return value, value
+        elif assignment == 1:
+            # Each team receives a different value.
+            return rng.randint(0, 1000), rng.randint(0, 1000)
+        elif assignment == 2:
+            # Just team A receives a value.
+            return rng.randint(0, 1000), 0
+        else:
+            # Just team B receives a value.
+            return 0, rng.randint(0, 1000)
+
+    role_rs = []
+    for hero in heroes:
+        for role in hero_roles[hero]:
+            role_rs.append(RoleR(hero, role, *rand_team_values()))
+
+    def primary(hero):
+        return (hero, hero_roles[hero][:1])
+
+    # Synergies between heroes of different primary roles.
+    synergy_sizes = range(2, len(ROLES) + 1)
+    synergy_rs = []
+    synergies = set()
+    for size in rng.choices(synergy_sizes, halving_weights(len(synergy_sizes)),
+                            k=int(num_heroes * synergy_density)):
+        roles_involved = rng.sample(ROLES, size)
+        synergy = frozenset(rng.choice(heroes[role::len(ROLES)]) for role in roles_involved)
+        if synergy not in synergies:
+            synergies.add(synergy)
+            synergy_rs.append(SynergyR([primary(h) for h in sorted(synergy)], *rand_team_values()))
+
+    # Counters between any disjoint groups of heroes.
+    counter_sizes = range(1, 3)
+    counter_rs = []
+    counters = set()
+    for _ in range(int(num_heroes * counter_density)):
+        team_size, foes_size = rng.choices(counter_sizes, halving_weights(len(counter_sizes)), k=2)
+        sample = rng.sample(heroes, team_size + foes_size)
+        counter = (frozenset(sample[:team_size]), frozenset(sample[team_size:]))
+        if counter not in counters:
+            counters.add(counter)
+            counter_rs.append(CounterR(
+                [primary(h) for h in sorted(counter[0])],
+                [primary(h) for h in sorted(counter[1])],
+                *rand_team_values(),
+            ))
+
+    return role_rs, synergy_rs, counter_rs
+
+
+def random_history(rng, draft_ai, length):
+    """Returns a random legal history of the given length."""
+    history = []
+    for _ in range(length):
+        history.append(rng.choice(sorted(draft_ai.selectable_heroes(history))))
+    return history
@@ -0,0 +1,223 @@
+"""
+Reproducible benchmark suite for the draft AI engine.
+
+Runs DraftAI.run_search for a fixed set of seeded reward sets, draft formats
+and history lengths, recording wall time, nodes and nodes per second (NPS)
+as JSON so results can be compared between commits:
+
+    python bench/run_bench.py --out before.json
+    ...
+    python bench/run_bench.py --out after.json --compare before.json
+
+With --perft, DraftAI.perft is run instead of search, walking the full
+legal tree (no pruning) to measure raw move generation speed.
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+from collections import namedtuple
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src', 'main', 'python'))
+
+from ai.draft_ai import DraftAI, A, B, PICK, BAN
+from bench.reward_gen import generate_rewards, random_history
+
+
+RewardConfig = namedtuple('RewardConfig', ['num_heroes', 'synergy_density', 'counter_density', 'flex_ratio'])
+
+REWARD_CONFIGS = {
+    'sparse':   RewardConfig(30, 0.2, 0.2, 0.1),
+    'standard': RewardConfig(40, 0.3, 0.3, 0.2),
+    'no_flex':  RewardConfig(40, 0.3, 0.3, 0.0),
+    'dense':    RewardConfig(40, 1.0, 1.0, 0.2),
+    'flex':     RewardConfig(32, 0.3, 0.3, 1.0),
+}
+
+FORMATS = {
+    # picks only with alternating double picks
+    'picks_10': [
+        (A, PICK), (B, PICK), (B, PICK), (A, PICK), (A, PICK),
+        (B, PICK), (B, PICK), (A, PICK), (A, PICK), (B, PICK),
+    ],
+    # same as the app's current format
+    'standard_14': [
+        (A, BAN), (B, BAN), (A, BAN), (B, BAN),
+        (A, PICK), (B, PICK), (B, PICK), (A, PICK), (A, PICK),
+        (B, PICK), (B, PICK), (A, PICK), (A, PICK), (B, PICK),
+    ],
+    # covers the pick then ban, ban then pick and double ban selections
+    'mixed_16': [
+        (A, BAN), (B, BAN), (A, PICK), (B, PICK), (B, PICK), (A, PICK),
+        (A, BAN), (B, BAN), (B, BAN), (A, BAN), (A, PICK), (B, PICK),
+        (B, PICK), (A, PICK), (A, PICK), (B, PICK),
+    ],
+}
+
+# number of selections left in the draft when search is run
+REMAINING = (6, 8, 9)
+DEEP_REMAINING = (10,)
+PERFT_REMAINING = (4, 6)  # full tree grows too quickly to go further
+
+NUM_HISTORIES = 2
+
+
+def git_commit():
+    try:
+        out = subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            capture_output=True,
+            text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        )
+        return out.stdout.strip() or None
+    except OSError:
+        return None
+
+
+def case_setup(config_name, format_name, remaining, history_num):
+    """
+    Returns the name, a new DraftAI (so the TT starts empty) and a history
+    for a case. The zobrist keys are derived from the rewards so every run
+    of a case does the same work.
+    """
+    config = REWARD_CONFIGS[config_name]
+    draft_format = FORMATS[format_name]
+    seed = f"{config_name}/{format_name}/{remaining}/{history_num}"
+
+    rewards = generate_rewards(random.Random(config_name), *config)
+    draft_ai = DraftAI(draft_format, *rewards)
+    history = random_history(random.Random(seed), draft_ai, len(draft_format) - remaining)
+    return seed, draft_ai, history
+
+
+def bench_case(config_name, format_name, remaining, history_num, perft=False):
+    """Runs search (or perft) from a seeded history and returns a dict of its results."""
+    name, draft_ai, history = case_setup(config_name, format_name, remaining, history_num)
+
+    start = time.perf_counter()
+    if perft:
+        result = draft_ai.perft(history, remaining)
+    else:
+        result = draft_ai.run_search(history)
+    seconds = time.perf_counter() - start
+
+    nodes = sum(result) if perft else draft_ai.last_search_nodes
+    return {
+        'name': name,
+        'rewards': config_name,
+        'format': format_name,
+        'remaining': remaining,
+        'history': history,
+        'result': list(result),
+        'seconds': seconds,
+        'nodes': nodes,
+        'nps': nodes / seconds if seconds > 0 else None,
+    }
+
+
+def run_suite(config_names, format_names, remainings, repeat, perft=False):
+    cases = []
+    for config_name in config_names:
+        for format_name in format_names:
+            for remaining in remainings:
+                for history_num in range(NUM_HISTORIES):
+                    # keep fastest of repeats to reduce timing noise
+                    runs = [bench_case(config_name, format_name, remaining, history_num, perft)
+                            for _ in range(repeat)]
+                    case = min(runs, key=lambda run: run['seconds'])
+                    print("{:<32} {:>8.3f}s {:>13,} nodes {:>13,.0f} nps".format(
+                        case['name'], case['seconds'], case['nodes'], case['nps'] or 0,
+                    ))
+                    cases.append(case)
+    total_seconds = sum(case['seconds'] for case in cases)
+    total_nodes = sum(case['nodes'] for case in cases)
+    return {
+        'commit': git_commit(),
+        'mode': 'perft' if perft else 'search',
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'machine': {
+            'platform': platform.platform(),
+            'python': platform.python_version(),
+            'cpus': os.cpu_count(),
+            'omp_num_threads': os.environ.get('OMP_NUM_THREADS'),
+        },
+        'cases': cases,
+        'total': {
+            'seconds': total_seconds,
+            'nodes': total_nodes,
+            'nps': total_nodes / total_seconds if total_seconds > 0 else None,
+        },
+    }
+
+
+def compare(results, baseline):
+    """Print the change in time, nodes and NPS of each case vs a baseline."""
+    base_cases = {case['name']: case for case in baseline['cases']}
+    print(f"\nvs baseline {baseline.get('commit')} ({baseline.get('timestamp')}):")
+
+    def ratio(new, base):
+        return new / base if base else float('nan')
+
+    totals = {'seconds': [0, 0], 'nodes': [0, 0]}
+    for case in results['cases']:
+        base = base_cases.get(case['name'])
+        if base is None:
+            continue
+        for key in totals:
+            totals[key][0] += case[key]
+            totals[key][1] += base[key]
+        flag = "" if case['result'] == base['result'] else "  RESULT CHANGED"
+        print("{:<32} time x{:<7.2f} nodes x{:<7.2f} nps x{:<7.2f}{}".format(
+            case['name'],
+            ratio(case['seconds'], base['seconds']),
+            ratio(case['nodes'], base['nodes']),
+            ratio(case['nps'] or 0, base['nps']),
+            flag,
+        ))
+
+    # totals only include cases present in both runs
+    (seconds, base_seconds), (nodes, base_nodes) = totals['seconds'], totals['nodes']
+    print("{:<32} time x{:<7.2f} nodes x{:<7.2f} nps x{:<7.2f}".format(
+        'TOTAL',
+        ratio(seconds, base_seconds),
+        ratio(nodes, base_nodes),
+        ratio(ratio(nodes, seconds), ratio(base_nodes, base_seconds)),
+    ))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rewards', nargs='+', choices=REWARD_CONFIGS, default=list(REWARD_CONFIGS))
+    parser.add_argument('--formats', nargs='+', choices=FORMATS, default=list(FORMATS))
+    parser.add_argument('--remaining', nargs='+', type=int, default=None,
+                        help=f"selections left when searching (default {REMAINING})")
+    parser.add_argument('--deep', action='store_true', help=f"also run with {DEEP_REMAINING} remaining")
+    parser.add_argument('--perft', action='store_true', help="count the full legal tree instead of searching")
+    parser.add_argument('--repeat', type=int, default=1, help="runs per case (fastest is kept)")
+    parser.add_argument('--out', help="write results as JSON to this file")
+    parser.add_argument('--compare', help="JSON results file from a previous run to compare against")
+    args = parser.parse_args()
+
+    if args.perft:
+        remainings = args.remaining or PERFT_REMAINING
+    else:
+        remainings = args.remaining or (REMAINING + (DEEP_REMAINING if args.deep else ()))
+    results = run_suite(args.rewards, args.formats, remainings, args.repeat, args.perft)
+
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+
+
+if __name__ == '__main__':
+    main()
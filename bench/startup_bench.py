@@ -0,0 +1,77 @@
+"""
+Benchmark of the draft AI's start up cost, as paid by the app before its
+window appears and on the first search.
+
+Each run is a fresh interpreter (so nothing is already imported) that
+times importing ai.draft_ai, constructing the first DraftAI and running
+the first search, with the median of all runs printed:
+
+    python bench/startup_bench.py --runs 20 --out startup.json
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+CHILD = """
+import json, random, sys, time
+sys.path.insert(0, {root!r})
+sys.path.insert(0, {src!r})
+
+start = time.perf_counter()
+import ai.draft_ai
+imported = time.perf_counter()
+
+from bench.reward_gen import generate_rewards, random_history
+from bench.run_bench import FORMATS, REWARD_CONFIGS
+rewards = generate_rewards(random.Random('standard'), *REWARD_CONFIGS['standard'])
+draft_format = FORMATS['standard_14']
+
+start_construct = time.perf_counter()
+draft_ai = ai.draft_ai.DraftAI(draft_format, *rewards)
+constructed = time.perf_counter()
+
+history = random_history(random.Random('startup'), draft_ai, len(draft_format) - 6)
+start_search = time.perf_counter()
+draft_ai.run_search(history)
+searched = time.perf_counter()
+
+print(json.dumps({{
+    'import': imported - start,
+    'construct': constructed - start_construct,
+    'first_search': searched - start_search,
+}}))
+"""
+
+STEPS = ('import', 'construct', 'first_search')
+
+
+def run_once():
+    child = CHILD.format(root=ROOT, src=os.path.join(ROOT, 'src', 'main', 'python'))
+    out = subprocess.run([sys.executable, '-c', child], capture_output=True, text=True, check=True)
+    return json.loads(out.stdout)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=10, help="fresh interpreters to time")
+    parser.add_argument('--out', help="write results as JSON to this file")
+    args = parser.parse_args()
+
+    runs = [run_once() for _ in range(args.runs)]
+    medians = {step: statistics.median(run[step] for run in runs) for step in STEPS}
+    for step in STEPS:
+        print("{:<14} {:>8.2f} ms".format(step, medians[step] * 1000))
+
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump({'runs': runs, 'median': medians}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -36,15 +36,28 @@ ffibuilder.cdef(
     struct constants_s get_constants();
 
     // initialiser set up functions
-    void set_role_r(int hero_num, int A_value, int B_value);
-    void set_synergy_r(int i, int heroes_size, int hero_nums[], int A_value, int B_value);
-    void set_counter_r(int i, int heroes_size, int hero_nums[], int foes_size, 
-                       int foe_nums[], int A_value, int B_value);
-    void set_draft_stage(int stage, int team, int selection);
-    void set_h_info(int hero_num, int same_role_and_h_size, int same_role_and_h_nums[],
-                    int same_h_size, int same_h_nums[]);
-    void set_sizes(int heroes, int synergy_rs, int counter_rs, int draft);
-    void set_zobrist_key(int team_or_ban, int hero_num, u64 key);
+    struct engine_spec
+    {
+        int num_heroes;
+        const int *A_role_values;
+        const int *B_role_values;
+        int num_synergy_rs;
+        const u64 *synergy_heroes;
+        const int *synergy_A_values;
+        const int *synergy_B_values;
+        int num_counter_rs;
+        const u64 *counter_heroes;
+        const u64 *counter_foes;
+        const int *counter_A_values;
+        const int *counter_B_values;
+        int draft_len;
+        const int *draft_teams;
+        const int *draft_selections;
+        const u64 *same_role_and_h;  // per hero num (diff_role_and_h is its complement)
+        const u64 *same_h;
+    };
+    void load_engine(const struct engine_spec *spec);
+    void set_sides_switched(int switched);
 
     // search
     struct search_result
@@ -52,6 +65,25 @@ ffibuilder.cdef(
         int value;
         int best_hero;
         int best_hero_2;  // only applies for stages with a double selection
+        u64 nodes;        // total nodes visited during search
+        int num_pv;       // number of root actions written to pv
+    };
+    struct root_action
+    {
+        int value;
+        int hero;
+        int hero_2;  // -1 for single selections
+    };
+    struct search_input
+    {
+        int num_teams_A;
+        int num_teams_B;
+        int team_A_size;
+        int team_B_size;
+        int banned_size;
+        int *teams_A;
+        int *teams_B;
+        int *banned;
     };
     struct search_result run_search(
         int num_teams_A,
@@ -61,13 +93,76 @@ ffibuilder.cdef(
         int banned_size,
         int** start_teams_A,
         int** start_teams_B,
-        int* banned
+        int* banned,
+        int num_pv,
+        struct root_action pv[],
+        int pv_lines[]
+    );
+    void run_search_batch(int num_searches, const struct search_input inputs[], struct search_result results[]);
+
+    // perft (node counting without pruning)
+    void run_perft(
+        int num_teams_A,
+        int num_teams_B,
+        int team_A_size,
+        int team_B_size,
+        int banned_size,
+        int** start_teams_A,
+        int** start_teams_B,
+        int* banned,
+        int depth,
+        u64 counts[]
+    );
+
+    // lineup evaluation
+    void lineup_values(
+        int num_teams_A,
+        int num_teams_B,
+        const u64 teams_A[],
+        const u64 teams_B[],
+        int values[]
     );
 
     // utils
+    enum tt_file_status
+    {
+        TT_FILE_OK = 0,
+        TT_FILE_NOT_FOUND = 1,
+        TT_FILE_TRUNCATED = 2,
+        TT_FILE_BAD_MAGIC = 3,
+        TT_FILE_BAD_VERSION = 4,
+        TT_FILE_INCOMPATIBLE = 5,
+        TT_FILE_MISMATCH = 6,
+        TT_FILE_CORRUPT = 7,
+        TT_FILE_NO_MEMORY = 8,
+        TT_FILE_MAP_FAILED = 9,
+        TT_FILE_KEYS_DIFFER = 10,
+    };
+    enum tt_map_mode
+    {
+        TT_MAP_READ_ONLY = 0,
+        TT_MAP_PRIVATE = 1,
+        TT_MAP_SHARED = 2,
+    };
+    #define TT_IDX_BITS ...
+    struct tt_file_header { ...; };
+    void stop_search(int stop);
     void clear_tt();
-    int write_tt_and_zobrist_keys(const char *filename);
-    int read_tt_and_zobrist_keys(const char *filename);
+    int alloc_tt();
+    int write_tt_and_zobrist_keys(const char *filename, const unsigned char fingerprint[]);
+    int read_tt_and_zobrist_keys(const char *filename, const unsigned char fingerprint[]);
+    int merge_tt_file(const char *filename, const unsigned char fingerprint[]);
+    void widen_tt_entries(int max_change);
+    int map_tt_file(const char *filename, const unsigned char fingerprint[], int mode);
+    int sync_tt_file();
+    void unmap_tt_file();
+    struct tt_file_header tt_file_header(const unsigned char fingerprint[]);
+    int check_tt_file_header(const struct tt_file_header *header, const unsigned char fingerprint[]);
+    int get_tt_entries(int start, int end, unsigned int idxs[], u64 words[]);
+    int set_tt_entries(int n, const unsigned int idxs[], const u64 words[]);
+    int merge_tt_entries(int n, const unsigned int idxs[], const u64 words[]);
+    void get_zobrist_keys(u64 keys[]);
+    void set_zobrist_keys(const u64 keys[]);
     """
 )
 
@@ -0,0 +1,80 @@
+"""
+Constants of the draft AI C engine (defined in draft_ai.h) mirrored in
+Python so they can be used without loading the engine, which is only
+done when first needed (see ai.engine). check_constants is run when it
+is loaded to ensure they are consistent.
+"""
+
+# max sizes
+MAX_NUM_HEROES = 64
+MAX_SYNERGY_RS = 50
+MAX_COUNTER_RS = 50
+MAX_DRAFT_LEN  = 24
+
+# teams / zobrist table indices
+A         = 0
+B         = 1
+BAN_KEYS  = 2
+
+# selection types
+PICK      = 0
+BAN       = 1
+PICK_PICK = 2
+PICK_BAN  = 3
+BAN_PICK  = 4
+BAN_BAN   = 5
+
+INF = 32000
+
+TT_IDX_BITS = 0xFFFFF
+MAX_TT_STAGE = 7
+
+# tt_file_status
+TT_FILE_OK           = 0
+TT_FILE_NOT_FOUND    = 1
+TT_FILE_TRUNCATED    = 2
+TT_FILE_BAD_MAGIC    = 3
+TT_FILE_BAD_VERSION  = 4
+TT_FILE_INCOMPATIBLE = 5
+TT_FILE_MISMATCH     = 6
+TT_FILE_CORRUPT      = 7
+TT_FILE_NO_MEMORY    = 8
+TT_FILE_MAP_FAILED   = 9
+TT_FILE_KEYS_DIFFER  = 10
+
+# tt_map_mode
+TT_MAP_READ_ONLY = 0
+TT_MAP_PRIVATE   = 1
+TT_MAP_SHARED    = 2
+
+
+def check_constants(lib):
+    """
+    Raise a RuntimeError if any constant differs from the value used by
+    the engine (i.e. draft_ai.h was changed without updating this file).
+    """
+    c = lib.get_constants()
+    engine_values = {
+        'MAX_NUM_HEROES': c.max_num_heroes,
+        'MAX_SYNERGY_RS': c.max_synergy_rs,
+        'MAX_COUNTER_RS': c.max_counter_rs,
+        'MAX_DRAFT_LEN': c.max_draft_len,
+        'A': c.a,
+        'B': c.b,
+        'BAN_KEYS': c.ban_keys,
+        'PICK': c.pick,
+        'BAN': c.ban,
+        'PICK_PICK': c.pick_pick,
+        'PICK_BAN': c.pick_ban,
+        'BAN_PICK': c.ban_pick,
+        'BAN_BAN': c.ban_ban,
+        'INF': c.inf,
+        'MAX_TT_STAGE': c.max_tt_stage,
+    }
+    for name in globals():
+        if name.startswith(('TT_IDX_BITS', 'TT_FILE_', 'TT_MAP_')):
+            engine_values[name] = getattr(lib, name)
+
+    differ = [name for name, value in engine_values.items() if globals()[name] != value]
+    if differ:
+        raise RuntimeError(f"Constants differ from the engine's: {', '.join(differ)}")
@@ -1,40 +1,49 @@
 """ Initial prep and interface for using the draft AI C engine. """
 
+import array
 from collections import namedtuple
+import hashlib
 import itertools
+import json
+import os
+import queue
 import random
+import threading
+
+from ai.constants import (
+    MAX_NUM_HEROES, MAX_SYNERGY_RS, MAX_COUNTER_RS, MAX_DRAFT_LEN,
+    A, B, BAN_KEYS,
+    PICK, BAN, PICK_PICK, PICK_BAN, BAN_PICK, BAN_BAN,
+    INF, MAX_TT_STAGE,
+    TT_FILE_OK, TT_FILE_NOT_FOUND, TT_FILE_TRUNCATED, TT_FILE_BAD_MAGIC, TT_FILE_BAD_VERSION,
+    TT_FILE_INCOMPATIBLE, TT_FILE_MISMATCH, TT_FILE_CORRUPT, TT_FILE_NO_MEMORY,
+    TT_FILE_MAP_FAILED, TT_FILE_KEYS_DIFFER,
+    TT_MAP_READ_ONLY, TT_MAP_PRIVATE, TT_MAP_SHARED,
+)
+from ai.engine import ffi, lib  # C engine is loaded once first used
+from ai.role_asgmts import has_role_asgmt, role_asgmts
+from ai.tt_file import is_sparse_tt_file, read_sparse_tt, write_sparse_tt
 
-from ai._draft_ai import ffi, lib
-
-
-constants = lib.get_constants()  # defined in draft_ai.h and returned to ensure consistency
-
-# max sizes
-MAX_NUM_HEROES = constants.max_num_heroes
-MAX_SYNERGY_RS = constants.max_synergy_rs
-MAX_COUNTER_RS = constants.max_counter_rs  
-MAX_DRAFT_LEN  = constants.max_draft_len
-
-# teams / zobrist table indices
-A         = constants.a
-B         = constants.b
-BAN_KEYS  = constants.ban_keys
-
-# selection types
-PICK      = constants.pick
-BAN       = constants.ban
-PICK_PICK = constants.pick_pick
-PICK_BAN  = constants.pick_ban
-BAN_PICK  = constants.ban_pick
-BAN_BAN   = constants.ban_ban
-
-INF = constants.inf
-
-MAX_TT_STAGE = constants.max_tt_stage
 
 PICKS = {PICK, PICK_PICK, PICK_BAN}
 BANS = {BAN, BAN_PICK, BAN_BAN}
 
+ALL_ACTIONS = -1  # for run_search to return every root action
+
+# reasons a TT file can fail to load
+TT_FILE_ERRORS = {
+    TT_FILE_NOT_FOUND: "file could not be opened",
+    TT_FILE_TRUNCATED: "file is truncated",
+    TT_FILE_BAD_MAGIC: "not a TT file",
+    TT_FILE_BAD_VERSION: "unsupported TT file version",
+    TT_FILE_INCOMPATIBLE: "saved by an engine with different TT constants",
+    TT_FILE_MISMATCH: "saved for a different draft format or rewards",
+    TT_FILE_CORRUPT: "checksum does not match",
+    TT_FILE_NO_MEMORY: "not enough memory to load",
+    TT_FILE_MAP_FAILED: "could not be mapped into memory",
+    TT_FILE_KEYS_DIFFER: "saved with different zobrist keys",
+}
+
 ZOBRIST_BITS = 64
 ROLES = range(5)
 
@@ -50,22 +59,29 @@ CounterR = namedtuple('CounterR', ['heroes', 'foes', 'A_value', 'B_value'])
 class Hero:
     """Represents a unique hero-role combination."""
 
-    def __init__(self, role_r, all_synergy_rs, all_counter_rs):
+    def __init__(self, role_r, synergy_rs, counter_rs):
+        """
+        Takes the hero's role reward and the synergy and counter rewards
+        it is one of the heroes of (see index_rewards).
+        """
         self.name = role_r.hero_name
         self.role = role_r.role
         self.A_role_value = role_r.A_value
         self.B_role_value = role_r.B_value
-        self.synergy_rs = self.find_rewards(all_synergy_rs)
-        self.counter_rs = self.find_rewards(all_counter_rs)
+        self.synergy_rs = synergy_rs
+        self.counter_rs = counter_rs
 
         self.potential = self.calculate_potential()
 
-    def find_rewards(self, all_rewards):
-        rewards = []
+    # Map each hero-role to the rewards (in the order given) it is one of
+    # the heroes of in a single pass rather than a scan per hero-role.
+    @staticmethod
+    def index_rewards(all_rewards):
+        rewards = {}
         for r in all_rewards:
             for hero_name, appl_roles in r.heroes:
-                if self.name == hero_name and self.role in appl_roles:
-                    rewards.append(r)
+                for role in set(appl_roles):
+                    rewards.setdefault((hero_name, role), []).append(r)
         return rewards
 
     # Simple approach that just totals all reward values.
@@ -83,6 +99,115 @@ class Hero:
         return potential
 
 
+# Background (ponder) searches are run one at a time on a single daemon
+# thread shared by all DraftAI objects as they use the same C memory.
+_ponder_queue = queue.Queue()
+_ponder_thread = None
+_ponder_stopping = False
+_pondering_ai = None
+
+
+def _ponder_worker():
+    while True:
+        draft_ai, history, roles, keys = _ponder_queue.get()
+        try:
+            result, _ = draft_ai._search(history, None, True, roles)
+            # results are meaningless if stopped during the search
+            if not _ponder_stopping:
+                for key in keys:
+                    draft_ai._ponder_results[key] = result
+        finally:
+            _ponder_queue.task_done()
+
+
+def wait_for_pondering():
+    """Block until all background searches have finished."""
+    _ponder_queue.join()
+
+
+def stop_pondering():
+    """
+    Stop any background searches, waiting for the running one to return.
+    Results from already finished searches are kept.
+    """
+
+    global _ponder_stopping, _pondering_ai
+    if _pondering_ai is None:
+        return
+    _ponder_stopping = True
+    try:
+        while True:
+            _ponder_queue.get_nowait()
+            _ponder_queue.task_done()
+    except queue.Empty:
+        pass
+    lib.stop_search(1)
+    _ponder_queue.join()
+    lib.stop_search(0)
+    _ponder_stopping = False
+    _pondering_ai = None
+
+
+def _check_rewards(role_rs, synergy_rs, counter_rs):
+    if len(role_rs) > MAX_NUM_HEROES:
+        raise ValueError(f"Max of {MAX_NUM_HEROES} role_rs supported")
+
+    def check_value(value):
+        if not isinstance(value, int):
+            raise TypeError("Invalid team value: must be an int")
+        if value < 0 or value > 1000:
+            # 1000 picked as users can than use 0 to 10 with 2 decimal
+            # places. Can also safely assume it will never exceed INF.
+            raise ValueError("Invalid team value: must be in range [0, 1000]")
+
+    for r in itertools.chain(role_rs, synergy_rs, counter_rs):
+        if isinstance(r, RoleR) and r.role not in ROLES:
+            raise ValueError("Roles must be an integer from 0 to 4")
+        check_value(r.A_value)
+        check_value(r.B_value)
+
+
+def reward_key(r):
+    """
+    Returns what identifies a reward regardless of its values: its type
+    and heroes (with their applicable roles).
+    """
+    def heroes(hs):
+        return tuple(sorted((hero_name, tuple(sorted(roles))) for hero_name, roles in hs))
+
+    if isinstance(r, RoleR):
+        return ('role', r.hero_name, r.role)
+    elif isinstance(r, SynergyR):
+        return ('synergy', heroes(r.heroes))
+    else:
+        return ('counter', heroes(r.heroes), heroes(r.foes))
+
+
+def reward_changes(old_rs, new_rs):
+    """
+    Returns the (added, removed, changed) rewards, as taken by
+    DraftAI.update_rewards, for going from one list of rewards (of any
+    types) to another.
+    """
+    old = {reward_key(r): r for r in old_rs}
+    new = {reward_key(r): r for r in new_rs}
+    added = [r for key, r in new.items() if key not in old]
+    removed = [r for key, r in old.items() if key not in new]
+    changed = [r for key, r in new.items() if key in old and r != old[key]]
+    return added, removed, changed
+
+
+# Packed C arrays for the engine's set up, viewing the memory of an
+# array.array so values are converted in one go rather than per item.
+def _c_ints(values):
+    return ffi.from_buffer("int[]", array.array("i", values))
+
+
+def _c_bitmasks(hero_sets):
+    return ffi.from_buffer("u64[]", array.array("Q", [sum(1 << h for h in heroes)
+                                                      for heroes in hero_sets]))
+
+
 class DraftAI:
     """
     Abstracted interface for using the C draft AI engine. Once
@@ -91,37 +216,55 @@ class DraftAI:
     and action(s).
     """
 
-    def __init__(self, draft_format, role_rs, synergy_rs, counter_rs, tt_file=None):
+    def __init__(self, draft_format, role_rs, synergy_rs, counter_rs, tt_file=None,
+                 ponder_replies=0, results_cache=None, tt_map_mode=None):
         """
         Construct a DraftAI (defining the draft format and rewards it
-        will operate on for all future searches).
+        will operate on for all future searches). A saved tt_file is
+        loaded, or mapped into memory if a tt_map_mode is given (falling
+        back to loading if mapping isn't possible). If ponder_replies is
+        greater than 0 then searches for that many of the enemy's most
+        likely replies are run in the background after each search. If
+        a results_cache (SearchCache) is given then it is checked before
+        running any search and all new results are saved to it.
         """
+        _check_rewards(role_rs, synergy_rs, counter_rs)
 
-        if len(role_rs) > MAX_NUM_HEROES:
-            raise ValueError(f"Max of {MAX_NUM_HEROES} role_rs supported")
-
-        def check_value(value):
-            if not isinstance(value, int):
-                raise TypeError("Invalid team value: must be an int")
-            if value < 0 or value > 1000:
-                # 1000 picked as users can than use 0 to 10 with 2 decimal
-                # places. Can also safely assume it will never exceed INF.
-                raise ValueError("Invalid team value: must be in range [0, 1000]")
-
-        for r in itertools.chain(role_rs, synergy_rs, counter_rs):
-            if isinstance(r, RoleR) and r.role not in ROLES:
-                raise ValueError("Roles must be an integer from 0 to 4")
-            check_value(r.A_value)
-            check_value(r.B_value)
+        stop_pondering()  # before any C globals are changed
 
         self.draft_format = self.get_ai_draft_format(draft_format)
+        self.rewards = (list(role_rs), list(synergy_rs), list(counter_rs))
         self.init_ordered_heroes(role_rs, synergy_rs, counter_rs)
-        self._set_C_globals(synergy_rs, counter_rs, tt_file)
+        self._set_C_globals(synergy_rs, counter_rs)
+        self.sides_switched = False
+        self.fingerprint = self.reward_fingerprint()
+        self._tt_fingerprint = self._unswitched_tt_fingerprint()
+        self.last_tt_error = None
+        self._mapped_tt = None  # (path, mode) of TT file if mapped
+        if tt_file is None:
+            self._reset_tt()
+        elif not ((tt_map_mode is not None and self.map_tt(tt_file, tt_map_mode))
+                  or self.load_tt(tt_file)):
+            # fresh zobrist keys and an empty TT if the file isn't valid
+            self._reset_tt()
+        self.last_search_nodes = 0
+        self.ponder_replies = ponder_replies
+        self._ponder_results = {}  # (result, pv) from background searches keyed by history and role hints
+        self.results_cache = results_cache
 
     # Creates a unique 'hero' for each real hero-role combination and
     # orders them by most potential.
     def init_ordered_heroes(self, role_rs, synergy_rs, counter_rs):
-        heroes = [Hero(role_r, synergy_rs, counter_rs) for role_r in role_rs]
+        hero_synergy_rs = Hero.index_rewards(synergy_rs)
+        hero_counter_rs = Hero.index_rewards(counter_rs)
+        heroes = [
+            Hero(
+                role_r,
+                hero_synergy_rs.get((role_r.hero_name, role_r.role), []),
+                hero_counter_rs.get((role_r.hero_name, role_r.role), []),
+            )
+            for role_r in role_rs
+        ]
         heroes.sort(key=lambda hero: hero.potential, reverse=True)
         self.ordered_heroes = heroes
 
@@ -141,6 +284,14 @@ class DraftAI:
                 roles = [role for role in ROLES if (hero.name, role) in self.hero_nums]
                 self.hero_roles[hero.name] = roles
 
+        # hero name bit and roles bitmask for finding selectable heroes
+        self._hero_masks = {
+            hero_name: (1 << i, sum(1 << role for role in roles))
+            for i, (hero_name, roles) in enumerate(self.hero_roles.items())
+        }
+        # empty history where each team's only assignment has no roles
+        self._selection_cache = ([], [(0, (frozenset([0]), frozenset([0])))])
+
     # After heroes have been ordered, and additional ones created for
     # flex picks, synergy rewards using these hero nums can be created.
     # Multiple versions of a reward may be created if it contains heroes
@@ -152,10 +303,8 @@ class DraftAI:
         def valid_synergy_nums(heroes):
             valid = []
             hero_names, hero_roles = zip(*heroes)
-            for roles in itertools.product(*hero_roles):
-                if len(set(roles)) != len(heroes):
-                    # only sets of heroes in unique roles are valid
-                    continue
+            # only sets of heroes in unique roles are valid
+            for roles in role_asgmts(hero_roles):
                 synergy_nums = []
                 for hero_name, role in zip(hero_names, roles):
                     synergy_nums.append(self.hero_nums[(hero_name, role)])
@@ -187,12 +336,9 @@ class DraftAI:
             valid = []
             hero_names, hero_roles = zip(*heroes)
             foe_names, foe_roles = zip(*foes)
-            for roles_h in itertools.product(*hero_roles):
-                if len(set(roles_h)) != len(heroes):
-                    continue
-                for roles_f in itertools.product(*foe_roles):
-                    if len(set(roles_f)) != len(foes):
-                        continue
+            foe_role_asgmts = role_asgmts(foe_roles)
+            for roles_h in role_asgmts(hero_roles):
+                for roles_f in foe_role_asgmts:
                     counter_nums_h = []
                     for hero_name, role in zip(hero_names, roles_h):
                         counter_nums_h.append(self.hero_nums[(hero_name, role)])
@@ -251,13 +397,18 @@ class DraftAI:
     # All hero nums that are role variations of the same underlying hero
     # are given the same key for bans because a ban of any is equivalent
     # (unlike picks, bans don't effect the open roles a team then has).
+    #
+    # Keys are generated from the TT fingerprint so that every DraftAI for
+    # the same draft format and rewards uses the same keys, letting TTs
+    # saved from separate sessions be merged (see merge_tt).
     def generate_zobrist_keys(self):
+        rng = random.Random(self.tt_fingerprint())
         used = set()
 
         def unique_key():
-            key = random.getrandbits(ZOBRIST_BITS)
-            while key in used:                          # single chance of getting duplicate is less
-                key = random.getrandbits(ZOBRIST_BITS)  # than 1e-15%, but better safe than sorry
+            key = rng.getrandbits(ZOBRIST_BITS)
+            while key in used:                       # single chance of getting duplicate is less
+                key = rng.getrandbits(ZOBRIST_BITS)  # than 1e-15%, but better safe than sorry
             return key
 
         # every hero num gets a unique key for picks
@@ -277,93 +428,284 @@ class DraftAI:
 
         return pick_keys_A, pick_keys_B, ban_keys
 
-    # Saves the transposition table (and the zobrist keys used to represent
-    # states inside the transposition table) to the specified file so that
-    # it can be loaded for reuse at a later point. 
-    def save_tt(self, filename):
-        c_filename = ffi.new("char[]", filename.encode("ascii"))
-        ret = lib.write_tt_and_zobrist_keys(c_filename)
-        return bool(ret)
+    def reward_fingerprint(self):
+        """
+        Returns a hash (hex string) identifying the draft format and the
+        translated rewards used for search. Only hero names, roles and
+        values are used (not hero nums or zobrist keys) so it is the same
+        on any machine and for any order the rewards are given in.
+        """
+
+        def hero(h):
+            return [self.ordered_heroes[h].name, self.ordered_heroes[h].role]
+
+        role_rs = sorted([hero.name, hero.role, hero.A_role_value, hero.B_role_value]
+                         for hero in self.ordered_heroes)
+        synergy_rs = sorted([sorted(map(hero, heroes)), A_value, B_value]
+                            for heroes, A_value, B_value in self.ai_synergy_rs)
+        counter_rs = sorted([sorted(map(hero, heroes)), sorted(map(hero, foes)), A_value, B_value]
+                            for heroes, foes, A_value, B_value in self.ai_counter_rs)
+        data = json.dumps([self.draft_format, role_rs, synergy_rs, counter_rs])
+        return hashlib.sha256(data.encode()).hexdigest()
+
+    # Fingerprint saved in the header of TT files. Hero nums are used to
+    # hash states so, unlike the reward fingerprint, this also depends on
+    # the order of heroes. The TT holds entries for both sides (see
+    # switch_sides) so it is always for the rewards as first given.
+    def tt_fingerprint(self):
+        return self._tt_fingerprint
+
+    def _unswitched_tt_fingerprint(self):
+        hero_nums = [[hero.name, hero.role] for hero in self.ordered_heroes]
+        data = json.dumps([self.fingerprint, hero_nums])
+        return hashlib.sha256(data.encode()).digest()
+
+    # Swap the A and B values of every reward, as if the teams had swapped
+    # sides in the draft, without losing anything cached in the TT. Entries
+    # for each orientation are kept apart by the engine (the team selecting
+    # at each stage differs so they are different positions) in the same
+    # TT, meaning searches after switching back reuse all earlier work and
+    # a single saved TT file serves both sides. Hero order only depends on
+    # the total of A and B values so hero nums don't change.
+    def switch_sides(self):
+        stop_pondering()
+        for hero in self.ordered_heroes:
+            hero.A_role_value, hero.B_role_value = hero.B_role_value, hero.A_role_value
+        self.ai_synergy_rs = [(heroes, B_value, A_value)
+                              for heroes, A_value, B_value in self.ai_synergy_rs]
+        self.ai_counter_rs = [(heroes, foes, B_value, A_value)
+                              for heroes, foes, A_value, B_value in self.ai_counter_rs]
+        self._load_engine()
+
+        self.sides_switched = not self.sides_switched
+        lib.set_sides_switched(self.sides_switched)
+        self.fingerprint = self.reward_fingerprint()  # results differ
+        self._ponder_results = {}
+
+    def update_rewards(self, added=(), removed=(), changed=()):
+        """
+        Add, remove and change the values of rewards (matched to current
+        ones by reward_key) without building a new DraftAI. Rewards are
+        as given to the constructor, even if sides have been switched.
+        Raises ValueError, leaving everything unchanged, if a removed or
+        changed reward doesn't exist or the new rewards aren't valid.
+
+        The TT is kept unless role rewards are added or removed (which
+        changes the heroes that can be selected) or it is mapped from a
+        file. Hero-roles keep their zobrist keys if the hero order
+        changes and, as the value of a draft can change by at most the
+        sum of the largest change to each reward, every entry is widened
+        into a bound that still holds (see widen_tt_entries in
+        draft_ai.c). Returns True if the TT was kept.
+        """
+        current = {reward_key(r): r for r in itertools.chain(*self.rewards)}
+        max_change = 0
+        for r in removed:
+            old_r = current.pop(reward_key(r), None)
+            if old_r is None:
+                raise ValueError(f"Reward to remove doesn't exist: {r}")
+            max_change += max(old_r.A_value, old_r.B_value)
+        for r in changed:
+            old_r = current.get(reward_key(r))
+            if old_r is None:
+                raise ValueError(f"Reward to change doesn't exist: {r}")
+            max_change += max(abs(r.A_value - old_r.A_value), abs(r.B_value - old_r.B_value))
+            current[reward_key(r)] = r
+        for r in added:
+            if reward_key(r) in current:
+                raise ValueError(f"Reward to add already exists: {r}")
+            max_change += max(r.A_value, r.B_value)
+            current[reward_key(r)] = r
+        role_rs = [r for r in current.values() if isinstance(r, RoleR)]
+        synergy_rs = [r for r in current.values() if isinstance(r, SynergyR)]
+        counter_rs = [r for r in current.values() if isinstance(r, CounterR)]
+        _check_rewards(role_rs, synergy_rs, counter_rs)
+
+        stop_pondering()  # before any C globals are changed
+        old_heroes = self.ordered_heroes
+        old_state = (self.ordered_heroes, self.hero_nums, self.hero_roles,
+                     self._hero_masks, self._selection_cache,
+                     self.ai_synergy_rs, self.ai_counter_rs)
+        try:
+            self.init_ordered_heroes(role_rs, synergy_rs, counter_rs)
+            self._set_C_globals(synergy_rs, counter_rs)  # translations raise before C is changed
+        except Exception:
+            (self.ordered_heroes, self.hero_nums, self.hero_roles,
+             self._hero_masks, self._selection_cache,
+             self.ai_synergy_rs, self.ai_counter_rs) = old_state
+            raise
+
+        sides_switched = self.sides_switched
+        self.rewards = (role_rs, synergy_rs, counter_rs)
+        self.sides_switched = False
+        self.fingerprint = self.reward_fingerprint()
+        self._tt_fingerprint = self._unswitched_tt_fingerprint()
+        self._ponder_results = {}
+
+        keep_tt = (self._mapped_tt is None and
+                   sorted(self.hero_nums) == sorted((hero.name, hero.role) for hero in old_heroes))
+        if keep_tt:
+            # give each hero-role its old keys so states still hash the same
+            keys = ffi.new("u64[]", 3 * MAX_NUM_HEROES)
+            lib.get_zobrist_keys(keys)
+            new_keys = ffi.new("u64[]", 3 * MAX_NUM_HEROES)
+            for old_num, hero in enumerate(old_heroes):
+                new_num = self.hero_nums[(hero.name, hero.role)]
+                for team in (A, B, BAN_KEYS):
+                    new_keys[team * MAX_NUM_HEROES + new_num] = keys[team * MAX_NUM_HEROES + old_num]
+            lib.set_zobrist_keys(new_keys)
+            if max_change:
+                lib.widen_tt_entries(max_change)
+        else:
+            self._reset_tt()
+
+        if sides_switched:
+            self.switch_sides()
+        return keep_tt
+
+    # Save the TT to a file. By default every slot is written so that the
+    # file can be mapped (see map_tt). If sparse, only populated entries
+    # are written, optionally compressed with "gzip" or "lzma" (which
+    # implies sparse), giving much smaller files after late stage
+    # searches. If the TT is the file mapped in shared mode then only the
+    # stored entries need to be written back. Otherwise it is written to
+    # a temporary file which then replaces the file, so a save is all or
+    # nothing and any process mapping the old file can keep using it.
+    def save_tt(self, filename, sparse=False, compression=None):
+        stop_pondering()  # the TT must not change while it is written
+        sparse = sparse or compression is not None
+        if not sparse and self._mapped_tt == (os.path.realpath(filename), TT_MAP_SHARED):
+            return bool(lib.sync_tt_file())
+
+        tmp_filename = f"{filename}.{os.getpid()}.tmp"
+        if sparse:
+            saved = write_sparse_tt(tmp_filename, self.tt_fingerprint(), compression)
+        else:
+            c_filename = ffi.new("char[]", tmp_filename.encode("ascii"))
+            saved = lib.write_tt_and_zobrist_keys(c_filename, self.tt_fingerprint())
+        if not saved:
+            if os.path.exists(tmp_filename):
+                os.remove(tmp_filename)
+            return False
+        os.replace(tmp_filename, filename)
+        return True
 
     # Load a transposition table (and the zobrist keys used to represent
     # states inside the transposition table) into memory, ready to be used
-    # for running search.
+    # for running search. Both dense and sparse files can be loaded.
     #
-    # @Important: A TT is only valid if being used with the exact same
-    # rewards that were used to populate it. There is currently no check for
-    # this so it is up to the caller to ensure correctness.
+    # A TT is only valid if being used with the exact same draft format
+    # and rewards that were used to populate it, so the file's header and
+    # checksum are validated first. If anything is wrong False is returned
+    # (with the reason in last_tt_error) and the current TT is untouched.
     def load_tt(self, filename):
+        stop_pondering()  # before the TT is replaced
+        if is_sparse_tt_file(filename):
+            status = read_sparse_tt(filename, self.tt_fingerprint())
+        else:
+            c_filename = ffi.new("char[]", filename.encode("ascii"))
+            status = lib.read_tt_and_zobrist_keys(c_filename, self.tt_fingerprint())
+        self.last_tt_error = TT_FILE_ERRORS.get(status)
+        if status == TT_FILE_OK:
+            self._mapped_tt = None
+        return status == TT_FILE_OK
+
+    # Merge the entries of a saved TT file (dense or sparse) into the
+    # current TT, so that what was learned by searches in other sessions
+    # on the same rewards is added rather than replacing what is already
+    # known. Where both have an entry for a slot the most useful is kept
+    # (an exact value over a bound, the tighter of two bounds, ...). The
+    # same checks as load_tt are done and the file must have been saved
+    # with the same zobrist keys (true for any TT saved for the same
+    # rewards). Returns False on failure, with the reason in last_tt_error.
+    def merge_tt(self, filename):
+        stop_pondering()  # before the TT is changed
+        if is_sparse_tt_file(filename):
+            status = read_sparse_tt(filename, self.tt_fingerprint(), merge=True)
+        else:
+            c_filename = ffi.new("char[]", filename.encode("ascii"))
+            status = lib.merge_tt_file(c_filename, self.tt_fingerprint())
+        self.last_tt_error = TT_FILE_ERRORS.get(status)
+        return status == TT_FILE_OK
+
+    # Use a saved TT file as the TT by mapping it into memory rather than
+    # reading it in, making it near instant to start and letting other
+    # processes share the same file. The mode decides what happens to new
+    # entries stored by search: with TT_MAP_READ_ONLY none are stored,
+    # with TT_MAP_PRIVATE they are only seen by this process and with
+    # TT_MAP_SHARED they are written back to the file (saving it becomes
+    # a sync of the changed pages). Only dense files can be mapped. The
+    # same checks as load_tt are done, other than verifying the checksum,
+    # with False returned on failure (including on platforms where
+    # mapping isn't supported).
+    def map_tt(self, filename, mode=TT_MAP_PRIVATE):
+        if mode not in (TT_MAP_READ_ONLY, TT_MAP_PRIVATE, TT_MAP_SHARED):
+            raise ValueError("Invalid TT map mode")
+
+        stop_pondering()  # before the TT is replaced
         c_filename = ffi.new("char[]", filename.encode("ascii"))
-        ret = lib.read_tt_and_zobrist_keys(c_filename)
-        return bool(ret)
+        status = lib.map_tt_file(c_filename, self.tt_fingerprint(), mode)
+        self.last_tt_error = TT_FILE_ERRORS.get(status)
+        if status == TT_FILE_OK:
+            self._mapped_tt = (os.path.realpath(filename), mode)
+        return status == TT_FILE_OK
+
+    # New zobrist keys and an empty TT.
+    def _reset_tt(self):
+        keys = self.generate_zobrist_keys()
+        # flattened in the layout of the engine's key table
+        padding = [0] * (MAX_NUM_HEROES - len(self.ordered_heroes))
+        lib.set_zobrist_keys(ffi.from_buffer("u64[]", array.array("Q", [
+            key
+            for team in (A, B, BAN_KEYS)
+            for key in keys[team] + padding
+        ])))
+
+        lib.clear_tt()  # ensure state values for old drafts aren't used
+        self._mapped_tt = None
 
     # Set the C global memory with all information required by the
-    # engine for running searches on a new set of rewards/draft format.
-    def _set_C_globals(self, synergy_rs, counter_rs, tt_file):
-
-        # role rewards
-        for hero_num, hero in enumerate(self.ordered_heroes):
-            lib.set_role_r(hero_num, hero.A_role_value, hero.B_role_value)
-
-        # synergy rewards
+    # engine for running searches on a new set of rewards/draft format.
+    def _set_C_globals(self, synergy_rs, counter_rs):
         self.ai_synergy_rs = self.translate_synergy_rs(synergy_rs)
-        for i, synergy_r in enumerate(self.ai_synergy_rs):
-            heroes, A_value, B_value = synergy_r
-            lib.set_synergy_r(i, len(heroes), heroes, A_value, B_value)
-
-        # counter rewards
         self.ai_counter_rs = self.translate_counter_rs(counter_rs)
-        for i, counter_r in enumerate(self.ai_counter_rs):
-            heroes, foes, A_value, B_value = counter_r
-            lib.set_counter_r(
-                i,
-                len(heroes),
-                heroes,
-                len(foes),
-                foes,
-                A_value,
-                B_value,
-            )
-
-        # draft format
-        for stage, (team, selection_type) in enumerate(self.draft_format):
-            lib.set_draft_stage(stage, team, selection_type)
+        self._load_engine()
+        lib.set_sides_switched(0)
 
-        # hero info for updating legal actions
+    # Pass the current rewards (from A's and B's perspectives), draft
+    # format and hero info to the engine with a single load_engine call.
+    def _load_engine(self):
         heroes_per_role = self.get_heroes_per_role()
         same_hero_refs = self.get_same_hero_refs()
-        for hero_num, hero in enumerate(self.ordered_heroes):
-            same_hero = same_hero_refs[hero_num]
-            same_role_and_hero = list(heroes_per_role[hero.role] | same_hero)
-            same_hero = list(same_hero)
-            lib.set_h_info(
-                hero_num,
-                len(same_role_and_hero),
-                same_role_and_hero,
-                len(same_hero),
-                same_hero,
-            )
-
-        # sizes
-        lib.set_sizes(
-            len(self.ordered_heroes),
-            len(self.ai_synergy_rs),
-            len(self.ai_counter_rs),
-            len(self.draft_format),
-        )
-
-        if tt_file is None:
-            # zobrist keys
-            keys = self.generate_zobrist_keys()
-            pick_keys_A, pick_keys_B, ban_keys = keys
-            for h in range(len(self.ordered_heroes)):
-                lib.set_zobrist_key(A, h, pick_keys_A[h])
-                lib.set_zobrist_key(B, h, pick_keys_B[h])
-                lib.set_zobrist_key(BAN_KEYS, h, ban_keys[h])
-
-            lib.clear_tt()  # ensure state values for old drafts aren't used
-        else:
-            self.load_tt(tt_file)
+        synergy_rs = self.ai_synergy_rs
+        counter_rs = self.ai_counter_rs
+        arrays = {
+            # role rewards
+            'A_role_values': _c_ints(hero.A_role_value for hero in self.ordered_heroes),
+            'B_role_values': _c_ints(hero.B_role_value for hero in self.ordered_heroes),
+            # synergy rewards
+            'synergy_heroes': _c_bitmasks(heroes for heroes, _, _ in synergy_rs),
+            'synergy_A_values': _c_ints(A_value for _, A_value, _ in synergy_rs),
+            'synergy_B_values': _c_ints(B_value for _, _, B_value in synergy_rs),
+            # counter rewards
+            'counter_heroes': _c_bitmasks(heroes for heroes, _, _, _ in counter_rs),
+            'counter_foes': _c_bitmasks(foes for _, foes, _, _ in counter_rs),
+            'counter_A_values': _c_ints(A_value for _, _, A_value, _ in counter_rs),
+            'counter_B_values': _c_ints(B_value for _, _, _, B_value in counter_rs),
+            # draft format
+            'draft_teams': _c_ints(team for team, _ in self.draft_format),
+            'draft_selections': _c_ints(selection_type for _, selection_type in self.draft_format),
+            # hero info for updating legal actions
+            'same_role_and_h': _c_bitmasks(heroes_per_role[hero.role] | same_hero_refs[hero_num]
+                                           for hero_num, hero in enumerate(self.ordered_heroes)),
+            'same_h': _c_bitmasks(same_hero_refs),
+        }
+        spec = ffi.new("struct engine_spec *", arrays)  # pointers into arrays, which outlive the call
+        spec.num_heroes = len(self.ordered_heroes)
+        spec.num_synergy_rs = len(synergy_rs)
+        spec.num_counter_rs = len(counter_rs)
+        spec.draft_len = len(self.draft_format)
+        lib.load_engine(spec)
 
     # Group all bans, team A selections and team B selections into
     # separate lists.
@@ -386,11 +728,12 @@ class DraftAI:
     # same roles will be open, and all duplicates made illegal, no matter
     # which variation is selected.
     #
-    # @Later an outer function can handle cases where selections made based
-    # on the AI's suggestion can eliminate the other flex possibilities as
-    # we know the intended role for maximum value.
-    def get_picks_n_bans(self, history):
+    # When the intended role of a flex pick is known (or narrowed down)
+    # the other possibilities can be eliminated by giving its roles in
+    # role hints (see _role_hints).
+    def get_picks_n_bans(self, history, roles=None):
         banned_names, team_A_names, team_B_names = self._split_history(history)
+        roles = {} if roles is None else dict(roles)
 
         banned = []
         for hero_name in banned_names:
@@ -399,23 +742,19 @@ class DraftAI:
                     banned.append(self.hero_nums[(hero_name, role)])
                     break  # only one role variation needed for bans
 
-        team_A_roles = [self.hero_roles[hero_name] for hero_name in team_A_names]
-        team_B_roles = [self.hero_roles[hero_name] for hero_name in team_B_names]
+        team_A_roles = [roles.get(hero_name, self.hero_roles[hero_name]) for hero_name in team_A_names]
+        team_B_roles = [roles.get(hero_name, self.hero_roles[hero_name]) for hero_name in team_B_names]
 
         teams_A = []
         teams_B = []
 
-        for roles_A in itertools.product(*team_A_roles):
-            if len(set(roles_A)) != len(team_A_names):
-                continue
+        for roles_A in role_asgmts(team_A_roles):
             team_A = []
             for hero_name, role in zip(team_A_names, roles_A):
                 team_A.append(self.hero_nums[(hero_name, role)])
             teams_A.append(team_A)
 
-        for roles_B in itertools.product(*team_B_roles):
-            if len(set(roles_B)) != len(team_B_names):
-                continue
+        for roles_B in role_asgmts(team_B_roles):
             team_B = []
             for hero_name, role in zip(team_B_names, roles_B):
                 team_B.append(self.hero_nums[(hero_name, role)])
@@ -430,50 +769,365 @@ class DraftAI:
 
         return teams_A, teams_B, banned
 
-    def run_search(self, history):
+    def _role_hints(self, history, roles):
+        """
+        Checks the roles given to run_search and returns them as a
+        sorted tuple of (hero name, roles) pairs, with the roles of
+        each hero as a sorted tuple, so they can be used in keys. An
+        empty tuple is returned if there are none.
+        """
+
+        if not roles:
+            return ()
+
+        _, team_A_names, team_B_names = self._split_history(history)
+        picked = set(team_A_names) | set(team_B_names)
+        hints = []
+        for hero_name, hero_roles in roles.items():
+            if hero_name not in picked:
+                raise ValueError(f"Invalid roles: {hero_name} has not been picked")
+            hero_roles = (hero_roles,) if hero_roles in ROLES else tuple(sorted(set(hero_roles)))
+            if not hero_roles or any(role not in self.hero_roles[hero_name] for role in hero_roles):
+                raise ValueError(f"Invalid roles: {hero_name} has no role reward for {hero_roles}")
+            hints.append((hero_name, hero_roles))
+
+        # a team may have assignments that are all ruled out by the hints
+        hinted = dict(hints)
+        for team, team_names in (('A', team_A_names), ('B', team_B_names)):
+            if (has_role_asgmt([self.hero_roles[hero_name] for hero_name in team_names])
+                    and not has_role_asgmt([hinted.get(hero_name, self.hero_roles[hero_name])
+                                            for hero_name in team_names])):
+                raise ValueError(f"Invalid roles: no role assignments possible for team {team}")
+        return tuple(sorted(hints))
+
+    def run_search(self, history, multi_pv=None, pv=False, roles=None):
         """
         Wrapper for the C run_search function. Prepares all inputs and
         returns the optimal value and action(s) for a given history.
 
+        If multi_pv is given then a list of the best multi_pv actions
+        (or all legal actions with ALL_ACTIONS) is returned instead,
+        each as a tuple of (value, hero) or (value, hero, hero_2) with
+        exact values and sorted from best to worst. Bans of heroes the
+        enemy can't pick are never considered so are not included.
+
+        If pv is True then the principal variation (the expected
+        selections for both teams through to the end of the draft,
+        starting with the optimal action(s)) is also returned as a list
+        of (hero, role) tuples, where role is None for bans, i.e.,
+        (result, pv). With multi_pv this is a list of the principal
+        variations following each returned action.
+
+        If roles is given it maps the names of picked heroes (of either
+        team) to the role they are known to play, or a collection of
+        roles if only partially known. Lineups where these heroes play
+        any other role are not considered, which can make search much
+        faster when flex heroes have been picked.
+
+        Results are first looked up in any results_cache.
+
+        If pondering is enabled (ponder_replies > 0) then, once the
+        result is returned, searches are started in the background from
+        the enemy's most likely replies (see ponder) and if one of these
+        histories is later searched its result is returned instantly.
+
         @Important: This function will only work if called on the most
                     recently instantiated DraftAI object. This is 
                     because they all share the same underlying C global
                     memory.
         """
 
-        for hero in history:
-            if hero not in self.hero_roles:
-                raise ValueError(f"Invalid history: {hero} has no role reward")
+        stop_pondering()  # the C memory can only be used by one search at a time
 
-        teams_A, teams_B, banned = self.get_picks_n_bans(history)
+        hints = self._role_hints(history, roles)
+        key = (tuple(history), hints)
+        cache = self.results_cache
+        cached = None if cache is None else cache.get(self.fingerprint, history, multi_pv, hints)
+        if cached is not None:
+            (result, line), nodes = cached, 0
+        elif multi_pv is None and key in self._ponder_results:
+            (result, line), nodes = self._ponder_results[key], 0
+        else:
+            # principal variation is also needed to find likely replies
+            # and is always saved with cached results
+            ponder = multi_pv is None and self.ponder_replies > 0
+            result, nodes = self._search(history, multi_pv, pv or ponder or cache is not None, hints)
+            if pv or ponder or cache is not None:
+                result, line = result
+        if cache is not None and cached is None:
+            cache.put(self.fingerprint, history, multi_pv, (result, line), hints)
+        self.last_search_nodes = nodes  # for measuring search speed
+
+        if multi_pv is None and self.ponder_replies > 0:
+            num_actions = len(result) - 1
+            self.ponder(history + list(result[1:]), line[num_actions:], dict(hints))
+
+        return (result, line) if pv else result
+
+    def _search(self, history, multi_pv, pv, roles=None):
+        """
+        Runs the C search for run_search (without pondering), returning
+        the result and number of nodes visited.
+        """
 
-        def total_team_potential(team):
-            return sum(self.ordered_heroes[h].potential for h in team)
+        teams_A, teams_B, banned = self._search_inputs(history, roles)
 
-        # sort teams from most likely to do well to least (achieves
-        # maximum likelihood of cut offs during search)
-        teams_A.sort(key=total_team_potential, reverse=True)
-        teams_B.sort(key=total_team_potential, reverse=True)
+        if multi_pv is None:
+            num_pv = 1
+        elif multi_pv == ALL_ACTIONS:
+            num_pv = len(self.ordered_heroes)**2  # upper bound on number of actions
+        elif multi_pv > 0:
+            num_pv = multi_pv
+        else:
+            raise ValueError("multi_pv must be positive or ALL_ACTIONS")
+        root_actions = ffi.new('struct root_action[]', num_pv)
+        pv_lines = ffi.new('int[]', num_pv * MAX_DRAFT_LEN) if pv else ffi.NULL
 
+        if not lib.alloc_tt():  # TT is only allocated once first searched
+            raise MemoryError("Not enough memory for the transposition table")
         search_result = lib.run_search(
             len(teams_A),
             len(teams_B),
-            len(teams_A[0]),  # all team variations will be same size
+            len(teams_A[0]),  # all team variations will be same size
             len(teams_B[0]),
             len(banned),
             [ffi.new('int[]', team) for team in teams_A],
             [ffi.new('int[]', team) for team in teams_B],
             banned,
+            num_pv,
+            root_actions,
+            pv_lines,
         )
-        value = search_result.value
-        best_hero = self.ordered_heroes[search_result.best_hero].name
 
         _, selection = self.draft_format[len(history)]
-        if selection == PICK or selection == BAN:
-            return value, best_hero
+        double_selection = selection != PICK and selection != BAN
+
+        def action(root_action):
+            value = root_action.value
+            hero = self.ordered_heroes[root_action.hero].name
+            if not double_selection:
+                return value, hero
+            else:
+                hero_2 = self.ordered_heroes[root_action.hero_2].name
+                return value, hero, hero_2
+
+        def principal_variation(i):
+            line = []
+            for stage in range(len(history), len(self.draft_format)):
+                hero_num = pv_lines[i * MAX_DRAFT_LEN + stage]
+                if hero_num < 0:
+                    break  # could not be reconstructed (hash collision)
+                hero = self.ordered_heroes[hero_num]
+                _, selection = self.draft_format[stage]
+                line.append((hero.name, hero.role if selection in PICKS else None))
+            return line
+
+        if multi_pv is None:
+            result = action(root_actions[0])
+            if pv:
+                result = (result, principal_variation(0))
         else:
-            best_hero_2 = self.ordered_heroes[search_result.best_hero_2].name
-            return value, best_hero, best_hero_2
+            result = [action(root_actions[i]) for i in range(search_result.num_pv)]
+            if pv:
+                result = (result, [principal_variation(i) for i in range(search_result.num_pv)])
+        return result, search_result.nodes
+
+    def run_search_batch(self, histories):
+        """
+        Returns the optimal value and action(s) for each of the given
+        histories, as run_search would, in a single call to the C
+        run_search_batch function. Small searches are run alongside
+        each other (one per thread) with larger ones still splitting
+        their root actions between threads. The TT is shared by all
+        searches, which are run from the latest stage to the earliest
+        (whichever team is selecting) so that states they store can
+        be reused by earlier histories of the same draft.
+
+        Results are first looked up in any results_cache but, as no
+        principal variations are found, new results are not saved.
+
+        @Important: Same as run_search, must be called on the most
+                    recently instantiated DraftAI object.
+        """
+
+        stop_pondering()  # the C memory can only be used by one search at a time
+
+        cache = self.results_cache
+        results = [None] * len(histories)
+        misses = []
+        for i, history in enumerate(histories):
+            cached = None if cache is None else cache.get(self.fingerprint, history)
+            if cached is not None:
+                results[i] = cached[0]
+            else:
+                misses.append(i)
+        # searches from the same stage are grouped by the engine
+        misses.sort(key=lambda i: len(histories[i]), reverse=True)
+
+        # all hero nums are put in a single buffer with each input
+        # pointing to its own teams and bans within it
+        all_inputs = [self._search_inputs(histories[i]) for i in misses]
+        hero_nums = ffi.new('int[]', [
+            h for inputs in all_inputs for heroes in inputs[:2] for team in heroes for h in team
+        ] + [h for _, _, banned in all_inputs for h in banned] or [0])
+        search_inputs = ffi.new('struct search_input[]', len(misses))
+        offset = 0
+        for search_input, (teams_A, teams_B, _) in zip(search_inputs, all_inputs):
+            search_input.num_teams_A = len(teams_A)
+            search_input.num_teams_B = len(teams_B)
+            search_input.team_A_size = len(teams_A[0])  # all team variations will be same size
+            search_input.team_B_size = len(teams_B[0])
+            search_input.teams_A = hero_nums + offset
+            offset += len(teams_A) * len(teams_A[0])
+            search_input.teams_B = hero_nums + offset
+            offset += len(teams_B) * len(teams_B[0])
+        for search_input, (_, _, banned) in zip(search_inputs, all_inputs):
+            search_input.banned_size = len(banned)
+            search_input.banned = hero_nums + offset
+            offset += len(banned)
+        search_results = ffi.new('struct search_result[]', len(misses))
+
+        if not lib.alloc_tt():  # TT is only allocated once first searched
+            raise MemoryError("Not enough memory for the transposition table")
+        lib.run_search_batch(len(misses), search_inputs, search_results)
+
+        for i, search_result in zip(misses, search_results):
+            _, selection = self.draft_format[len(histories[i])]
+            result = (search_result.value, self.ordered_heroes[search_result.best_hero].name)
+            if selection != PICK and selection != BAN:
+                result += (self.ordered_heroes[search_result.best_hero_2].name,)
+            results[i] = result
+        self.last_search_nodes = sum(search_result.nodes for search_result in search_results)
+
+        return results
+
+    def ponder(self, history, pv=None, roles=None):
+        """
+        Starts searches in the background from each of the histories
+        resulting from the enemy's ponder_replies most likely replies
+        at the given history (where it is the enemy's turn to select).
+        The reply in the given principal variation is searched first
+        followed by replies with the most potential. Searches are run
+        one at a time on a single thread and stop as soon as run_search
+        is called again (or another DraftAI is created). Any roles are
+        used for every search as in run_search.
+        """
+
+        global _pondering_ai, _ponder_thread
+        stop_pondering()
+        self._ponder_results = {}
+        hints = self._role_hints(history, roles)
+        if len(history) >= len(self.draft_format):
+            return
+        _pondering_ai = self
+        if _ponder_thread is None:
+            _ponder_thread = threading.Thread(target=_ponder_worker, name='ponder', daemon=True)
+            _ponder_thread.start()
+
+        _, selection = self.draft_format[len(history)]
+        unordered = selection == PICK_PICK or selection == BAN_BAN
+        for reply in self._likely_replies(history, pv):
+            reply_history = history + list(reply)
+            if len(reply_history) == len(self.draft_format):
+                continue  # draft is over
+            keys = [(tuple(reply_history), hints)]
+            if unordered:
+                keys.append((tuple(history) + reply[::-1], hints))
+            _ponder_queue.put((self, reply_history, hints, keys))
+
+    def _likely_replies(self, history, pv=None):
+        """
+        Returns up to ponder_replies of the enemy's actions (as tuples of
+        one or two heroes) at the given history, starting with the one
+        in the principal variation then in order of hero potential.
+        """
+
+        _, selection = self.draft_format[len(history)]
+        num_heroes = 1 if selection == PICK or selection == BAN else 2
+        unordered = selection == PICK_PICK or selection == BAN_BAN
+        # ordered heroes are sorted by potential
+        names = list(dict.fromkeys(hero.name for hero in self.ordered_heroes))
+
+        replies = []
+        if pv is not None and len(pv) >= num_heroes:
+            replies.append(tuple(hero for hero, _ in pv[:num_heroes]))
+        selectable = self.selectable_heroes(history)
+        for hero in names:
+            if len(replies) >= self.ponder_replies:
+                break
+            if hero not in selectable:
+                continue
+            if num_heroes == 1:
+                reply = (hero,)
+                if reply not in replies:
+                    replies.append(reply)
+                continue
+            selectable_2 = self.selectable_heroes(history + [hero])
+            for hero_2 in names:
+                if len(replies) >= self.ponder_replies:
+                    break
+                reply = (hero, hero_2)
+                if (hero_2 not in selectable_2 or reply in replies
+                        or (unordered and reply[::-1] in replies)):
+                    continue
+                replies.append(reply)
+        return replies[:self.ponder_replies]
+
+    def perft(self, history, depth):
+        """
+        Wrapper for the C run_perft function. Walks the full legal tree
+        (no pruning or evaluation) from the given history for depth
+        selections and returns the number of nodes visited at each
+        stage, starting with the current one. The last count is the
+        number of unique drafts of that length, so without flex heroes
+        going to the end of the draft it should match num_unique_drafts
+        (divided by 2 for each double pick/ban remaining as the order
+        of those selections is irrelevant).
+
+        @Important: Same as run_search, must be called on the most
+                    recently instantiated DraftAI object.
+        """
+
+        teams_A, teams_B, banned = self._search_inputs(history)
+
+        counts = ffi.new('u64[]', MAX_DRAFT_LEN + 1)
+        lib.run_perft(
+            len(teams_A),
+            len(teams_B),
+            len(teams_A[0]),
+            len(teams_B[0]),
+            len(banned),
+            [ffi.new('int[]', team) for team in teams_A],
+            [ffi.new('int[]', team) for team in teams_B],
+            banned,
+            depth,
+            counts,
+        )
+        end_stage = min(len(history) + depth, len(self.draft_format))
+        return [counts[stage] for stage in range(len(history), end_stage + 1)]
+
+    def _search_inputs(self, history, roles=None):
+        """
+        Returns all team lineups (as hero nums) for each team and the
+        banned hero nums for a history (and any role hints) in the form
+        expected by the C search functions.
+        """
+
+        for hero in history:
+            if hero not in self.hero_roles:
+                raise ValueError(f"Invalid history: {hero} has no role reward")
+
+        teams_A, teams_B, banned = self.get_picks_n_bans(history, roles)
+
+        def total_team_potential(team):
+            return sum(self.ordered_heroes[h].potential for h in team)
+
+        # sort teams from most likely to do well to least (achieves
+        # maximum likelihood of cut offs during search)
+        teams_A.sort(key=total_team_potential, reverse=True)
+        teams_B.sort(key=total_team_potential, reverse=True)
+
+        return teams_A, teams_B, banned
 
     # Turns a draft format where each stage is an indictor of the
     # selecting team and a selection type consisting of either a pick
@@ -516,41 +1170,74 @@ class DraftAI:
 
         stage = len(history) if stage is None else stage
         assert stage <= len(history)
+        state = self._selection_states(history)[stage]
+        for i in range(stage + 1, len(history)):
+            # ignore any current hero for deciding selectable
+            state = self._selection_state(state, history[i], i)
+        return self._selectable_in_state(state, stage)
+
+    def selectable_heroes_by_stage(self, history):
+        """
+        Returns a list of the sets of hero names selectable at each
+        stage of the history, followed by those for the next selection
+        if the draft isn't over, i.e., selectable_heroes(history[:stage])
+        for every stage but found in a single pass over the history.
+        """
+
+        states = self._selection_states(history)
+        num_stages = min(len(history) + 1, len(self.draft_format))
+        return [self._selectable_in_state(states[stage], stage) for stage in range(num_stages)]
+
+    # Selectable heroes are found with bitmasks. The selected heroes are
+    # a bitmask of hero names and each team is the set of roles taken in
+    # each of its valid role assignments (as bitmasks of roles). A hero
+    # not yet selected that can play a role left open in at least one of
+    # these has a valid role assignment with the team. The states after
+    # each stage of the last history given are kept so later calls only
+    # go over the stages where the history differs.
+    def _selection_states(self, history):
+        cached_history, states = self._selection_cache
+        same = 0
+        while (same < len(history) and same < len(cached_history)
+                and history[same] == cached_history[same]):
+            same += 1
+        states = states[:same + 1]
+        for stage in range(same, len(history)):
+            states.append(self._selection_state(states[-1], history[stage], stage))
+        self._selection_cache = (list(history), states)
+        return states
+
+    def _selection_state(self, state, hero, stage):
+        selected, team_role_sets = state
         team, selection = self.draft_format[stage]
-        selected = set()
-        team_heroes = []
-        for i in range(len(history)):
-            if i == stage:
-                continue  # ignore any current hero for deciding selectable
-            selected.add(history[i])
-            team_i, selection_i = self.draft_format[i]
-            if team_i == team and selection_i in PICKS:
-                team_heroes.append(history[i])
+        hero_bit, role_mask = self._hero_masks[hero]
+        if selection in PICKS:
+            team_role_sets = list(team_role_sets)
+            team_role_sets[team] = frozenset(
+                role_set | (1 << role)
+                for role_set in team_role_sets[team]
+                for role in ROLES
+                if (role_mask & ~role_set) >> role & 1
+            )
+            team_role_sets = tuple(team_role_sets)
+        return selected | hero_bit, team_role_sets
 
+    def _selectable_in_state(self, state, stage):
+        selected, team_role_sets = state
+        team, selection = self.draft_format[stage]
         if selection in BANS:
-            selectable = set(self.hero_roles.keys()) - selected
+            open_roles = ~0  # any hero not selected can be banned
         else:
-            selectable = set()
-            team_roles = [self.hero_roles[hero] for hero in team_heroes]
-            for hero in self.hero_roles.keys():
-                if hero in selected:
-                    continue
-                # check for a valid role assignment with hero and current team
-                for roles in itertools.product(*team_roles, self.hero_roles[hero]):
-                    if len(set(roles)) == len(team_heroes) + 1:
-                        selectable.add(hero)
-                        break
-        return selectable
+            open_roles = 0
+            for role_set in team_role_sets[team]:
+                open_roles |= ~role_set
+        return {hero for hero, (hero_bit, role_mask) in self._hero_masks.items()
+                if not selected & hero_bit and role_mask & open_roles}
 
     # Returns a list of all role assignments based on what the heroes
     # can play and ensuring no clashes.
     def valid_role_asgmts(self, team_names):
-        role_asgmts = []
-        team_roles = [self.hero_roles[hero_name] for hero_name in team_names]
-        for roles in itertools.product(*team_roles):
-            if len(set(roles)) == len(team_names):
-                role_asgmts.append(roles)
-        return role_asgmts
+        return role_asgmts([self.hero_roles[hero_name] for hero_name in team_names])
 
     # Get hero nums for the given hero names playing in the given roles.
     def get_hero_nums(self, names, roles):
@@ -563,7 +1250,8 @@ class DraftAI:
     # done over both team's possible role assignments. The unexploitable
     # team choosese first and is set to the MAX player. Thus, the
     # returned assignments is whichever assignement gets MAX the most
-    # value given MIN's best response.
+    # value given MIN's best response. The value of every pair of
+    # assignments is found by the engine in a single call.
     def optimal_role_asgmts(self, history, unexploitable):
         """
         Returns the optimal role assignments for the heroes of each team
@@ -573,29 +1261,34 @@ class DraftAI:
         that results in their best guaranteed value even if more would be
         possible vs the enemy assignment if they were willing to leave
         themselves open to counter exploitation.
+
+        @Important: Same as run_search, must be called on the most
+                    recently instantiated DraftAI object.
         """
 
         _, team_A_names, team_B_names = self._split_history(history)
+        role_asgmts_A = self.valid_role_asgmts(team_A_names)
+        role_asgmts_B = self.valid_role_asgmts(team_B_names)
+        values = self.lineup_values(
+            [self.get_hero_nums(team_A_names, roles) for roles in role_asgmts_A],
+            [self.get_hero_nums(team_B_names, roles) for roles in role_asgmts_B],
+        )
         if unexploitable == A:
-            names_max = team_A_names
-            names_min = team_B_names
+            names_max, role_asgmts_max = team_A_names, role_asgmts_A
+            names_min, role_asgmts_min = team_B_names, role_asgmts_B
         else:
-            names_max = team_B_names
-            names_min = team_A_names
+            names_max, role_asgmts_max = team_B_names, role_asgmts_B
+            names_min, role_asgmts_min = team_A_names, role_asgmts_A
 
         value_max = -INF
-        for roles_max in self.valid_role_asgmts(names_max):
-            team_nums_max = self.get_hero_nums(names_max, roles_max)
-
+        for i, roles_max in enumerate(role_asgmts_max):
             value_min = INF
-            for roles_min in self.valid_role_asgmts(names_min):
-                team_nums_min = self.get_hero_nums(names_min, roles_min)
-
+            for j, roles_min in enumerate(role_asgmts_min):
                 # get value in terms of MAX's perspective
                 if unexploitable == A:
-                    value = self.reward_value(team_nums_max, team_nums_min)
+                    value = values[i][j]
                 else:
-                    value = -self.reward_value(team_nums_min, team_nums_max)
+                    value = -values[j][i]
 
                 if value < value_min:
                     value_min = value
@@ -615,34 +1308,26 @@ class DraftAI:
 
     # Return the zero-sum value in team A's perspective for all granted
     # role, synergy and counter rewards for the given team hero nums.
+    #
+    # @Important: Same as run_search, must be called on the most
+    #             recently instantiated DraftAI object.
     def reward_value(self, team_A, team_B):
-        value = 0
-        team_A = set(team_A)
-        team_B = set(team_B)
-
-        # role rewards
-        for h in team_A:
-            value += self.ordered_heroes[h].A_role_value
-        for h in team_B:
-            value -= self.ordered_heroes[h].B_role_value
-
-        # synergy rewards
-        for synergy_hs, A_value, B_value in self.ai_synergy_rs:
-            if all(map(lambda h: h in team_A, synergy_hs)):
-                value += A_value
-            elif all(map(lambda h: h in team_B, synergy_hs)):
-                value -= B_value
-
-        # counter rewards
-        for counter_hs, counter_fs, A_value, B_value in self.ai_counter_rs:
-            if (all(map(lambda h: h in team_A, counter_hs))
-                    and all(map(lambda f: f in team_B, counter_fs))):
-                value += A_value
-            elif (all(map(lambda h: h in team_B, counter_hs))
-                    and all(map(lambda f: f in team_A, counter_fs))):
-                value -= B_value
-
-        return value
+        return self.lineup_values([team_A], [team_B])[0][0]
+
+    def lineup_values(self, teams_A, teams_B):
+        """
+        Wrapper for the C lineup_values function. Returns the reward
+        value (as for reward_value) of each of team A's lineups against
+        each of team B's, given as lists of hero nums, with row i
+        holding the values of team A's lineup i.
+
+        @Important: Same as run_search, must be called on the most
+                    recently instantiated DraftAI object.
+        """
+
+        values = ffi.new('int[]', len(teams_A) * len(teams_B))
+        lib.lineup_values(len(teams_A), len(teams_B), _c_bitmasks(teams_A), _c_bitmasks(teams_B), values)
+        return [list(values[i * len(teams_B):(i + 1) * len(teams_B)]) for i in range(len(teams_A))]
 
     # Return the total number of unique possible drafts from the given history
     # for the instantiated draft format and heroes used in the role rewards.
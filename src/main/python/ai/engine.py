@@ -0,0 +1,43 @@
+"""
+The draft AI C engine (compiled by build_draft_ai_extension.py), loaded
+the first time it is used rather than on import so that modules using
+it can be imported quickly (e.g. while the app's window is created).
+"""
+
+import threading
+
+from ai.constants import check_constants
+
+_extension = None
+_load_lock = threading.Lock()
+
+
+def load():
+    """Returns the extension module, importing it if not already done."""
+    global _extension
+    with _load_lock:
+        if _extension is None:
+            from ai import _draft_ai
+            check_constants(_draft_ai.lib)
+            _extension = _draft_ai
+    return _extension
+
+
+class _Lazy:
+    """
+    Stands in for the extension's ffi or lib object, loading it on first
+    attribute access. Attributes are then set on the instance so later
+    lookups are as fast as normal (not going through __getattr__).
+    """
+
+    def __init__(self, name):
+        self._name = name
+
+    def __getattr__(self, attr):
+        value = getattr(getattr(load(), self._name), attr)
+        setattr(self, attr, value)
+        return value
+
+
+ffi = _Lazy('ffi')
+lib = _Lazy('lib')
@@ -0,0 +1,66 @@
+"""
+Role assignments for a group of heroes, where each hero plays one of
+the roles it can and no two heroes play the same role (i.e., a perfect
+matching of heroes to roles).
+
+Roles are handled as bitmasks. Assignments are enumerated by
+backtracking that never gives a hero a role already taken, rather than
+filtering every combination of roles, and whether any assignment exists
+is found by bipartite matching (augmenting paths) without enumerating
+them at all.
+"""
+
+
+def _roles_in(mask):
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
+
+
+def _has_matching(masks, open_roles):
+    role_heroes = {}  # hero given each role so far
+
+    def augment(h, tried):
+        # give hero h a role, moving others to different roles if needed
+        for role in _roles_in(masks[h] & open_roles & ~tried[0]):
+            tried[0] |= 1 << role
+            if role not in role_heroes or augment(role_heroes[role], tried):
+                role_heroes[role] = h
+                return True
+        return False
+
+    return all(augment(h, [0]) for h in range(len(masks)))
+
+
+def has_role_asgmt(hero_roles, open_roles=~0):
+    """
+    Returns True if the heroes, given as a list of the roles each can
+    play, have at least one role assignment using only the roles in
+    the open_roles bitmask (all roles by default).
+    """
+    return _has_matching([sum(1 << role for role in roles) for roles in hero_roles], open_roles)
+
+
+def role_asgmts(hero_roles):
+    """
+    Returns a list of all role assignments for the heroes, given as a
+    list of the roles each can play, as tuples with the role of each
+    hero. They are in the same order as the valid combinations from
+    itertools.product(*hero_roles).
+    """
+    asgmts = []
+
+    def extend(roles, used):
+        i = len(roles)
+        if i == len(hero_roles):
+            asgmts.append(tuple(roles))
+            return
+        for role in hero_roles[i]:
+            if not (used >> role) & 1:
+                roles.append(role)
+                extend(roles, used | (1 << role))
+                roles.pop()
+
+    extend([], 0)
+    return asgmts
@@ -0,0 +1,70 @@
+""" On-disk cache of search results so repeated searches are instant. """
+
+import json
+import sqlite3
+
+
+class SearchCache:
+    """
+    Stores the results returned by DraftAI.run_search in an SQLite
+    database. Results are keyed by the DraftAI's reward fingerprint (see
+    DraftAI.reward_fingerprint), the history searched from and the
+    number of root actions requested (and any role hints), so the same
+    file can be shared between reward sets, side orientations and
+    machines.
+    """
+
+    def __init__(self, filename):
+        self.connection = sqlite3.connect(str(filename))
+        with self.connection:
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS results ("
+                "fingerprint TEXT NOT NULL, "
+                "history TEXT NOT NULL, "
+                "multi_pv INTEGER NOT NULL, "
+                "result TEXT NOT NULL, "
+                "PRIMARY KEY (fingerprint, history, multi_pv))"
+            )
+
+    @staticmethod
+    def _key(fingerprint, history, multi_pv, roles):
+        # 0 is used for a single result as multi_pv can never be 0 and
+        # role hints are only saved alongside the history if given
+        history = list(history) if not roles else [list(history), roles]
+        return fingerprint, json.dumps(history), 0 if multi_pv is None else multi_pv
+
+    def get(self, fingerprint, history, multi_pv=None, roles=()):
+        """
+        Returns the (result, pv) pair saved for the search, as returned
+        by run_search with pv=True, or None if it hasn't been saved.
+        """
+        row = self.connection.execute(
+            "SELECT result FROM results WHERE fingerprint = ? AND history = ? AND multi_pv = ?",
+            self._key(fingerprint, history, multi_pv, roles),
+        ).fetchone()
+        if row is None:
+            return None
+
+        # JSON turns all tuples into lists
+        result, pv = json.loads(row[0])
+        if multi_pv is None:
+            return tuple(result), [tuple(selection) for selection in pv]
+        else:
+            return ([tuple(action) for action in result],
+                    [[tuple(selection) for selection in line] for line in pv])
+
+    def put(self, fingerprint, history, multi_pv, result_and_pv, roles=()):
+        """Save the (result, pv) pair returned by a search."""
+        with self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?)",
+                self._key(fingerprint, history, multi_pv, roles) + (json.dumps(result_and_pv),),
+            )
+
+    def clear(self):
+        """Remove all saved results."""
+        with self.connection:
+            self.connection.execute("DELETE FROM results")
+
+    def close(self):
+        self.connection.close()
@@ -0,0 +1,171 @@
+"""
+Sparse (and optionally compressed) transposition table files.
+
+A dense TT file (see write_tt_and_zobrist_keys in draft_ai.c) is a dump
+of every slot in the table, most of which are empty after a late stage
+search. A sparse file instead holds only the populated entries:
+
+    magic (8 bytes) | compression (1 byte) | payload
+
+where the payload, compressed as a single stream if a compression is
+used, is the same header as a dense file followed by the zobrist keys,
+chunks of entries, each as a count then that many indexes and packed
+entry words, an empty chunk marking the end and finally a CRC-32 of
+everything before it.
+"""
+
+import gzip
+import lzma
+import struct
+import zlib
+
+from ai.constants import MAX_NUM_HEROES, TT_IDX_BITS
+from ai.engine import ffi, lib
+
+SPARSE_MAGIC = b"OMNIDTTS"
+
+# compressions with their id and stream opener
+COMPRESSIONS = {
+    None: (0, lambda f, mode: f),
+    # deflate with gzip framing (no name or time so output is reproducible)
+    "gzip": (1, lambda f, mode: gzip.GzipFile(filename="", mode=mode, fileobj=f, mtime=0)),
+    "lzma": (2, lambda f, mode: lzma.LZMAFile(f, mode=mode)),
+}
+COMPRESSION_IDS = {compression_id: opener for compression_id, opener in COMPRESSIONS.values()}
+
+NUM_TT_ENTRIES = TT_IDX_BITS + 1
+NUM_KEYS = 3 * MAX_NUM_HEROES
+CHUNK_SIZE = 1 << 16  # entries per chunk
+
+
+def is_sparse_tt_file(filename):
+    try:
+        with open(filename, "rb") as f:
+            return f.read(len(SPARSE_MAGIC)) == SPARSE_MAGIC
+    except OSError:
+        return False
+
+
+def write_sparse_tt(filename, fingerprint, compression=None):
+    """
+    Write the populated entries of the TT, and the zobrist keys used to
+    access it, to the given file. Returns True if successful.
+    """
+    if compression not in COMPRESSIONS:
+        raise ValueError(f"Unknown TT compression: {compression}")
+    compression_id, opener = COMPRESSIONS[compression]
+
+    header = ffi.new("struct tt_file_header *", lib.tt_file_header(fingerprint))
+    keys = ffi.new("u64[]", NUM_KEYS)
+    lib.get_zobrist_keys(keys)
+    idxs = ffi.new("unsigned int[]", CHUNK_SIZE)
+    words = ffi.new("u64[]", CHUNK_SIZE)
+
+    try:
+        with open(filename, "wb") as raw:
+            raw.write(SPARSE_MAGIC + bytes([compression_id]))
+            with opener(raw, "wb") as f:
+                crc = 0
+
+                def write(data):
+                    nonlocal crc
+                    crc = zlib.crc32(data, crc)
+                    f.write(data)
+
+                write(ffi.buffer(header))
+                write(ffi.buffer(keys))
+                for start in range(0, NUM_TT_ENTRIES, CHUNK_SIZE):
+                    n = lib.get_tt_entries(start, min(start + CHUNK_SIZE, NUM_TT_ENTRIES), idxs, words)
+                    if n:
+                        write(struct.pack("<I", n))
+                        write(ffi.buffer(idxs, n * ffi.sizeof("unsigned int")))
+                        write(ffi.buffer(words, n * ffi.sizeof("u64")))
+                write(struct.pack("<I", 0))
+                f.write(struct.pack("<I", crc))
+    except OSError:
+        return False
+    return True
+
+
+class _TruncatedError(Exception):
+    pass
+
+
+def read_sparse_tt(filename, fingerprint, merge=False):
+    """
+    Load a TT written by write_sparse_tt, streaming it in chunks. The
+    whole file is checked (and entries held in Python) before the
+    current TT and keys are replaced, so they are left unchanged if
+    anything is wrong. If merge, the entries are instead merged into
+    the current TT (see merge_tt_entry in draft_ai.c) so long as the
+    file uses the current zobrist keys. Returns a tt_file_status.
+    """
+    try:
+        raw = open(filename, "rb")
+    except OSError:
+        return lib.TT_FILE_NOT_FOUND
+
+    with raw:
+        prefix = raw.read(len(SPARSE_MAGIC) + 1)
+        if len(prefix) < len(SPARSE_MAGIC) + 1:
+            return lib.TT_FILE_TRUNCATED
+        if prefix[:-1] != SPARSE_MAGIC:
+            return lib.TT_FILE_BAD_MAGIC
+        if prefix[-1] not in COMPRESSION_IDS:
+            return lib.TT_FILE_BAD_VERSION
+
+        try:
+            with COMPRESSION_IDS[prefix[-1]](raw, "rb") as f:
+                crc = 0
+
+                def read(size):
+                    nonlocal crc
+                    data = f.read(size)
+                    if len(data) != size:
+                        raise _TruncatedError
+                    crc = zlib.crc32(data, crc)
+                    return data
+
+                header = ffi.new("struct tt_file_header *")
+                ffi.buffer(header)[:] = read(ffi.sizeof("struct tt_file_header"))
+                status = lib.check_tt_file_header(header, fingerprint)
+                if status != lib.TT_FILE_OK:
+                    return status
+
+                keys = read(NUM_KEYS * ffi.sizeof("u64"))
+                chunks = []
+                while True:
+                    n, = struct.unpack("<I", read(4))
+                    if n == 0:
+                        break
+                    if n > CHUNK_SIZE:
+                        return lib.TT_FILE_CORRUPT
+                    idxs = read(n * ffi.sizeof("unsigned int"))
+                    words = read(n * ffi.sizeof("u64"))
+                    chunks.append((n, idxs, words))
+
+                expected_crc = f.read(4)
+                if len(expected_crc) != 4:
+                    raise _TruncatedError
+                if struct.unpack("<I", expected_crc)[0] != crc or f.read(1):
+                    return lib.TT_FILE_CORRUPT
+        except (_TruncatedError, EOFError):
+            return lib.TT_FILE_TRUNCATED
+        except (OSError, lzma.LZMAError, zlib.error):
+            return lib.TT_FILE_CORRUPT  # compressed stream is invalid
+
+    if merge:
+        current_keys = ffi.new("u64[]", NUM_KEYS)
+        lib.get_zobrist_keys(current_keys)
+        if ffi.buffer(current_keys)[:] != keys:
+            return lib.TT_FILE_KEYS_DIFFER
+        set_entries = lib.merge_tt_entries
+    else:
+        lib.clear_tt()
+        lib.set_zobrist_keys(ffi.from_buffer("u64[]", keys))
+        set_entries = lib.set_tt_entries
+
+    for n, idxs, words in chunks:
+        if not set_entries(n, ffi.from_buffer("unsigned int[]", idxs), ffi.from_buffer("u64[]", words)):
+            return lib.TT_FILE_NO_MEMORY
+    return lib.TT_FILE_OK
@@ -10,7 +10,7 @@ from game_constants import ROLES
 from hero_box import HeroBox, set_hero_box_layout_sizes
 from reward_dialogs import init_search_list_view
 from reward_models import TEAM_1, TEAM_2, TEAM_1_COLOR, TEAM_2_COLOR
-from ai.draft_ai import A, B, PICK, BAN, INF
+from ai.constants import A, B, PICK, BAN, INF
 
 
 HERO_BOX_SIZE = QSize(100, 100)
@@ -37,6 +37,8 @@ class DraftPage(QWidget):
         self.team_tags = team_tags
         self.team_builder = team_builder
 
+        self.reward_set = None
+        self.draft_ai = None
         self.side_A_team = TEAM_1
         self.team_A_label = QLabel(team_tags[0])
         self.team_B_label = QLabel(team_tags[1])
@@ -177,16 +179,24 @@ class DraftPage(QWidget):
 
     # Set a new reward set, whose saved rewards will be used for determining
     # what heroes can be used to enter draft histories and wha the AI will
-    # use for finding the otpimal selection(s) for those histories.
-    def set_reward_set(self, reward_set):
+    # use for finding the otpimal selection(s) for those histories. If the
+    # changes (from RewardSet.save_rewards) to the reward set already in use
+    # are given then the DraftAI is updated in place so its TT is kept.
+    def set_reward_set(self, reward_set, reward_changes=None):
         assert reward_set.get_draft_format() == self.draft_format
+        update_in_place = (reward_changes is not None and self.draft_ai is not None
+                           and reward_set is self.reward_set)
         self.reward_set = reward_set
         valid_heroes = sorted(self.reward_set.unique_heroes_used())
         self.search_model.clear()
         for name in valid_heroes:
             item = QStandardItem(self.hero_icons[name], name)
             self.search_model.appendRow(item)
-        self.update_draft_ai()
+        if update_in_place:
+            self.draft_ai.update_rewards(*reward_changes)
+            self.validate_history()
+        else:
+            self.update_draft_ai()
 
     # Updates the DraftAI object (used for creating hisories and running
     # searches) to that returned from the RewardSet based on the team A
@@ -194,7 +204,11 @@ class DraftPage(QWidget):
     # else that was dependent on the old DraftAI object is also updated.
     def update_draft_ai(self):
         self.draft_ai = self.reward_set.get_draft_ai(self.side_A_team)
+        self.validate_history()
 
+    # Remove any heroes from the history that are no longer selectable
+    # with the DraftAI's (new) rewards.
+    def validate_history(self):
         # Validate history with (new) rewards in the new DraftAI.
         history = self.get_history()
         for hero_box in self.hero_boxes:
@@ -202,10 +216,10 @@ class DraftPage(QWidget):
             if hero_box.selected:
                 selected_index = hero_box.index
         stage = 0
+        selectable_by_stage = self.draft_ai.selectable_heroes_by_stage(history)
         for hero in history:
             # check if hero is still selectable with history before it
-            selectable = self.draft_ai.selectable_heroes(history[:stage])
-            if hero not in selectable:
+            if hero not in selectable_by_stage[stage]:
                 break
             self.hero_boxes[stage].set_hero(hero)
             stage += 1
@@ -355,6 +369,12 @@ class DraftPage(QWidget):
     # need to be run again.
     def update_next_value_label(self, stage, selected_hero):
         search_result = self.hero_boxes[stage].value_label.search_result
+        pv = self.hero_boxes[stage].value_label.pv
+        if pv is not None:
+            # remaining continuation after the selected hero
+            next_pv = [h for h in pv[:2] if h[0] != selected_hero] + pv[2:]
+        else:
+            next_pv = None
         if search_result is None or len(search_result) == 2:
             # no saved result or single selection so nothing to update
             return
@@ -363,16 +383,16 @@ class DraftPage(QWidget):
             # could be selected
             if selected_hero == search_result[1]:
                 next_result = (search_result[0], search_result[2])
-                self.hero_boxes[stage + 1].value_label.set_search_result(next_result)
+                self.hero_boxes[stage + 1].value_label.set_search_result(next_result, next_pv)
             elif selected_hero == search_result[2]:
                 next_result = (search_result[0], search_result[1])
-                self.hero_boxes[stage + 1].value_label.set_search_result(next_result)
+                self.hero_boxes[stage + 1].value_label.set_search_result(next_result, next_pv)
         else:
             # selecting team has two selections of a different type so must be
             # selected in order
             if selected_hero == search_result[1]:
                 next_result = (search_result[0], search_result[2])
-                self.hero_boxes[stage + 1].value_label.set_search_result(next_result)
+                self.hero_boxes[stage + 1].value_label.set_search_result(next_result, next_pv)
 
     # Change the selected box so long as it is next one needing entered
     # or one before that.
@@ -442,8 +462,8 @@ class DraftPage(QWidget):
         self.change_selected_box(selected_box)  # selection is same, but legal search heroes need updated
         self.history_changed(selected_box.index)
 
-    # Switches the team playing as A, updating the labels and calling
-    # to update the draft ai.
+    # Switches the team playing as A, updating the labels and
+    # switching the sides of the draft ai.
     @Slot()
     def switch_sides_button_clicked(self):
         if self.side_A_team == TEAM_1:
@@ -456,7 +476,10 @@ class DraftPage(QWidget):
             self.team_B_label.setText(self.team_tags[1])
         for hero_box in self.hero_boxes:
             hero_box.value_label.update_color()
-        self.update_draft_ai()
+        # Rewards only swap perspective so the history is still valid and
+        # everything cached for both sides by the DraftAI is kept.
+        self.draft_ai.switch_sides()
+        self.history_changed(-1)  # -1 to indicate that all value labels are invalid
 
     # Has DraftAI determine current optimal roles for each hero in
     # both teams for the current point in history, sets them to the
@@ -499,7 +522,7 @@ class DraftPage(QWidget):
         # move user selection to where search is being run from (next draft selection)
         if not self.hero_boxes[len(history)].selected:
             self.change_selected_box(self.hero_boxes[len(history)])
-        search_result = self.draft_ai.run_search(history)
+        search_result, pv = self.draft_ai.run_search(history, pv=True)
         # check for incomplete search
         if search_result[0] == INF or search_result[0] == -INF:
             msg_box = QMessageBox(self)
@@ -509,12 +532,12 @@ class DraftPage(QWidget):
                                        "role rewards.")
             msg_box.exec()
             return
-        self.reward_set.save_tt_if_best(self.draft_ai, self.side_A_team, len(history))
+        self.reward_set.save_merged_tt(self.draft_ai, len(history))
         # scale the integer values between 0 and 1000 used by the AI to floats between 0 and 10
         updated_search_result = (search_result[0] / 100, search_result[1])
         updated_search_result += () if len(search_result) == 2 else (search_result[2],)
         # set optimal value for current selection
-        self.hero_boxes[len(history)].value_label.set_search_result(updated_search_result)
+        self.hero_boxes[len(history)].value_label.set_search_result(updated_search_result, pv)
         # display optimal value and selection(s)
         self.value_lcd.display(updated_search_result[0])
         self.optimal_hero_boxes[0].set_hero(updated_search_result[1])
@@ -607,7 +630,9 @@ class SummaryDialog(QDialog):
         return groupbox
 
     # Set the desired information and then show dialog to display summary.
-    def display(self, stage, search_result):
+    # Any principal variation (list of (hero, role) from the stage onwards)
+    # is used to show the expected continuation of the draft.
+    def display(self, stage, search_result, pv=None):
         # Find selecting team's colour and tag.
         selecting_side = self.draft_page.draft_format[stage][0]
         if self.draft_page.side_A_team == TEAM_1:
@@ -630,6 +655,10 @@ class SummaryDialog(QDialog):
             if i < stage:
                 hero_box.set_hero(self.draft_page.hero_boxes[i].name)
                 update_ban_icon(hero_box, self.draft_page.ban_icons)
+            elif pv is not None and i - stage < len(pv):
+                # show expected continuation of the draft
+                hero_box.set_hero(pv[i - stage][0])
+                update_ban_icon(hero_box, self.draft_page.ban_icons)
             else:
                 hero_box.clear()
                 update_ban_icon(hero_box, self.draft_page.ban_icons)
@@ -700,6 +729,7 @@ class ValueLabel(QLabel):
         self.side = draft_page.draft_format[hero_box.index][0]
         self.search_result = None  # the optimal value and selection(s) returned from running AI search
                                    # for the selection that this value label is associated with
+        self.pv = None  # expected continuation of the draft from the same search
         self.setAlignment(Qt.AlignCenter)
         self.setFrameStyle(QFrame.Panel | QFrame.Plain)
         self.setLineWidth(1)
@@ -708,12 +738,14 @@ class ValueLabel(QLabel):
         self.margin = hero_box.frameWidth() * 2  # add margin so it doesn't overlap with hero box frame
         self.update_color()
 
-    def set_search_result(self, search_result):
+    def set_search_result(self, search_result, pv=None):
         self.search_result = search_result
+        self.pv = pv
         self.setText(str(search_result[0]))
 
     def clear(self):
         self.search_result = None
+        self.pv = None
         self.setText(None)
 
     def update_color(self):
@@ -725,7 +757,7 @@ class ValueLabel(QLabel):
 
     def mousePressEvent(self, event):
         if self.search_result is not None:
-            self.draft_page.summary_dialog.display(self.hero_box.index, self.search_result)
+            self.draft_page.summary_dialog.display(self.hero_box.index, self.search_result, self.pv)
         else:
             # display tool tip describing the purpose of the value label
             QToolTip.showText(
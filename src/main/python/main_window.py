@@ -6,7 +6,7 @@ from reward_set import RewardSet
 from rewards_page import RewardsPage
 from reward_models import RoleReward
 from draft_page import DraftPage
-from ai.draft_ai import A, B, PICK, BAN
+from ai.constants import A, B, PICK, BAN
 from game_constants import ROLES
 
 # @Temp heroes and draft format while I focus on building the main
@@ -97,8 +97,8 @@ class MainWindow(QMainWindow):
     def tab_changed(self, index):
         if index == 1:
             rewards = self.rewards_page.get_rewards()
-            self.reward_set.save_rewards(*rewards)
-            self.draft_page.set_reward_set(self.reward_set)
+            reward_changes = self.reward_set.save_rewards(*rewards)
+            self.draft_page.set_reward_set(self.reward_set, reward_changes)
 
     # @Temp method to add in some test rewards to help with implementing
     # other features.
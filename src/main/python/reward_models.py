@@ -4,6 +4,8 @@ from operator import itemgetter
 from PySide6.QtCore import Qt, QAbstractTableModel, QModelIndex, Slot
 from PySide6.QtGui import QColor, QFont
 
+from ai.role_asgmts import role_asgmts
+
 
 # Flags for the status of a reward based on teams in the team builder.
 TEAM_1  = 0
@@ -244,11 +246,10 @@ class SynergyReward:
         names, roles = zip(*self.heroes)
         self.hero_names = names
         self.hero_role_asgmts = set()
-        for role_asgmt in itertools.product(*roles):
-            # find all role assignments with no clashes
-            if len(set(role_asgmt)) == len(self.heroes):
-                asgmt = tuple(zip(names, role_asgmt))
-                self.hero_role_asgmts.add(asgmt)
+        # find all role assignments with no clashes
+        for role_asgmt in role_asgmts(roles):
+            asgmt = tuple(zip(names, role_asgmt))
+            self.hero_role_asgmts.add(asgmt)
 
     # used role rewards tracked to ensure safe deleting
     def init_used_role_rs(self):
@@ -343,14 +344,13 @@ class CounterReward:
         foe_names, foe_roles = zip(*self.foes)
         self.foe_names = foe_names
         self.hero_role_asgmts = set()
-        for roles_h in itertools.product(*hero_roles):
-            if len(set(roles_h)) == len(self.heroes):
-                hero_asgmt = tuple(zip(hero_names, roles_h))
-                # find each valid foe hero role assignment as well
-                for roles_f in itertools.product(*foe_roles):
-                    if len(set(roles_f)) == len(self.foes):
-                        foe_asgmt = tuple(zip(foe_names, roles_f))
-                        self.hero_role_asgmts.add((hero_asgmt, foe_asgmt))
+        foe_role_asgmts = role_asgmts(foe_roles)
+        for roles_h in role_asgmts(hero_roles):
+            hero_asgmt = tuple(zip(hero_names, roles_h))
+            # find each valid foe hero role assignment as well
+            for roles_f in foe_role_asgmts:
+                foe_asgmt = tuple(zip(foe_names, roles_f))
+                self.hero_role_asgmts.add((hero_asgmt, foe_asgmt))
 
     def init_used_role_rs(self):
         self.used_role_rs = set()
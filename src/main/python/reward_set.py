@@ -3,8 +3,9 @@ import re
 from pathlib import Path
 
 from game_constants import ROLES
-from reward_models import TEAM_1, TEAM_2
-from ai.draft_ai import DraftAI, RoleR, SynergyR, CounterR, MAX_TT_STAGE
+from reward_models import TEAM_2
+from ai.draft_ai import DraftAI, RoleR, SynergyR, CounterR, MAX_TT_STAGE, reward_changes
+from ai.search_cache import SearchCache
 
 
 class RewardSet:
@@ -14,9 +15,15 @@ class RewardSet:
     """
 
     data_filename = "data.p"
-    team_1_A_tt_filename = "team_1_A_tt.bin"
-    team_2_A_tt_filename = "team_2_A_tt.bin"
+    tt_filename = "tt.bin"  # one TT for either team playing as side A
+    results_cache_filename = "results_cache.sqlite"
     ai_roles = {role: i for i, role in enumerate(ROLES)}
+    ponder_replies = 5  # enemy replies searched in the background after each search
+    # Saved TTs are sparse and compressed as they are mostly empty. Only
+    # uncompressed dense TTs can be mapped into memory (see DraftAI.map_tt)
+    # so set tt_compression to None and tt_map_mode to map them instead.
+    tt_compression = "gzip"
+    tt_map_mode = None
 
     def __init__(self, name):
         """
@@ -28,6 +35,13 @@ class RewardSet:
             raise ValueError(f"No reward set called '{name}' exists.")
         with open(self.path / self.data_filename, 'rb') as data_file:
             self.data = pickle.load(data_file)
+        if "tt" not in self.data:
+            # reward sets saved with a TT per side start a new shared one
+            self.data.pop("team_1_A_tt", None)
+            self.data.pop("team_2_A_tt", None)
+            self.data["tt"] = None
+        # results are keyed by reward fingerprint so never need removed
+        self.results_cache = SearchCache(self.path / self.results_cache_filename)
 
     @staticmethod
     def reward_sets_dir():
@@ -63,8 +77,7 @@ class RewardSet:
             "role_rs": [],
             "synergy_rs": [],
             "counter_rs": [],
-            "team_1_A_tt": None,
-            "team_2_A_tt": None,
+            "tt": None,
         }
         with open(path / cls.data_filename, 'wb') as data_file:
             pickle.dump(reward_set_data, data_file)
@@ -84,7 +97,11 @@ class RewardSet:
             pickle.dump(self.data, data_file)
 
     def save_rewards(self, role_rs, synergy_rs, counter_rs):
-        """Save the given rewards to the instantiated reward set."""
+        """
+        Save the given rewards to the instantiated reward set. Returns the
+        (added, removed, changed) rewards, as taken by DraftAI.update_rewards,
+        compared to those previously saved.
+        """
         role_rs = sorted(self.ai_reward_format(r, 'role') for r in role_rs)
         synergy_rs = sorted(self.ai_reward_format(r, 'synergy') for r in synergy_rs)
         counter_rs = sorted(self.ai_reward_format(r, 'counter') for r in counter_rs)
@@ -93,14 +110,18 @@ class RewardSet:
             synergy_rs == self.data['synergy_rs'] and
             counter_rs == self.data['counter_rs']):
             # Nothing to do as rewards are already saved.
-            return
+            return [], [], []
+        changes = reward_changes(
+            self.data['role_rs'] + self.data['synergy_rs'] + self.data['counter_rs'],
+            role_rs + synergy_rs + counter_rs,
+        )
         # Save new rewards and remove any (now invalid) transposition tables.
         self.data["role_rs"] = role_rs
         self.data["synergy_rs"] = synergy_rs
         self.data["counter_rs"] = counter_rs
-        self.data["team_1_A_tt"] = None
-        self.data["team_2_A_tt"] = None
+        self.data["tt"] = None
         self._save_data()
+        return changes
 
     def ai_reward_format(self, reward, reward_type):
         """
@@ -133,13 +154,12 @@ class RewardSet:
         else:
             raise ValueError
 
-    def save_tt_if_best(self, draft_ai, side_A_team, search_stage):
+    def save_merged_tt(self, draft_ai, search_stage):
         """
         Save the transposition table cached by the given DraftAI object from
-        running a search at the given stage in the draft format with the given
-        team as side A so long as there is not a more useful transposition 
-        table already saved: that is, a TT with saved states from an earlier
-        stage.
+        running a search at the given stage in the draft format (with either
+        team as side A), first merging in any transposition table already
+        saved so that the entries from every search accumulate.
         """
         # TT entries only get cached for states with stages after the stage
         # search is run from so long as they are less than the MAX_TT_STAGE.
@@ -147,62 +167,50 @@ class RewardSet:
         # cached so the TT shouldn't be saved.
         if (search_stage + 1) >= MAX_TT_STAGE:
             return
-        if side_A_team == TEAM_1:
-            saved_tt_stage = self.data["team_1_A_tt"]
+        tt_file = str(self.path / self.tt_filename)
+
+        # A saved TT that can't be merged (e.g., saved before keys were
+        # derived from the rewards) is replaced.
+        saved_tt_stage = self.data["tt"]
+        if saved_tt_stage is not None:
+            draft_ai.merge_tt(tt_file)
+        if draft_ai.save_tt(tt_file, compression=self.tt_compression):
+            # earliest stage searched is kept as TTs from it hold the most
             if saved_tt_stage is None or search_stage < saved_tt_stage:
-                tt_file = str(self.path / self.team_1_A_tt_filename)
-                if draft_ai.save_tt(tt_file):
-                    self.data["team_1_A_tt"] = search_stage
-                    self._save_data()
-        else:
-            saved_tt_stage = self.data["team_2_A_tt"]
-            if saved_tt_stage is None or search_stage < saved_tt_stage:
-                tt_file = str(self.path / self.team_2_A_tt_filename)
-                if draft_ai.save_tt(tt_file):
-                    self.data["team_2_A_tt"] = search_stage
-                    self._save_data()
-
-    def tt_is_available(self, side_A_team):
-        """Returns True if a TT is saved for the given team playing as side A."""
-        if side_A_team == TEAM_1:
-            return self.data["team_1_A_tt"] is not None
-        else:
-            return self.data["team_2_A_tt"] is not None
+                self.data["tt"] = search_stage
+                self._save_data()
+
+    def tt_is_available(self):
+        """Returns True if a TT is saved."""
+        return self.data["tt"] is not None
 
     def get_draft_ai(self, side_A_team):
         """
         Return a DraftAI with the saved rewards and any saved TT for the
-        instantiated reward set with the given team playing as side A.
+        instantiated reward set with the given team playing as side A. The
+        DraftAI is always created with team 1 as side A (which the saved
+        TT is for) then switched if needed, so that the same TT is used
+        for both sides (see DraftAI.switch_sides).
         """
-        if side_A_team == TEAM_1:
-            role_rs = self.data["role_rs"]
-            synergy_rs = self.data["synergy_rs"]
-            counter_rs = self.data["counter_rs"]
-            if self.data["team_1_A_tt"] is None:
-                tt_file = None
-            else:
-                tt_file = str(self.path / self.team_1_A_tt_filename)
+        if self.data["tt"] is None:
+            tt_file = None
         else:
-            def switch_values(r):
-                if isinstance(r, RoleR):
-                    return RoleR(r.hero_name, r.role, r.B_value, r.A_value)
-                elif isinstance(r, SynergyR):
-                    return SynergyR(r.heroes, r.B_value, r.A_value)
-                elif isinstance(r, CounterR):
-                    return CounterR(r.heroes, r.foes, r.B_value, r.A_value)
-                else:
-                    raise ValueError
-            role_rs = [switch_values(r) for r in self.data["role_rs"]]
-            synergy_rs = [switch_values(r) for r in self.data["synergy_rs"]]
-            counter_rs = [switch_values(r) for r in self.data["counter_rs"]]
-            if self.data["team_2_A_tt"] is None:
-                tt_file = None
-            else:
-                tt_file = str(self.path / self.team_2_A_tt_filename)
-        return DraftAI(
+            tt_file = str(self.path / self.tt_filename)
+        draft_ai = DraftAI(
             self.data["draft_format"],
-            role_rs,
-            synergy_rs,
-            counter_rs,
+            self.data["role_rs"],
+            self.data["synergy_rs"],
+            self.data["counter_rs"],
             tt_file,
+            ponder_replies=self.ponder_replies,
+            results_cache=self.results_cache,
+            tt_map_mode=self.tt_map_mode,
         )
+        if tt_file is not None and draft_ai.last_tt_error is not None:
+            # saved TT is invalid (DraftAI started with an empty one) so
+            # let the next search save over it
+            self.data["tt"] = None
+            self._save_data()
+        if side_A_team == TEAM_2:
+            draft_ai.switch_sides()
+        return draft_ai
@@ -3,11 +3,14 @@ import os
 dir_path = os.path.join(os.path.realpath(''), 'src', 'main', 'python')
 sys.path.insert(0, dir_path)
 
+import tempfile
 import unittest 
+import itertools
 from random import Random
 from collections import namedtuple
 
 from ai.draft_ai import *
+from ai.role_asgmts import has_role_asgmt, role_asgmts
 
 
 class TestAIPrep(unittest.TestCase):
@@ -317,6 +320,15 @@ class TestAIPrep(unittest.TestCase):
         self.assertEqual(team_Bs[3], [2, 4])
         self.assertEqual(banned, [6, 5])
 
+        # known roles rule out the other teams
+        history = ['Gwen', 'Skye', 'Taka', 'Lyra', 'Krul', 'Rona']
+        team_As, team_Bs, banned = draft_ai.get_picks_n_bans(history, {'Lyra': (2,), 'Rona': (3, 4)})
+        self.assertEqual(team_As, [[0, 9]])
+        self.assertEqual(team_Bs, [[1, 3], [1, 4], [2, 3], [2, 4]])
+        team_As, team_Bs, banned = draft_ai.get_picks_n_bans(history, {'Krul': (1,), 'Rona': (4,)})
+        self.assertEqual(len(team_As), 2)
+        self.assertEqual(team_Bs, [[1, 4]])
+
     def test_get_picks_n_bans_with_ban_pick(self):
         small_format = [
             (A, PICK),
@@ -370,6 +382,13 @@ class TestAIPrep(unittest.TestCase):
         self.assertEqual(ban_keys[1], ban_keys[3])
         self.assertEqual(ban_keys[2], ban_keys[4])
 
+        # keys only depend on the rewards
+        same_keys = DraftAI([], role_rs, [], []).generate_zobrist_keys()
+        self.assertEqual(same_keys, (pick_keys_A, pick_keys_B, ban_keys))
+        role_rs[0] = RoleR('Taka', 0, 1, 9)
+        other_keys = DraftAI([], role_rs, [], []).generate_zobrist_keys()
+        self.assertNotEqual(other_keys[0], pick_keys_A)
+
     def test_selectable_heroes(self):
         draft_format = [
             (A, BAN),
@@ -424,6 +443,38 @@ class TestAIPrep(unittest.TestCase):
         # so Lyra should be selectable)
         self.assertEqual({'Lyra', 'Gwen'}, draft_ai.selectable_heroes(history))
 
+        # all stages at once (Skye can't join Gwen on team A so the last
+        # hero isn't selectable)
+        history = ['Taka', 'Krul', 'Rona', 'Lyra', 'Reza', 'Gwen', 'Skye']
+        by_stage = draft_ai.selectable_heroes_by_stage(history)
+        self.assertEqual(len(by_stage), len(history) + 1)
+        for stage, selectable in enumerate(by_stage):
+            self.assertEqual(selectable, draft_ai.selectable_heroes(history[:stage]))
+        self.assertEqual({'Gwen', 'Skye'}, by_stage[5])
+        self.assertEqual(set(), by_stage[6])
+
+        # earlier stages kept for the last history can't leak into others
+        history = ['Taka', 'Krul', 'Reza', 'Lyra']
+        self.assertEqual({'Skye', 'Gwen', 'Rona'}, draft_ai.selectable_heroes(history))
+        draft_ai.update_rewards(added=[RoleR('Lyra', 3, 0, 0)])
+        self.assertEqual({'Skye', 'Gwen', 'Rona'}, draft_ai.selectable_heroes(history))
+        draft_ai.update_rewards(removed=[RoleR('Lyra', 2, 0, 0)])
+        self.assertEqual({'Rona'}, draft_ai.selectable_heroes(history))
+
+    def test_role_asgmts(self):
+        self.assertEqual(role_asgmts([]), [()])
+        self.assertEqual(role_asgmts([[1, 2], [2], [1, 3]]), [(1, 2, 3)])
+        self.assertFalse(has_role_asgmt([[1, 2], [2], [1, 2]]))
+        self.assertFalse(has_role_asgmt([[0, 1], [1]], open_roles=0b01))
+
+        # same assignments, in the same order, as filtering every product
+        rng = Random(0)
+        for _ in range(200):
+            hero_roles = [rng.sample(range(5), rng.randint(1, 5)) for _ in range(rng.randint(1, 5))]
+            valid = [roles for roles in itertools.product(*hero_roles) if len(set(roles)) == len(roles)]
+            self.assertEqual(role_asgmts(hero_roles), valid)
+            self.assertEqual(has_role_asgmt(hero_roles), len(valid) > 0)
+
     def test_num_unique_drafts(self):
         draft_format = [
             (A, BAN),
@@ -459,8 +510,6 @@ class TestAIPrep(unittest.TestCase):
 
     def test_save_and_load_tt(self):
         draft_format = [
-            (A, BAN),
-            (B, BAN),
             (A, BAN),
             (B, BAN),
             (A, PICK),
@@ -471,10 +520,8 @@ class TestAIPrep(unittest.TestCase):
             (B, PICK),
             (B, PICK),
             (A, PICK),
-            (A, PICK),
-            (B, PICK),
         ]
-        # Create random set of role rewards.
+        # Create random set of role rewards.
         random = Random(10)
         random_role_rs = []
         for hero in range(40):
@@ -484,35 +531,228 @@ class TestAIPrep(unittest.TestCase):
 
         # Select subset for actual role rewards.
         random.shuffle(random_role_rs)
-        role_rs = random_role_rs[:50]
+        role_rs = random_role_rs[:20]
 
-        filename = "test/test_save_and_load_tt.bin"
-
-        # Ran the following commented out code once and it took 34s,
-        # returning optimal value -233 and action "25"
-        """
         draft_ai = DraftAI(draft_format, role_rs, [], [])
         value, action = draft_ai.run_search([])
-        print(value, action)
-
-        # Save the transpostion table used for these rewards.
-        draft_ai.save_tt(filename)
-        """
-
-        # We can now load in the TT and test that we get same results much quicker
-        # thanks to the TT if it was loaded correctly.
+        search_nodes = draft_ai.last_search_nodes
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            filename = os.path.join(tmp_dir, "tt.bin")
+            self.assertTrue(draft_ai.save_tt(filename))
+
+            # We can now load in the TT and test that we get same results with
+            # far fewer nodes thanks to the TT if it was loaded correctly.
+            draft_ai = DraftAI(draft_format, role_rs, [], [])
+            self.assertTrue(draft_ai.load_tt(filename))
+            self.assertIsNone(draft_ai.last_tt_error)
+            self.assertEqual(draft_ai.run_search([]), (value, action))
+            self.assertLess(draft_ai.last_search_nodes, search_nodes)
+
+            draft_ai = DraftAI(draft_format, role_rs, [], [], filename)
+            self.assertEqual(draft_ai.run_search([]), (value, action))
+            self.assertLess(draft_ai.last_search_nodes, search_nodes)
+
+    def test_load_invalid_tt(self):
+        draft_format = [(A, BAN), (B, BAN), (A, PICK), (B, PICK), (B, PICK), (A, PICK)]
+        role_rs = [RoleR(str(hero), hero % 5, hero, 10 - hero) for hero in range(10)]
         draft_ai = DraftAI(draft_format, role_rs, [], [])
-        load_succeeded = draft_ai.load_tt(filename)
-        self.assertTrue(load_succeeded)
-        value, action = draft_ai.run_search([])
-        self.assertEqual(value, -233)
-        self.assertEqual(action, "25")
-
-        draft_ai = DraftAI(draft_format, role_rs, [], [], filename)
-        value, action = draft_ai.run_search([])
-        self.assertEqual(value, -233)
-        self.assertEqual(action, "25")
-
+        draft_ai.run_search([])
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            filename = os.path.join(tmp_dir, "tt.bin")
+            self.assertTrue(draft_ai.save_tt(filename))
+            with open(filename, 'rb') as f:
+                data = f.read()
+
+            def load(file_data=None, rewards=role_rs, fmt=draft_format):
+                bad_filename = os.path.join(tmp_dir, "bad_tt.bin")
+                if file_data is not None:
+                    with open(bad_filename, 'wb') as f:
+                        f.write(file_data)
+                draft_ai = DraftAI(fmt, rewards, [], [])
+                self.assertFalse(draft_ai.load_tt(bad_filename))
+                return draft_ai.last_tt_error
+
+            missing = os.path.join(tmp_dir, "missing.bin")
+            self.assertFalse(DraftAI(draft_format, role_rs, [], []).load_tt(missing))
+
+            # different rewards and draft format
+            other_rs = [RoleR(r.hero_name, r.role, r.A_value + 1, r.B_value) for r in role_rs]
+            mismatch = TT_FILE_ERRORS[lib.TT_FILE_MISMATCH]
+            self.assertEqual(load(data, rewards=other_rs), mismatch)
+            self.assertEqual(load(data, fmt=draft_format[:-1]), mismatch)
+
+            # same rewards but heroes with equal potential given a different order
+            tied_rs = [RoleR(str(hero), hero % 5, 5, 5) for hero in range(10)]
+            DraftAI(draft_format, tied_rs, [], []).save_tt(filename)
+            with open(filename, 'rb') as f:
+                self.assertEqual(load(f.read(), rewards=tied_rs[::-1]), mismatch)
+
+            self.assertEqual(load(data[:-8]), TT_FILE_ERRORS[lib.TT_FILE_TRUNCATED])
+            self.assertEqual(load(data[:100]), TT_FILE_ERRORS[lib.TT_FILE_TRUNCATED])
+            self.assertEqual(load(b'x' + data[1:]), TT_FILE_ERRORS[lib.TT_FILE_BAD_MAGIC])
+            corrupt = bytearray(data)
+            corrupt[-3] ^= 0xFF
+            self.assertEqual(load(bytes(corrupt)), TT_FILE_ERRORS[lib.TT_FILE_CORRUPT])
+
+            # an invalid file given on creation is ignored
+            draft_ai = DraftAI(draft_format, other_rs, [], [], filename)
+            self.assertIsNotNone(draft_ai.last_tt_error)
+            self.assertEqual(draft_ai.run_search([]), DraftAI(draft_format, other_rs, [], []).run_search([]))
+
+
+    @unittest.skipIf(os.name == 'nt', "TT files can't be mapped on Windows")
+    def test_map_tt(self):
+        draft_format = [(A, BAN), (B, BAN), (A, PICK), (B, PICK), (B, PICK), (A, PICK), (A, PICK), (B, PICK)]
+        role_rs = [RoleR(str(hero), hero % 5, (hero * 37) % 1000, (hero * 91) % 1000) for hero in range(20)]
+        draft_ai = DraftAI(draft_format, role_rs, [], [])
+        result = draft_ai.run_search([])
+        search_nodes = draft_ai.last_search_nodes
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            filename = os.path.join(tmp_dir, "tt.bin")
+            self.assertTrue(draft_ai.save_tt(filename))
+            with open(filename, 'rb') as f:
+                data = f.read()
+
+            # searching from a later ban stores states not in the saved TT
+            draft_ai = DraftAI(draft_format, role_rs, [], [])
+            other_result = draft_ai.run_search(['3'])
+            other_nodes = draft_ai.last_search_nodes
+
+            for mode in (TT_MAP_READ_ONLY, TT_MAP_PRIVATE):
+                draft_ai = DraftAI(draft_format, role_rs, [], [], filename, tt_map_mode=mode)
+                self.assertIsNone(draft_ai.last_tt_error)
+                self.assertEqual(draft_ai.run_search([]), result)
+                self.assertLess(draft_ai.last_search_nodes, search_nodes)
+                draft_ai.run_search(['3'])
+                with open(filename, 'rb') as f:
+                    self.assertTrue(f.read() == data)  # nothing written to file
+
+            # saving while mapped privately replaces the file
+            self.assertTrue(draft_ai.save_tt(filename))
+            self.assertTrue(DraftAI(draft_format, role_rs, [], []).load_tt(filename))
+            self.assertEqual(os.listdir(tmp_dir), ["tt.bin"])
+
+            # shared mode writes entries back to the file when saved
+            shared_filename = os.path.join(tmp_dir, "shared_tt.bin")
+            with open(shared_filename, 'wb') as f:
+                f.write(data)
+            draft_ai = DraftAI(draft_format, role_rs, [], [], shared_filename, tt_map_mode=TT_MAP_SHARED)
+            draft_ai.run_search(['3'])
+            self.assertTrue(draft_ai.save_tt(shared_filename))
+            with open(shared_filename, 'rb') as f:
+                self.assertTrue(f.read() != data)
+            draft_ai = DraftAI(draft_format, role_rs, [], [])
+            self.assertTrue(draft_ai.load_tt(shared_filename))  # checksum updated
+            self.assertEqual(draft_ai.run_search(['3']), other_result)
+            self.assertLess(draft_ai.last_search_nodes, other_nodes)
+
+            # mismatched files aren't mapped
+            other_rs = [RoleR(r.hero_name, r.role, r.A_value, r.B_value + 1) for r in role_rs]
+            draft_ai = DraftAI(draft_format, other_rs, [], [])
+            self.assertFalse(draft_ai.map_tt(filename))
+            self.assertEqual(draft_ai.last_tt_error, TT_FILE_ERRORS[lib.TT_FILE_MISMATCH])
+
+    def test_sparse_tt(self):
+        draft_format = [(A, BAN), (B, BAN), (A, PICK), (B, PICK), (B, PICK), (A, PICK), (A, PICK), (B, PICK)]
+        role_rs = [RoleR(str(hero), hero % 5, (hero * 37) % 1000, (hero * 91) % 1000) for hero in range(20)]
+        draft_ai = DraftAI(draft_format, role_rs, [], [])
+        result = draft_ai.run_search([])
+        search_nodes = draft_ai.last_search_nodes
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            dense_filename = os.path.join(tmp_dir, "dense.bin")
+            self.assertTrue(draft_ai.save_tt(dense_filename))
+            dense_size = os.path.getsize(dense_filename)
+
+            sizes = {}
+            for sparse, compression in [(True, None), (False, "gzip"), (False, "lzma")]:
+                filename = os.path.join(tmp_dir, f"{compression}.bin")
+                self.assertTrue(draft_ai.save_tt(filename, sparse, compression))
+                sizes[compression] = os.path.getsize(filename)
+
+                loaded_ai = DraftAI(draft_format, role_rs, [], [], filename)
+                self.assertIsNone(loaded_ai.last_tt_error)
+                self.assertEqual(loaded_ai.run_search([]), result)
+                self.assertLess(loaded_ai.last_search_nodes, search_nodes)
+
+                # can't be mapped but still loaded instead
+                loaded_ai = DraftAI(draft_format, role_rs, [], [], filename, tt_map_mode=TT_MAP_PRIVATE)
+                self.assertIsNone(loaded_ai.last_tt_error)
+                self.assertLess(loaded_ai.last_search_nodes, search_nodes)
+
+            self.assertLess(sizes[None], dense_size)
+            self.assertLess(sizes["gzip"], sizes[None])
+            self.assertLess(sizes["lzma"], sizes[None])
+            with self.assertRaises(ValueError):
+                draft_ai.save_tt(filename, compression="zstd")
+
+            filename = os.path.join(tmp_dir, "gzip.bin")
+            with open(filename, 'rb') as f:
+                data = f.read()
+            bad_filename = os.path.join(tmp_dir, "bad.bin")
+            for bad_data, error in [
+                (data[:len(data) // 2], lib.TT_FILE_TRUNCATED),
+                (data[:-100] + bytes([data[-100] ^ 0xFF]) + data[-99:], lib.TT_FILE_CORRUPT),
+            ]:
+                with open(bad_filename, 'wb') as f:
+                    f.write(bad_data)
+                self.assertFalse(draft_ai.load_tt(bad_filename))
+                self.assertEqual(draft_ai.last_tt_error, TT_FILE_ERRORS[error])
+
+            other_rs = [RoleR(r.hero_name, r.role, r.A_value, r.B_value + 1) for r in role_rs]
+            self.assertFalse(DraftAI(draft_format, other_rs, [], []).load_tt(filename))
+
+    def test_merge_tt(self):
+        draft_format = [(A, BAN), (B, BAN), (A, PICK), (B, PICK), (B, PICK), (A, PICK), (A, PICK), (B, PICK)]
+        role_rs = [RoleR(str(hero), hero % 5, (hero * 37) % 1000, (hero * 91) % 1000) for hero in range(20)]
+        histories = [['3'], ['7']]
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            # save TTs from separate sessions searching different histories
+            results = []
+            filenames = []
+            for i, history in enumerate(histories):
+                draft_ai = DraftAI(draft_format, role_rs, [], [])
+                results.append((draft_ai.run_search(history), draft_ai.last_search_nodes))
+                filenames.append(os.path.join(tmp_dir, f"{i}.bin"))
+                self.assertTrue(draft_ai.save_tt(filenames[-1], compression="gzip" if i else None))
+
+            # merged TT does better than either one for both histories
+            unmerged_nodes = []
+            for filename in filenames:
+                draft_ai = DraftAI(draft_format, role_rs, [], [], filename)
+                unmerged_nodes.append([])
+                for history in histories:
+                    draft_ai.load_tt(filename)
+                    draft_ai.run_search(history)
+                    unmerged_nodes[-1].append(draft_ai.last_search_nodes)
+
+            for load_file, merge_file in [filenames, filenames[::-1]]:
+                draft_ai = DraftAI(draft_format, role_rs, [], [], load_file)
+                self.assertTrue(draft_ai.merge_tt(merge_file))
+                for i, history in enumerate(histories):
+                    draft_ai.load_tt(load_file)
+                    draft_ai.merge_tt(merge_file)
+                    self.assertEqual(draft_ai.run_search(history), results[i][0])
+                    self.assertLess(draft_ai.last_search_nodes, results[i][1])
+                    self.assertLessEqual(draft_ai.last_search_nodes, min(nodes[i] for nodes in unmerged_nodes))
+
+            # can't merge TTs for other rewards or saved with other keys
+            other_rs = [RoleR(r.hero_name, r.role, r.A_value, r.B_value + 1) for r in role_rs]
+            draft_ai = DraftAI(draft_format, other_rs, [], [])
+            self.assertFalse(draft_ai.merge_tt(filenames[0]))
+            self.assertEqual(draft_ai.last_tt_error, TT_FILE_ERRORS[lib.TT_FILE_MISMATCH])
+            draft_ai = DraftAI(draft_format, role_rs, [], [])
+            keys = ffi.new("u64[]", 3 * MAX_NUM_HEROES)
+            lib.get_zobrist_keys(keys)
+            keys[A * MAX_NUM_HEROES] = 1
+            lib.set_zobrist_keys(keys)
+            for filename in filenames:
+                self.assertFalse(draft_ai.merge_tt(filename))
+                self.assertEqual(draft_ai.last_tt_error, TT_FILE_ERRORS[lib.TT_FILE_KEYS_DIFFER])
 
 if __name__ == '__main__':
     unittest.main()
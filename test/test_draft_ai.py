@@ -6,9 +6,13 @@ sys.path.insert(0, dir_path)
 import unittest 
 import itertools
 import random
+import subprocess
+import tempfile
 
 from test.draft_az import draft_az
+from ai import constants
 from ai.draft_ai import *
+from ai.search_cache import SearchCache
 
 INF = 30000
 
@@ -63,6 +67,57 @@ def translate_old_draft(draft):
     return draft.history, new_format, role_rs, synergy_rs, counter_rs
 
 
+# Seeded random rewards for heroes named H0, H1, ... that each play a
+# random number of roles (in the roles_per_hero range). Synergies and
+# counters are between two random heroes in one of their roles.
+def random_rewards(rng, num_heroes, roles_per_hero, num_synergy_rs, num_counter_rs):
+    heroes = [f'H{i}' for i in range(num_heroes)]
+    hero_roles = {h: sorted(rng.sample(ROLES, rng.randint(*roles_per_hero))) for h in heroes}
+    role_rs = [RoleR(h, r, rng.randint(0, 9), rng.randint(0, 9)) for h in heroes for r in hero_roles[h]]
+
+    def combo_heroes(k):
+        return [(h, [rng.choice(hero_roles[h])]) for h in rng.sample(heroes, k)]
+
+    synergy_rs = [SynergyR(combo_heroes(2), rng.randint(1, 9), rng.randint(1, 9))
+                  for _ in range(num_synergy_rs)]
+    counter_rs = [CounterR(*([c] for c in combo_heroes(2)), rng.randint(1, 9), rng.randint(1, 9))
+                  for _ in range(num_counter_rs)]
+    return heroes, hero_roles, role_rs, synergy_rs, counter_rs
+
+
+# All lineups (as dicts of hero name to role) for a team where each
+# hero plays one of its roles and no two heroes share a role.
+def role_lineups(team, hero_roles):
+    return [dict(zip(team, roles)) for roles in itertools.product(*(hero_roles[h] for h in team))
+            if len(set(roles)) == len(team)]
+
+
+# Returns a function giving the value (in A's perspective) of a pair
+# of lineups by brute force over every reward.
+def lineup_evaluator(role_rs, synergy_rs, counter_rs):
+    role_values = {(r.hero_name, r.role): (r.A_value, r.B_value) for r in role_rs}
+
+    def has(lineup, heroes):
+        return all(lineup.get(name) in roles for name, roles in heroes)
+
+    def lineup_value(lineup_A, lineup_B):
+        value = (sum(role_values[h, r][0] for h, r in lineup_A.items())
+                 - sum(role_values[h, r][1] for h, r in lineup_B.items()))
+        for r in synergy_rs:
+            if has(lineup_A, r.heroes):
+                value += r.A_value
+            elif has(lineup_B, r.heroes):
+                value -= r.B_value
+        for r in counter_rs:
+            if has(lineup_A, r.heroes) and has(lineup_B, r.foes):
+                value += r.A_value
+            elif has(lineup_B, r.heroes) and has(lineup_A, r.foes):
+                value -= r.B_value
+        return value
+
+    return lineup_value
+
+
 # Basic alpha-beta search function to work on the old draft simulator.
 # This will take ages to run, but the old simulator is well tested so
 # it can provide good tests for the new bit field C implementation.
@@ -125,7 +180,10 @@ class TestDraftAISearch(unittest.TestCase):
 
     def run_c_search(self, history, draft_format, role_rs, synergy_rs, counter_rs):
         ai = DraftAI(draft_format, role_rs, synergy_rs, counter_rs)
-        return ai.run_search(history)
+        result = ai.run_search(history)
+        # searching again with the TT filled must give the same result
+        self.assertEqual(ai.run_search(history), result)
+        return result
     
     def test_A_last_pick_counter(self):
         role_rs = [
@@ -302,6 +360,124 @@ class TestDraftAISearch(unittest.TestCase):
         self.assertEqual(value, target_value)
         self.assertEqual(action, target_action)
 
+    def test_multi_pv_single_bans(self):
+        # same scenario as test_single_bans
+        random.seed(1)
+        old_draft = draft_az.Draft()
+        scale_rewards(old_draft)
+        old_draft.format = (
+            (draft_az.A, draft_az.PICK),
+            (draft_az.B, draft_az.PICK),
+            (draft_az.B, draft_az.PICK),
+            (draft_az.A, draft_az.PICK),
+            (draft_az.A, draft_az.PICK),
+            (draft_az.B, draft_az.PICK),
+            (draft_az.B, draft_az.BAN),
+            (draft_az.A, draft_az.BAN),
+            (draft_az.B, draft_az.PICK),
+            (draft_az.A, draft_az.PICK),
+            (draft_az.A, draft_az.PICK),
+            (draft_az.B, draft_az.PICK),
+        )
+        for _ in range(6):
+            old_draft.apply(random.choice(old_draft.legal_actions()))
+        history, draft_format, *rewards = translate_old_draft(old_draft)
+
+        ai = DraftAI(draft_format, *rewards)
+        all_actions = ai.run_search(history, multi_pv=ALL_ACTIONS)
+        self.assertEqual(all_actions[0], (-1055, 23))
+        # heroes the enemy can't pick are never worth banning so are skipped
+        heroes = [hero for _, hero in all_actions]
+        self.assertEqual(len(heroes), len(set(heroes)))
+        self.assertTrue(set(heroes) < ai.selectable_heroes(history))
+        self.assertEqual(all_actions, sorted(all_actions, key=lambda a: a[0], reverse=True))
+
+        # value of every ban matches searching from the resulting state
+        for value, hero in all_actions:
+            child_value, _ = self.run_c_search(history + [hero], draft_format, *rewards)
+            self.assertEqual(value, -child_value)
+
+        ai = DraftAI(draft_format, *rewards)
+        top_actions = ai.run_search(history, multi_pv=3)
+        self.assertEqual([a[0] for a in top_actions], [a[0] for a in all_actions[:3]])
+
+    def test_multi_pv_double_picks(self):
+        # same scenario as test_double_picks
+        random.seed(0)
+        old_draft = draft_az.Draft()
+        scale_rewards(old_draft)
+        for _ in range(7):
+            old_draft.apply(random.choice(old_draft.legal_actions()))
+        history, draft_format, *rewards = translate_old_draft(old_draft)
+
+        ai = DraftAI(draft_format, *rewards)
+        all_actions = ai.run_search(history, multi_pv=ALL_ACTIONS)
+        self.assertEqual(all_actions[0][0], 1386)
+        self.assertEqual(set(all_actions[0][1:]), {2, 9})
+
+        # each unordered pair of heroes is only given once
+        pairs = [frozenset(a[1:]) for a in all_actions]
+        self.assertEqual(len(pairs), len(set(pairs)))
+        legal_pairs = {frozenset((hero, hero_2))
+                       for hero in ai.selectable_heroes(history)
+                       for hero_2 in ai.selectable_heroes(history + [hero])}
+        self.assertEqual(set(pairs), legal_pairs)
+
+        for value, hero, hero_2 in all_actions[:5]:
+            child_value, *_ = self.run_c_search(history + [hero, hero_2], draft_format, *rewards)
+            self.assertEqual(value, -child_value)
+
+        ai = DraftAI(draft_format, *rewards)
+        top_actions = ai.run_search(history, multi_pv=5)
+        self.assertEqual([a[0] for a in top_actions], [a[0] for a in all_actions[:5]])
+        self.assertEqual(ai.run_search(history, multi_pv=1)[0][0], 1386)
+
+    def test_principal_variation(self):
+        # same scenario as test_double_picks
+        random.seed(0)
+        old_draft = draft_az.Draft()
+        scale_rewards(old_draft)
+        for _ in range(7):
+            old_draft.apply(random.choice(old_draft.legal_actions()))
+        history, draft_format, *rewards = translate_old_draft(old_draft)
+
+        ai = DraftAI(draft_format, *rewards)
+        (value, *actions), pv = ai.run_search(history, pv=True)
+        self.assertEqual(value, 1386)
+        self.assertEqual([hero for hero, _ in pv[:2]], actions)
+        self.assertEqual(len(history) + len(pv), len(draft_format))
+
+        # following the principal variation keeps the same value (from
+        # the selecting team's perspective) and the expected selections
+        root_team, _ = draft_format[len(history)]
+        for i in range(len(pv)):
+            prefix = history + [hero for hero, _ in pv[:i]]
+            team, selection = draft_format[len(prefix)]
+            self.assertIn(pv[i][0], ai.selectable_heroes(prefix))
+            self.assertEqual(pv[i][1] is None, selection == BAN)
+            if i > 0 and draft_format[len(prefix) - 1][0] == team:
+                continue  # second of a double selection
+            child_value, *_ = self.run_c_search(prefix, draft_format, *rewards)
+            self.assertEqual(child_value, value if team == root_team else -value)
+
+        # and the final draft is worth the value
+        ai = DraftAI(draft_format, *rewards)
+        teams = {A: [], B: []}
+        for (team, selection), hero in zip(draft_format, history + pv):
+            if selection == PICK:
+                name, role = hero if isinstance(hero, tuple) else (hero, ai.hero_roles[hero][0])
+                teams[team].append(ai.hero_nums[(name, role)])
+        final_value = ai.reward_value(teams[A], teams[B])
+        self.assertEqual(final_value, value if root_team == A else -value)
+
+        # multi-PV gives a principal variation for each action
+        ai = DraftAI(draft_format, *rewards)
+        results, pvs = ai.run_search(history, multi_pv=3, pv=True)
+        self.assertEqual(len(results), len(pvs))
+        for (_, *actions), action_pv in zip(results, pvs):
+            self.assertEqual([hero for hero, _ in action_pv[:2]], actions)
+            self.assertEqual(len(history) + len(action_pv), len(draft_format))
+
     def test_double_bans(self):
         random.seed(2)
         old_draft = draft_az.Draft()
@@ -663,6 +839,238 @@ class TestDraftAISearch(unittest.TestCase):
         self.assertTrue((action, action_2) == target_actions 
                         or (action_2, action) == target_actions)
 
+    # Tests that lineups which can never do better than another (see
+    # prune_lineups in draft_ai.c) are removed without changing results,
+    # by comparing with the same rewards minus the dominated roles.
+    def test_flex_dominated_lineups(self):
+        role_rs = [
+            RoleR('Taka', 0, 3, 3),
+            RoleR('Taka', 1, 0, 0),
+            RoleR('Krul', 0, 0, 0),
+            RoleR('Krul', 1, 3, 3),
+            RoleR('Lyra', 0, 0, 0),
+            RoleR('Lyra', 1, 2, 2),
+            RoleR('Reim', 0, 2, 2),
+            RoleR('Reim', 1, 0, 0),
+            RoleR('Rona', 2, 1, 1),
+            RoleR('Gwen', 3, 1, 2),
+            RoleR('Reza', 2, 2, 1),
+            RoleR('Skye', 3, 1, 1),
+            RoleR('Vyra', 4, 1, 3),
+            RoleR('Ozo', 4, 2, 1),
+        ]
+        # no combo rewards for the flex heroes so each team's lineup
+        # with less role value is dominated
+        synergy_rs = [
+            SynergyR([('Rona', [2]), ('Vyra', [4])], 4, 6),
+        ]
+        counter_rs = [
+            CounterR([('Gwen', [3])], [('Ozo', [4])], 5, 3),
+        ]
+        dominated = {('Taka', 1), ('Krul', 0), ('Lyra', 0), ('Reim', 1)}
+        best_role_rs = [r for r in role_rs if (r.hero_name, r.role) not in dominated]
+
+        history = ['Taka', 'Lyra', 'Reim', 'Krul']
+        for h in (history, history + ['Rona'], history + ['Gwen']):
+            target = self.run_c_search(h, SIMPLE_FORMAT, best_role_rs, synergy_rs, counter_rs)
+            result = self.run_c_search(h, SIMPLE_FORMAT, role_rs, synergy_rs, counter_rs)
+            self.assertEqual(result, target)
+
+    # Tests that role hints give the same results as searching with the
+    # rewards of the roles they rule out removed.
+    def test_role_hints(self):
+        role_rs = [
+            RoleR('Taka', 0, 3, 3),
+            RoleR('Taka', 1, 0, 0),
+            RoleR('Krul', 0, 0, 0),
+            RoleR('Krul', 1, 3, 3),
+            RoleR('Krul', 2, 1, 2),
+            RoleR('Lyra', 0, 0, 0),
+            RoleR('Lyra', 1, 2, 2),
+            RoleR('Reim', 0, 2, 2),
+            RoleR('Reim', 1, 0, 0),
+            RoleR('Rona', 2, 1, 1),
+            RoleR('Gwen', 3, 1, 2),
+            RoleR('Reza', 2, 2, 1),
+            RoleR('Skye', 3, 1, 1),
+            RoleR('Vyra', 4, 1, 3),
+            RoleR('Ozo', 4, 2, 1),
+        ]
+        synergy_rs = [
+            SynergyR([('Krul', [1]), ('Skye', [3])], 4, 6),
+        ]
+        counter_rs = [
+            CounterR([('Taka', [1])], [('Lyra', [0])], 5, 3),
+            CounterR([('Reim', [0])], [('Krul', [2])], 2, 4),
+        ]
+        roles = {'Taka': 1, 'Krul': [1, 2], 'Reim': [0]}
+        ruled_out = {('Taka', 0), ('Krul', 0), ('Reim', 1)}
+        hinted_role_rs = [r for r in role_rs if (r.hero_name, r.role) not in ruled_out]
+
+        history = ['Taka', 'Lyra', 'Reim', 'Krul']
+        for h in (history, history + ['Vyra'], history + ['Skye', 'Gwen']):
+            target = DraftAI(SIMPLE_FORMAT, hinted_role_rs, synergy_rs, counter_rs).run_search(h, pv=True)
+            ai = DraftAI(SIMPLE_FORMAT, role_rs, synergy_rs, counter_rs)
+            self.assertEqual(ai.run_search(h, pv=True, roles=roles), target)
+
+        # only picked heroes in roles they can play can be given
+        with self.assertRaises(ValueError):
+            ai.run_search(history, roles={'Rona': 2})
+        with self.assertRaises(ValueError):
+            ai.run_search(history, roles={'Taka': [1, 2]})
+        with self.assertRaises(ValueError):
+            ai.run_search(history, roles={'Lyra': 0, 'Reim': 0})  # role clash
+
+    def test_run_search_batch(self):
+        rng = random.Random(13)
+        _, _, role_rs, synergy_rs, counter_rs = random_rewards(rng, 14, (1, 2), 6, 6)
+
+        # every stage of a draft (covering both teams and searches
+        # run alongside each other and split at the root)
+        ai = DraftAI(SIMPLE_FORMAT, role_rs, synergy_rs, counter_rs)
+        draft = []
+        while len(draft) < len(SIMPLE_FORMAT) - 1:
+            draft.append(rng.choice(sorted(ai.selectable_heroes(draft))))
+        histories = [draft[:i] for i in range(len(draft) + 1)]
+        results = ai.run_search_batch(histories)
+        self.assertEqual(len(results), len(histories))
+
+        for history, result in zip(histories, results):
+            target = DraftAI(SIMPLE_FORMAT, role_rs, synergy_rs, counter_rs).run_search(history)
+            self.assertEqual(result[0], target[0])
+            self.assertIn(result[1], ai.selectable_heroes(history))
+
+        # cached results are returned without searching
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            cache = SearchCache(os.path.join(tmp_dir, 'results.sqlite'))
+            ai = DraftAI(SIMPLE_FORMAT, role_rs, synergy_rs, counter_rs, results_cache=cache)
+            cached = ai.run_search(histories[-1])
+            self.assertEqual(ai.run_search_batch([histories[-1]]), [cached])
+            self.assertEqual(ai.last_search_nodes, 0)
+            self.assertEqual(ai.run_search_batch([]), [])
+            cache.close()
+
+    # Tests a last pick where both teams have heroes that play every
+    # role so each has the most possible lineups (MAX_LINEUPS in
+    # draft_ai.h), checking the value against every lineup vs lineup.
+    def test_max_lineups(self):
+        rng = random.Random(5)
+        heroes = [f'H{i}' for i in range(11)]
+        role_rs = [RoleR(h, r, rng.randint(0, 9), rng.randint(0, 9)) for h in heroes for r in ROLES]
+        synergy_rs = [
+            SynergyR([('H0', [0]), ('H3', [1])], 5, 5),
+            SynergyR([('H6', [2]), ('H8', [3])], 5, 5),
+        ]
+        counter_rs = [
+            CounterR([('H5', [0])], [('H0', [1])], 7, 6),
+            CounterR([('H2', [3])], [('H9', [4])], 8, 4),
+        ]
+        history = ['H0', 'H5', 'H6', 'H1', 'H2', 'H7', 'H8', 'H3', 'H4']
+        team_A = ['H0', 'H1', 'H2', 'H3', 'H4']
+        team_B = ['H5', 'H6', 'H7', 'H8']
+
+        hero_roles = {h: ROLES for h in heroes}
+        lineup_value = lineup_evaluator(role_rs, synergy_rs, counter_rs)
+
+        def lineups(team):
+            return role_lineups(team, hero_roles)
+
+        # B is selecting so gets its best guaranteed value (see the
+        # terminal values in flex_negamax)
+        self.assertEqual(len(lineups(team_A)), 120)
+        target_value = max(
+            -min(max(lineup_value(a, b) for a in lineups(team_A)) for b in lineups(team_B + [hero]))
+            for hero in ('H9', 'H10')
+        )
+
+        value, _ = self.run_c_search(history, SIMPLE_FORMAT, role_rs, synergy_rs, counter_rs)
+        self.assertEqual(value, target_value)
+
+    # Checks the terminal values of multi-lineup leaves (where synergies
+    # are found per lineup and counters per pair of lineups) against a
+    # brute force over every lineup, with combos that depend on the
+    # roles played. The team selecting at the root takes the last pick
+    # (for A also leaving B's last pick) and gets its best guaranteed
+    # value over the lineups of both teams.
+    def check_multilineup_leaf_values(self, seed, num_heroes, root_team):
+        heroes, hero_roles, role_rs, synergy_rs, counter_rs = random_rewards(
+            random.Random(seed), num_heroes, (2, 3), 6, 10
+        )
+        if root_team == A:
+            history = ['H0', 'H1', 'H2', 'H3', 'H4', 'H5', 'H6', 'H7']
+            team_A = ['H0', 'H3', 'H4', 'H7']
+        else:
+            history = ['H0', 'H1', 'H2', 'H3', 'H4', 'H5', 'H6', 'H7', 'H8']
+            team_A = ['H0', 'H3', 'H4', 'H7', 'H8']
+        team_B = ['H1', 'H2', 'H5', 'H6']
+        left = heroes[len(history):]
+        lineup_value = lineup_evaluator(role_rs, synergy_rs, counter_rs)
+
+        def lineups(team):
+            return role_lineups(team, hero_roles)
+
+        def leaf_value(team_A, team_B):
+            # root team's best guaranteed value (in its perspective)
+            lineups_A, lineups_B = lineups(team_A), lineups(team_B)
+            if not lineups_A or not lineups_B:
+                return None
+            if root_team == A:
+                return max(min(lineup_value(a, b) for b in lineups_B) for a in lineups_A)
+            return max(min(-lineup_value(a, b) for a in lineups_A) for b in lineups_B)
+
+        if root_team == A:
+            target_value = max(
+                min(v for v in (leaf_value(team_A + [a], team_B + [b]) for b in left if b != a) if v is not None)
+                for a in left
+                if any(leaf_value(team_A + [a], team_B + [b]) is not None for b in left if b != a)
+            )
+        else:
+            self.assertGreater(len(lineups(team_A)), 1)
+            target_value = max(v for v in (leaf_value(team_A, team_B + [b]) for b in left) if v is not None)
+
+        value, _ = self.run_c_search(history, SIMPLE_FORMAT, role_rs, synergy_rs, counter_rs)
+        self.assertEqual(value, target_value)
+
+    def test_multilineup_leaf_values_A(self):
+        self.check_multilineup_leaf_values(7, 12, A)
+
+    def test_multilineup_leaf_values_B(self):
+        self.check_multilineup_leaf_values(12, 14, B)
+
+    # Tests that states with multiple lineups cached in the TT (see
+    # flex_hash in draft_ai.c) give the same values as a fresh search
+    # when searching from each stage onwards with the same TT.
+    def test_flex_tt(self):
+        random.seed(6)
+        old_draft = draft_az.Draft()
+        scale_rewards(old_draft)
+        old_draft.format = (
+            (draft_az.A, draft_az.PICK),
+            (draft_az.B, draft_az.PICK),
+            (draft_az.B, draft_az.PICK),
+            (draft_az.A, draft_az.PICK),
+            (draft_az.A, draft_az.PICK),  # starting from here
+            (draft_az.B, draft_az.PICK),
+            (draft_az.B, draft_az.BAN),
+            (draft_az.A, draft_az.BAN),
+            (draft_az.B, draft_az.PICK),
+            (draft_az.A, draft_az.PICK),
+            (draft_az.A, draft_az.PICK),
+            (draft_az.B, draft_az.PICK),
+        )
+        old_draft.apply(1)   # roles: 1, 2, 3
+        old_draft.apply(39)  # roles: 1, 2, 3
+        old_draft.apply(43)  # roles: 3, 4
+        old_draft.apply(20)  # roles: 2, 4
+        history, draft_format, *rewards = translate_old_draft(old_draft)
+        _, pv = DraftAI(draft_format, *rewards).run_search(history, pv=True)
+        histories = [history + [hero for hero, _ in pv[:i]] for i in range(len(pv))]
+
+        values = [DraftAI(draft_format, *rewards).run_search(h)[0] for h in histories]
+        ai = DraftAI(draft_format, *rewards)
+        for h, value in zip(histories + histories[::-1], values + values[::-1]):
+            self.assertEqual(ai.run_search(h)[0], value)
+
     def test_multilineup_terminal_value_B(self):
         random.seed(9)
         old_draft = draft_az.Draft()
@@ -805,6 +1213,111 @@ class TestDraftAISearch(unittest.TestCase):
         self.assertEqual(value_s, target_value_s, "after initial switch")
         self.assertEqual(action_s, target_action_s, "after initial switch")
 
+    def test_switch_sides(self):
+        random.seed(12)
+        old_draft = draft_az.Draft()
+        scale_rewards(old_draft)
+        old_draft.format = (
+            (draft_az.A, draft_az.PICK),
+            (draft_az.B, draft_az.PICK),
+            (draft_az.B, draft_az.PICK),
+            (draft_az.A, draft_az.PICK),
+            (draft_az.A, draft_az.PICK),  # starting from here
+            (draft_az.B, draft_az.PICK),
+            (draft_az.B, draft_az.PICK),
+            (draft_az.A, draft_az.PICK),
+            (draft_az.A, draft_az.PICK),
+            (draft_az.B, draft_az.PICK),
+        )
+        for _ in range(4):
+            old_draft.apply(random.choice(old_draft.legal_actions()))
+
+        history, draft_format, *rewards = translate_old_draft(old_draft)
+        switched_rewards = [[r._replace(A_value=r.B_value, B_value=r.A_value) for r in rs]
+                            for rs in rewards]
+        switched_result = DraftAI(draft_format, *switched_rewards).run_search(history)
+
+        ai = DraftAI(draft_format, *rewards)
+        result = ai.run_search(history)
+        nodes = ai.last_search_nodes
+
+        ai.switch_sides()
+        self.assertEqual(ai.run_search(history), switched_result)
+        self.assertEqual(ai.fingerprint, DraftAI(draft_format, *switched_rewards).fingerprint)
+
+        # entries from before the switch are still in the TT
+        ai = DraftAI(draft_format, *rewards)
+        ai.run_search(history)
+        ai.switch_sides()
+        ai.run_search(history)
+        ai.switch_sides()
+        self.assertEqual(ai.run_search(history), result)
+        self.assertLess(ai.last_search_nodes, nodes)
+
+    def test_update_rewards(self):
+        random.seed(13)
+        old_draft = draft_az.Draft()
+        scale_rewards(old_draft)
+        old_draft.format = (
+            (draft_az.A, draft_az.PICK),
+            (draft_az.B, draft_az.PICK),
+            (draft_az.B, draft_az.PICK),
+            (draft_az.A, draft_az.PICK),
+            (draft_az.A, draft_az.PICK),  # starting from here
+            (draft_az.B, draft_az.PICK),
+            (draft_az.B, draft_az.PICK),
+            (draft_az.A, draft_az.PICK),
+            (draft_az.A, draft_az.PICK),
+            (draft_az.B, draft_az.PICK),
+        )
+        for _ in range(4):
+            old_draft.apply(random.choice(old_draft.legal_actions()))
+        history, draft_format, role_rs, synergy_rs, counter_rs = translate_old_draft(old_draft)
+
+        def switched(rewards):
+            return [[r._replace(A_value=r.B_value, B_value=r.A_value) for r in rs] for rs in rewards]
+
+        # updates with the rewards expected after each (constructing a
+        # DraftAI clears the TT so all are searched before any updates)
+        changed = [r._replace(A_value=1000 - r.A_value) for r in role_rs + synergy_rs[:1]]
+        added_counter_r = counter_rs[1]._replace(A_value=5)
+        new_hero = RoleR(max(r.hero_name for r in role_rs) + 1, role_rs[0].role, 500, 500)
+        updates = [
+            # changing and removing rewards keeps the (widened) TT
+            (dict(changed=changed), True, False,
+             (changed[:len(role_rs)], changed[len(role_rs):] + synergy_rs[1:], counter_rs)),
+            (dict(removed=counter_rs[:1]), True, False,
+             (changed[:len(role_rs)], changed[len(role_rs):] + synergy_rs[1:], counter_rs[1:])),
+            # rewards are given as they were at construction if sides are switched
+            (dict(added=[added_counter_r], removed=counter_rs[1:2]), True, True,
+             (changed[:len(role_rs)], changed[len(role_rs):] + synergy_rs[1:],
+              [added_counter_r] + counter_rs[2:])),
+            # new heroes clear the TT
+            (dict(added=[new_hero]), False, True,
+             (changed[:len(role_rs)] + [new_hero], changed[len(role_rs):] + synergy_rs[1:],
+              [added_counter_r] + counter_rs[2:])),
+        ]
+        expected = []
+        for _, _, sides_switched, rewards in updates:
+            new_ai = DraftAI(draft_format, *(switched(rewards) if sides_switched else rewards))
+            expected.append((new_ai.fingerprint, new_ai.run_search(history)[0]))
+
+        ai = DraftAI(draft_format, role_rs, synergy_rs, counter_rs)
+        ai.run_search(history)
+        for (kwargs, keeps_tt, sides_switched, _), (fingerprint, value) in zip(updates, expected):
+            if sides_switched != ai.sides_switched:
+                ai.switch_sides()
+            self.assertEqual(ai.update_rewards(**kwargs), keeps_tt)
+            self.assertEqual(ai.fingerprint, fingerprint)
+            self.assertEqual(ai.run_search(history)[0], value)
+
+        # nothing changes for invalid updates
+        self.assertRaises(ValueError, ai.update_rewards, removed=counter_rs[:1])
+        self.assertRaises(ValueError, ai.update_rewards, added=synergy_rs[1:2])
+        self.assertRaises(ValueError, ai.update_rewards, changed=[new_hero._replace(A_value=-1)])
+        self.assertEqual(ai.fingerprint, fingerprint)
+        self.assertEqual(ai.run_search(history)[0], value)
+
     # Tests that the correct terminal value is returned for an A pick in
     # a situation where the value doesn't converge.
     def test_both_teams_flex_with_counter_terminal_value_A(self):
@@ -917,6 +1430,41 @@ class TestDraftAISearch(unittest.TestCase):
         self.assertEqual(value, -6)
         self.assertEqual(action, 'Ozo')
 
+    # Tests that TT entries for states with multiple lineups are kept
+    # separate for each root selecting team, as a non-converging terminal
+    # value (see above tests) depends on which team is searching.
+    def test_flex_tt_root_team(self):
+        role_rs = [
+            RoleR('Taka', 0, 3, 3),
+            RoleR('Taka', 1, 0, 0),
+            RoleR('Krul', 0, 0, 0),
+            RoleR('Krul', 1, 3, 3),
+            RoleR('Lyra', 0, 2, 2),
+            RoleR('Lyra', 1, 0, 0),
+            RoleR('Reim', 0, 0, 0),
+            RoleR('Reim', 1, 2, 2),
+            RoleR('Rona', 2, 1, 1),
+            RoleR('Gwen', 3, 1, 1),
+            RoleR('Reza', 2, 1, 1),
+            RoleR('Skye', 3, 1, 1),
+            RoleR('Vyra', 4, 1, 1),
+            RoleR('Ozo', 4, 1, 1),
+        ]
+        counter_rs = [
+            CounterR([('Taka', [1])], [('Lyra', [0])], 20, 20),
+        ]
+        # alternating picks so the same states are searched by both teams
+        draft_format = [(A, PICK), (B, PICK)] * 5
+        history = ['Taka', 'Lyra', 'Krul', 'Reim']
+        _, pv = DraftAI(draft_format, role_rs, [], counter_rs).run_search(history, pv=True)
+        histories = [history + [hero for hero, _ in pv[:i]] for i in range(len(pv))]
+
+        values = [DraftAI(draft_format, role_rs, [], counter_rs).run_search(h)[0] for h in histories]
+        self.assertEqual(values, [2, -6, 2, -6, 2, -6])
+        ai = DraftAI(draft_format, role_rs, [], counter_rs)
+        for h, value in zip(histories, values):
+            self.assertEqual(ai.run_search(h)[0], value)
+
 
 class TestDraftAIMisc(unittest.TestCase):
 
@@ -997,6 +1545,207 @@ class TestDraftAIMisc(unittest.TestCase):
         correct_asgmt = ([('Taka', 0), ('Krul', 1)], [('Lyra', 1), ('Reim', 0)])
         self.assertEqual(correct_asgmt, draft_ai.optimal_role_asgmts(history, B))
 
+    # Tests the engine's lineup values against summing the AI rewards
+    # granted to each pair of lineups, from both sides.
+    def test_lineup_values(self):
+        heroes, _, role_rs, synergy_rs, counter_rs = random_rewards(random.Random(3), 10, (2, 3), 5, 8)
+        draft_ai = DraftAI(SIMPLE_FORMAT, role_rs, synergy_rs, counter_rs)
+
+        def reward_value(team_A, team_B):
+            value = sum(draft_ai.ordered_heroes[h].A_role_value for h in team_A)
+            value -= sum(draft_ai.ordered_heroes[h].B_role_value for h in team_B)
+            for synergy_hs, A_value, B_value in draft_ai.ai_synergy_rs:
+                if set(synergy_hs) <= set(team_A):
+                    value += A_value
+                elif set(synergy_hs) <= set(team_B):
+                    value -= B_value
+            for counter_hs, counter_fs, A_value, B_value in draft_ai.ai_counter_rs:
+                if set(counter_hs) <= set(team_A) and set(counter_fs) <= set(team_B):
+                    value += A_value
+                elif set(counter_hs) <= set(team_B) and set(counter_fs) <= set(team_A):
+                    value -= B_value
+            return value
+
+        def lineups(names):
+            return [draft_ai.get_hero_nums(names, roles) for roles in draft_ai.valid_role_asgmts(names)]
+
+        teams_A = lineups(heroes[:5])
+        teams_B = lineups(heroes[5:])
+        self.assertGreater(len(teams_A) * len(teams_B), 1)
+        for switch in (False, True):
+            if switch:
+                draft_ai.switch_sides()
+            values = draft_ai.lineup_values(teams_A, teams_B)
+            target = [[reward_value(a, b) for b in teams_B] for a in teams_A]
+            self.assertEqual(values, target)
+            self.assertEqual(draft_ai.reward_value(teams_A[-1], teams_B[0]), target[-1][0])
+
+    def test_ponder(self):
+        # same scenario as test_double_picks with B's double pick next
+        random.seed(0)
+        old_draft = draft_az.Draft()
+        scale_rewards(old_draft)
+        for _ in range(7):
+            old_draft.apply(random.choice(old_draft.legal_actions()))
+        history, draft_format, *rewards = translate_old_draft(old_draft)
+
+        ai = DraftAI(draft_format, *rewards, ponder_replies=3)
+        (value, hero, hero_2), pv = ai.run_search(history, pv=True)
+        history = history + [hero, hero_2]
+        replies = ai._likely_replies(history, pv[2:])
+        self.assertEqual(len(replies), 3)
+        self.assertEqual(set(replies[0]), {h for h, _ in pv[2:4]})
+        wait_for_pondering()
+
+        # all likely replies are answered without searching (in either
+        # order as B has a double pick) and match a normal search
+        for reply in replies:
+            for reply_history in (history + list(reply), history + list(reply[::-1])):
+                ai = DraftAI(draft_format, *rewards)
+                target = ai.run_search(reply_history)
+
+                ai = DraftAI(draft_format, *rewards, ponder_replies=3)
+                ai.ponder(history, pv[2:])
+                wait_for_pondering()
+                self.assertEqual(ai.run_search(reply_history)[0], target[0])
+                self.assertEqual(ai.last_search_nodes, 0)
+
+        # any other reply is searched as usual
+        ai.ponder(history, pv[2:])
+        other = [h for h in ai.selectable_heroes(history) if h not in replies[0]][:2]
+        ai.run_search(history + other)
+        self.assertGreater(ai.last_search_nodes, 0)
+
+    def test_stop_pondering(self):
+        random.seed(0)
+        old_draft = draft_az.Draft()
+        scale_rewards(old_draft)
+        history, draft_format, *rewards = translate_old_draft(old_draft)
+
+        # background searches from the start of the draft take a while
+        # so creating a new DraftAI must stop them without storing values
+        ai = DraftAI(draft_format, *rewards, ponder_replies=10)
+        ai.ponder(history)
+        ai = DraftAI(draft_format, *rewards)
+        self.assertEqual(ai._ponder_results, {})
+
+        for _ in range(8):
+            old_draft.apply(random.choice(old_draft.legal_actions()))
+        history = old_draft.history
+        target = ai.run_search(history)
+        ai = DraftAI(draft_format, *rewards, ponder_replies=10)
+        ai.ponder([])
+        self.assertEqual(ai.run_search(history), target)
+
+    # Saving, loading, merging and mapping the TT must first stop any
+    # background search that could still be using it.
+    def test_tt_files_stop_pondering(self):
+        random.seed(0)
+        old_draft = draft_az.Draft()
+        scale_rewards(old_draft)
+        history, draft_format, *rewards = translate_old_draft(old_draft)
+        for _ in range(8):
+            old_draft.apply(random.choice(old_draft.legal_actions()))
+        target = DraftAI(draft_format, *rewards).run_search(old_draft.history)
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            filename = os.path.join(tmp_dir, 'tt.bin')
+            ai = DraftAI(draft_format, *rewards, ponder_replies=10)
+            ai.ponder(history)
+            self.assertTrue(ai.save_tt(filename))
+            self.assertEqual(ai._ponder_results, {})
+
+            for load in (ai.load_tt, ai.merge_tt, ai.map_tt):
+                ai.ponder(history)
+                self.assertTrue(load(filename))
+                self.assertEqual(ai.run_search(old_draft.history), target)
+
+    def test_results_cache(self):
+        random.seed(0)
+        old_draft = draft_az.Draft()
+        scale_rewards(old_draft)
+        for _ in range(7):
+            old_draft.apply(random.choice(old_draft.legal_actions()))
+        history, draft_format, role_rs, synergy_rs, counter_rs = translate_old_draft(old_draft)
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            filename = os.path.join(tmp_dir, 'results.sqlite')
+            ai = DraftAI(draft_format, role_rs, synergy_rs, counter_rs,
+                         results_cache=SearchCache(filename))
+            target = ai.run_search(history, pv=True)
+            self.assertGreater(ai.last_search_nodes, 0)
+            target_all = ai.run_search(history, multi_pv=ALL_ACTIONS)
+            ai.results_cache.close()
+
+            # reward order doesn't change the fingerprint so results
+            # are found without searching
+            ai = DraftAI(draft_format, role_rs[::-1], synergy_rs[::-1], counter_rs,
+                         results_cache=SearchCache(filename))
+            self.assertEqual(ai.run_search(history, pv=True), target)
+            self.assertEqual(ai.run_search(history), target[0])
+            self.assertEqual(ai.run_search(history, multi_pv=ALL_ACTIONS), target_all)
+            self.assertEqual(ai.last_search_nodes, 0)
+
+            # but different reward values (such as switching sides) do
+            switched_role_rs = [RoleR(r.hero_name, r.role, r.B_value, r.A_value) for r in role_rs]
+            ai = DraftAI(draft_format, switched_role_rs, synergy_rs, counter_rs,
+                         results_cache=ai.results_cache)
+            ai.run_search(history)
+            self.assertGreater(ai.last_search_nodes, 0)
+            ai.results_cache.close()
+
+    def test_perft_matches_unique_drafts(self):
+        role_rs = [RoleR(name, r % 5, 0, 0) for r, name in
+                   enumerate(['Taka', 'Rona', 'Krul', 'Lyra', 'Reim', 'Skye'])]
+        draft_format = [(A, BAN), (B, BAN), (A, PICK), (B, PICK)]
+        draft_ai = DraftAI(draft_format, role_rs, [], [])
+
+        self.assertEqual([1, 6, 30, 120, 360], draft_ai.perft([], 4))
+        self.assertEqual(draft_ai.num_unique_drafts([]), draft_ai.perft([], 4)[-1])
+        self.assertEqual([1, 4, 12], draft_ai.perft(['Taka', 'Lyra'], 2))
+        self.assertEqual([1, 5], draft_ai.perft(['Taka'], 1))
+
+    def test_perft_double_pick(self):
+        role_rs = [RoleR(name, r, 0, 0) for r, name in
+                   enumerate(['Taka', 'Rona', 'Krul', 'Lyra', 'Reim'])]
+        draft_format = [(A, PICK), (B, PICK), (B, PICK)]
+        draft_ai = DraftAI(draft_format, role_rs, [], [])
+
+        # The intermediate state after B's first pick is counted but
+        # the order of the two picks is irrelevant so only half of the
+        # drafts are unique.
+        self.assertEqual([1, 5, 20, 30], draft_ai.perft([], 3))
+        self.assertEqual(draft_ai.num_unique_drafts([]) // 2, draft_ai.perft([], 3)[-1])
+
+    def test_perft_role_clash(self):
+        role_rs = [
+            RoleR('Taka', 0, 0, 0),
+            RoleR('Rona', 0, 0, 0),
+            RoleR('Krul', 1, 0, 0),
+        ]
+        draft_format = [(A, PICK), (B, PICK), (A, PICK)]
+        draft_ai = DraftAI(draft_format, role_rs, [], [])
+
+        # A can never finish with both role 0 heroes, so only 4 of the
+        # 6 orderings reach the end.
+        self.assertEqual([1, 3, 6, 4], draft_ai.perft([], 3))
+        self.assertEqual([1, 3, 6, 4], draft_ai.perft([], 10))
+
+    def test_lazy_engine(self):
+        # engine isn't loaded on import
+        code = "import sys, ai.draft_ai; print('ai._draft_ai' in sys.modules)"
+        out = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True,
+                             env=dict(os.environ, PYTHONPATH=dir_path))
+        self.assertEqual(out.stdout.strip(), 'False')
+
+        # mirrored constants are checked against the engine's
+        constants.check_constants(lib)
+        try:
+            constants.INF += 1
+            self.assertRaises(RuntimeError, constants.check_constants, lib)
+        finally:
+            constants.INF -= 1
+
 
 if __name__ == '__main__':
     unittest.main()